@@ -31,6 +31,8 @@ sys.path.append(os.path.join(root, 'utils'))
 import pyximport; pyximport.install()
 from ellipse_2D_cython import project_2D_Ellipse_arrays_cython
 from ellipse_2D_cython_new import project_2D_Ellipse_arrays_cython_test
+from ellipse_2D_cython_new import project_2D_Ellipse_arrays_cython_newton
+from ellipse_2D_cython_new import project_2D_Ellipse_arrays_cython_parallel
 
 import io_utils
 import duck_3D
@@ -44,9 +46,15 @@ def parse_cmdline_args(default_config='ellipse_projections.ini'):
                         help="file name of the output *.h5 file to edit / create")
     parser.add_argument('-c', '--config', type=str, \
                         help="file name of the configuration file")
+    parser.add_argument('-b', '--benchmark', type=int, \
+                        help="time and compare the bisection and Newton projections for this many random points then exit")
     
     args = parser.parse_args()
     
+    # the benchmark does not need a config or output file
+    if args.benchmark is not None :
+        return args, None
+    
     # if config is non then read the default from the *.h5 dir
     if args.config is None :
         args.config = os.path.join(os.path.split(args.filename)[0], default_config)
@@ -74,11 +82,59 @@ def parse_cmdline_args(default_config='ellipse_projections.ini'):
     
     return args, params
 
+def benchmark(N, seed = 1):
+    """
+    Time the bisection and Newton ellipse projections for N 
+    random (x, y, Wx, Wy, I) and print the differences between them.
+    
+    The points are scattered both inside and outside of the ellipses
+    and the weightings span a few orders of magnitude. 
+    """
+    import time
+    np.random.seed(seed)
+    x    = np.random.random(N) * 8. - 4.
+    y    = np.random.random(N) * 8. - 4.
+    Wx   = 10**(np.random.random(N) * 3. - 2.)
+    Wy   = 10**(np.random.random(N) * 3. - 2.)
+    I    = np.random.random(N) * 3.
+    mask = np.ones((N,), dtype=np.uint8)
+    
+    d0 = time.time()
+    xp_b, yp_b = project_2D_Ellipse_arrays_cython_test(x, y, Wx, Wy, I, mask)
+    d1 = time.time()
+    xp_n, yp_n = project_2D_Ellipse_arrays_cython_newton(x, y, Wx, Wy, I, mask)
+    d2 = time.time()
+    
+    t, t, its_b = project_2D_Ellipse_arrays_cython_parallel(x, y, Wx, Wy, I, mask, 1, 0)
+    t, t, its_n = project_2D_Ellipse_arrays_cython_parallel(x, y, Wx, Wy, I, mask, 1, 1)
+    
+    # relative distance between the bisection and newton solutions
+    r    = np.sqrt(xp_b**2 + yp_b**2) + 1.0e-10
+    diff = np.sqrt((xp_b - xp_n)**2 + (yp_b - yp_n)**2) / r
+    
+    # relative error: Wx xp**2 + Wy yp**2 = I
+    err_b = np.abs(Wx * xp_b**2 + Wy * yp_b**2 - I) / (I + 1.0e-10)
+    err_n = np.abs(Wx * xp_n**2 + Wy * yp_n**2 - I) / (I + 1.0e-10)
+    
+    print('number of points            :', N)
+    print('bisection time         (s)  :', d1-d0)
+    print('newton    time         (s)  :', d2-d1)
+    print('speedup                     :', (d1-d0)/(d2-d1))
+    print('bisection iterations mean / max:', np.mean(its_b), np.max(its_b))
+    print('newton    iterations mean / max:', np.mean(its_n), np.max(its_n))
+    print('max relative difference     :', np.max(diff))
+    print('max ellipse error bisection :', np.max(err_b))
+    print('max ellipse error newton    :', np.max(err_n))
+    return diff, err_b, err_n
 
 
 if __name__ == '__main__':
     args, params = parse_cmdline_args()
     
+    if args.benchmark is not None :
+        benchmark(args.benchmark)
+        sys.exit()
+    
     # make the input
     Wx = np.array([params['wx']])
     Wy = np.array([params['wy']])
@@ -59,6 +59,88 @@ def parse_cmdline_args(default_config='forward_model.ini'):
     
     return args, params
 
+def copy_config(config, outputdir):
+    try :
+        import shutil
+        shutil.copy(config, outputdir)
+    except Exception as e :
+        print(e)
+
+def parse_sweep(v):
+    """
+    Parse the values of a sweep_* parameter, e.g. '0.5, 1.0, None' 
+    --> [0.5, 1.0, None]
+    """
+    if v is None :
+        return None
+    
+    if hasattr(v, 'split') :
+        out = []
+        for x in v.split(','):
+            x = x.strip()
+            if x == 'None' :
+                out.append(None)
+                continue
+            try :
+                out.append(int(x))
+            except ValueError :
+                out.append(float(x))
+        return out
+    
+    return list(np.atleast_1d(v))
+
+def write_sweep(fnam, solid_unit, unit_cell, grid, processes = None, seed = None, **params):
+    """
+    Simulate every combination of the values in grid with 
+    forward_sim.sweep_diff and write each grid point to 
+    /forward_model/sweep/<index> in fnam. The grid independent 
+    arrays (solid_unit, crystal, unit_cell) are written once to 
+    /forward_model/sweep.
+    """
+    cache, results = forward_sim.sweep_diff(solid_unit, unit_cell, grid, processes = processes, 
+                                            seed = seed, **params)
+    
+    f = h5py.File(fnam, 'a')
+    
+    group = '/forward_model/sweep'
+    if group in f :
+        del f[group]
+    g = f.create_group(group)
+    
+    g['solid_unit'] = solid_unit
+    g['crystal']    = cache['crystal']
+    g['unit_cell']  = cache['unit_cell']
+    g.attrs['keys'] = np.array(sorted(grid.keys()), dtype=np.string_)
+    
+    # the constraint ratio only depends on the support
+    omegas = {}
+    
+    for index, point, diff, info in results :
+        key = group + '/%05d' % index
+        print('\nwriting sweep point:', key, point)
+        
+        support_frac = point.get('support_frac', params.get('support_frac', None))
+        if support_frac not in omegas :
+            omegas[support_frac] = calculate_constraint_ratio(info['support'], params['space_group'], unit_cell)
+        info['omega_continuous'], info['omega_Bragg'], info['omega_global'] = omegas[support_frac]
+        
+        gp = f.create_group(key)
+        for k, v in point.items():
+            gp.attrs[k] = 'None' if v is None else v
+        
+        gp['data'] = diff
+        for k, v in info.items():
+            if v is None :
+                continue 
+            try :
+                gp[k] = v
+            except Exception as e :
+                print('could not write:', key + '/' + k, ':', e)
+        
+        f.flush()
+    
+    f.close()
+
 
 if __name__ == '__main__':
     args, params = parse_cmdline_args()
@@ -107,6 +189,22 @@ if __name__ == '__main__':
     del params['sigma']
     del params['solid_unit']
     
+    # parameter sweep
+    #################
+    grid = {}
+    for k in ['n', 'sigma', 'photons', 'support_frac'] :
+        v = parse_sweep(params.pop('sweep_' + k, None))
+        if v is not None :
+            grid[k] = v
+    processes = params.pop('processes', None)
+    seed      = params.pop('seed', None)
+    
+    if len(grid) > 0 :
+        write_sweep(fnam, solid_unit, unit_cell, grid, processes = processes, seed = seed, 
+                    n = N, sigma = sigma, **params)
+        copy_config(args.config, os.path.split(os.path.abspath(fnam))[0])
+        sys.exit()
+    
     # calculate the diffraction data and metadata
     #############################################
     diff, info = forward_sim.generate_diff(solid_unit, unit_cell, N, sigma, **params)
@@ -164,8 +262,4 @@ if __name__ == '__main__':
     
     # copy the config file
     ######################
-    try :
-        import shutil
-        shutil.copy(args.config, outputdir)
-    except Exception as e :
-        print(e)
+    copy_config(args.config, outputdir)
@@ -19,8 +19,10 @@ except ImportError :
 import numpy as np
 import h5py 
 import argparse
+import multiprocessing
 import os, sys
 import re
+import time
 
 # import python modules using the relative directory 
 # locations this way the repository can be anywhere 
@@ -29,26 +31,137 @@ root = os.path.split(root)[0]
 sys.path.append(os.path.join(root, 'utils'))
 
 import io_utils
+from io_utils import to_shared, from_shared
 import duck_3D
 import forward_sim
 import phasing_3d
 import maps
+import fft_backends
 import fidelity
+from phasing_3d.utils.noise import rad_av
 
 
 def config_iters_to_alg_num(string):
-    # split a string like '100ERA 200DM 50ERA' with the numbers
-    steps = re.split('(\d+)', string)   # ['', '100', 'ERA ', '200', 'DM ', '50', 'ERA']
+    # [['ERA', 100], ['DM', 200], ['ERA', 50]] (without the stop conditions)
+    return [[alg, iters] for alg, iters, conditions, options in parse_schedule(string)]
+
+def parse_schedule(string):
+    """
+    split a schedule string like:
+        '1000DM(plateau[20]<1e-3, time>600) 1cheshire 100ERA(eCon<1e-8) 200RAAR(beta=0.8)'
+    
+    into [[alg, iters, conditions, options], ...]:
+        [['DM', 1000, [('plateau', 20, '<', 1e-3), ('time', None, '>', 600.)], {}], 
+         ['cheshire', 1, [], {}], 
+         ['ERA', 100, [('eCon', None, '<', 1e-8)], {}],
+         ['RAAR', 200, [], {'beta': 0.8}]]
+    
+    A step ends after 'iters' iterations or as soon as one of its 
+    conditions is met, then the next step starts (so e.g. DM can be 
+    switched to ERA when it stagnates). The conditions are:
+        eMod<x          : the last eMod is less than x
+        eCon<x          : the last eCon is less than x
+        plateau[n]<x    : eMod has changed by less than a fraction x over 
+                          the last n iterations (n defaults to 10)
+        time>x          : the step has run for more than x seconds
+    
+    and the options are:
+        beta=x          : the beta parameter of DM, RAAR, HIO or ADMM 
+                          for this step
+    """
+    # the steps must cover the whole string (up to white space)
+    step  = re.compile(r'\s*(\d+)\s*([A-Za-z_]+)\s*(?:\(([^)]*)\))?\s*')
+    steps = []
+    pos   = 0
+    while pos < len(string) :
+        m = step.match(string, pos)
+        if m is None :
+            if len(string[pos:].strip()) == 0 :
+                break
+            raise ValueError('could not parse the schedule at: ' + string[pos:] + ' in: ' + string)
+        steps.append(m.groups(''))
+        pos = m.end()
     
-    # get rid of empty strings
-    steps = [s for s in steps if len(s)>0] # ['100', 'ERA ', '200', 'DM ', '50', 'ERA']
     
-    # pair alg and iters
-    # [['ERA', 100], ['DM', 200], ['ERA', 50]]
-    alg_iters = [ [steps[i+1].strip(), int(steps[i])] for i in range(0, len(steps), 2)]
+    alg_iters = []
+    for iters, alg, conditions in steps :
+        conds   = []
+        options = {}
+        for c in conditions.split(',') :
+            if len(c.strip()) == 0 :
+                continue
+            
+            m = re.match(r'^\s*(beta)\s*=\s*([-+0-9.eE]+)\s*$', c)
+            if m is not None :
+                options[m.group(1)] = float(m.group(2))
+                continue
+            
+            m = re.match(r'^\s*(eMod|eCon|plateau|time)\s*(?:\[\s*(\d+)\s*\])?\s*([<>])\s*([-+0-9.eE]+)\s*$', c)
+            if m is None :
+                raise ValueError('could not parse the stop condition: ' + c + ' in: ' + string)
+            
+            key, window, op, value = m.groups()
+            if (key == 'time') != (op == '>') :
+                raise ValueError('stop conditions are eMod<x, eCon<x, plateau[n]<x or time>x, not: ' + c)
+            
+            if key == 'plateau' :
+                window = 10 if window is None else int(window)
+            elif window is not None :
+                raise ValueError('only plateau takes a window: ' + c)
+            conds.append((key, window, op, float(value)))
+        
+        alg_iters.append([alg, int(iters), conds, options])
     return alg_iters
 
-def phase(mapper, iters_str = '100DM 100ERA', beta=1):
+def make_stop(conditions, eMod_prev = None, t0 = None, comm = None):
+    """
+    Make the stop(eMods, eCons) function for the phasing_3d algorithms that
+    is True when one of the conditions of a schedule step (see 
+    parse_schedule) is met. eMod_prev are the eMod values from earlier 
+    blocks of the same step and t0 is the start time of the step.
+    If comm (an MPI communicator) is not None then the decision of the
+    first rank is used by every rank. Returns None if there are no conditions.
+    """
+    if len(conditions) == 0 :
+        return None
+    
+    if t0 is None :
+        t0 = time.time()
+    
+    if eMod_prev is None :
+        eMod_prev = []
+    
+    def stop(eMods, eCons):
+        for key, window, op, value in conditions :
+            if key == 'time' :
+                if (time.time() - t0) > value :
+                    return True
+            
+            elif key == 'eMod' :
+                if len(eMods) > 0 and eMods[-1] < value :
+                    return True
+            
+            elif key == 'eCon' :
+                if len(eCons) > 0 and eCons[-1] < value :
+                    return True
+            
+            elif key == 'plateau' :
+                e = list(eMod_prev[-window-1:]) + list(eMods[-window-1:])
+                if len(e) > window and abs(e[-window-1] - e[-1]) <= value * abs(e[-window-1]) :
+                    return True
+        return False
+    
+    if comm is None :
+        return stop
+    
+    # the ranks must stop at the same iteration (the times differ)
+    def stop_all(eMods, eCons):
+        return comm.bcast(stop(eMods, eCons), root = 0)
+    
+    return stop_all
+
+def phase(mapper, iters_str = '100DM 100ERA', beta=1, cheshire_scan=3, 
+          checkpoint=None, checkpoint_file=None, resume=False, writer=None):
     """
     phase a crappy crystal diffraction volume
     
@@ -67,95 +180,501 @@ def phase(mapper, iters_str = '100DM 100ERA', beta=1):
     -----------------
     iters_str : str, optional, default ('100DM 100ERA')
         supported iteration strings, in general it is '[number][alg][space]'
-        [N]DM [N]ERA 1cheshire
+        [N]DM [N]ERA [N]RAAR [N]HIO [N]ADMM 1cheshire
+        the steps can have stop conditions and a beta parameter, e.g. 
+        '1000DM(plateau[20]<1e-3, time>600) 200RAAR(beta=0.8) 100ERA(eCon<1e-8)' 
+        (see parse_schedule)
+    
+    beta : float, optional, default (1)
+        the beta parameter of the difference map (RAAR, HIO and ADMM use 
+        their own default, see phasing_3d, unless beta=x is given in iters_str)
+    
+    cheshire_scan : int or None, optional, default (3)
+        the cheshire scan covers shifts in range(-cheshire_scan, cheshire_scan) 
+        along each axis, if None then every shift in the unit-cell is scanned
+    
+    checkpoint : int or None, optional, default (None)
+        write the state of the reconstruction to checkpoint_file every 
+        'checkpoint' iterations (and after each step of iters_str)
+    
+    checkpoint_file : str or None, optional, default (None)
+        the h5 file for the checkpoints (see write_checkpoint)
+    
+    resume : bool, optional, default (False)
+        if True then continue from the checkpoint in checkpoint_file
+    
+    writer : io_utils.H5_writer or None, optional, default (None)
+        append the eMod / eCon values to 'eMod' and 'eCon' as they are
+        produced (after each step or checkpoint block)
     """
-    alg_iters = config_iters_to_alg_num(iters_str)
+    alg_iters = parse_schedule(iters_str)
+    
+    # the algorithms that iterate on mapper.modes
+    algs = {'DM'   : phasing_3d.DM, 
+            'RAAR' : phasing_3d.RAAR, 
+            'HIO'  : phasing_3d.HIO, 
+            'ADMM' : phasing_3d.ADMM}
+    for alg, iters, conditions, options in alg_iters :
+        if alg not in algs and alg not in ['ERA', 'cheshire'] :
+            raise ValueError('unknown algorithm: ' + alg + ' in: ' + iters_str)
     
     Cheshire_error_map = None
     eMod = []
     eCon = []
     O = mapper.O
-    for alg, iters in alg_iters :
+    
+    # the position in the schedule
+    step, done = 0, 0
+    if resume :
+        O, eMod, eCon, step, done, Cheshire_error_map = read_checkpoint(checkpoint_file, mapper, iters_str)
+    modes_it = mapper.modes
+    
+    if writer is not None :
+        writer.append('eMod', eMod, reset=True)
+        writer.append('eCon', eCon, reset=True)
+    
+    info = None
+    for n, (alg, iters, conditions, options) in enumerate(alg_iters) :
+        if n < step :
+            continue
         
-        print(alg, iters)
+        # the errors of this step so far (if resumed part way through)
+        start = len(eMod) - done
+        t0    = time.time()
         
-        if alg == 'ERA':
-           O, info = phasing_3d.ERA(iters, mapper = mapper)
-         
-        if alg == 'DM':
-           O, info = phasing_3d.DM(iters, mapper = mapper, beta=beta)
+        print(alg, iters)
         
         if alg == 'cheshire':
-           O, info = mapper.scans_cheshire(O, scan_points=[range(-3,3,1),range(-3,3,1),range(-3,3,1)])
+           if cheshire_scan is None :
+               scan_points = None
+           else :
+               scan_points = [range(-cheshire_scan, cheshire_scan, 1)]*3
+           O, info = mapper.scans_cheshire(O, scan_points=scan_points)
            Cheshire_error_map = info['error_map'].copy()
-         
-        eMod += info['eMod']
-        eCon += info['eCon']
-
+           done = iters
+           
+           eMod += info['eMod']
+           eCon += info['eCon']
+           if writer is not None :
+               writer.append('eMod', info['eMod'])
+               writer.append('eCon', info['eCon'])
+        
+        # split the iterations into blocks between checkpoints
+        while done < iters :
+            its = iters - done
+            if checkpoint :
+                its = min(its, checkpoint)
+            
+            stop = make_stop(conditions, eMod[start:], t0, getattr(mapper, 'comm', None))
+            
+            if alg == 'ERA':
+               O, info = phasing_3d.ERA(its, mapper = mapper, stop = stop)
+             
+            if alg in algs :
+               # DM (RAAR...) updates mapper.modes in place, then mapper.finish 
+               # replaces it with the solution, so keep the iterate
+               # to continue from in the next block
+               if done > 0 :
+                   mapper.modes = modes_it
+               modes_it = mapper.modes
+               
+               kwargs = {}
+               if 'beta' in options :
+                   kwargs['beta'] = options['beta']
+               elif alg == 'DM' :
+                   kwargs['beta'] = beta
+               O, info = algs[alg](its, mapper = mapper, stop = stop, **kwargs)
+            
+            done += len(info['eMod'])
+            eMod += info['eMod']
+            eCon += info['eCon']
+            if writer is not None :
+                writer.append('eMod', info['eMod'])
+                writer.append('eCon', info['eCon'])
+            
+            # a stop condition was met so go to the next step
+            if stop is not None and stop(info['eMod'], info['eCon']) :
+                done = iters
+            
+            if checkpoint and done < iters :
+                if alg in algs :
+                    modes = modes_it
+                else :
+                    modes = mapper.modes
+                write_checkpoint(checkpoint_file, mapper, modes, O, eMod, eCon, iters_str, n, done, Cheshire_error_map, writer)
+        
+        done = 0
+        if checkpoint :
+            write_checkpoint(checkpoint_file, mapper, mapper.modes, O, eMod, eCon, iters_str, n+1, 0, Cheshire_error_map, writer)
+    
+    # resumed after the last step
+    if info is None :
+        modes = mapper.sym_ops.solid_syms_Fourier(mapper.fftn(O.astype(mapper.c_dtype)), apply_translation=True)
+        info  = mapper.finish(modes)
+    
     if Cheshire_error_map is not None :
         info['Cheshire_error_map'] = Cheshire_error_map
     
     return O, mapper, eMod, eCon, info
 
-def parse_cmdline_args(default_config='phase.ini'):
-    parser = argparse.ArgumentParser(description="phase a crappy crystal from it's diffraction intensity. The results are output into a .h5 file.")
-    parser.add_argument('-f', '--filename', type=str, \
-                        help="file name of the output *.h5 file to edit / create")
-    parser.add_argument('-c', '--config', type=str, \
-                        help="file name of the configuration file")
+def write_checkpoint(fnam, mapper, modes, O, eMod, eCon, iters_str, step, done, Cheshire_error_map = None, writer = None):
+    """
+    Write the state of the reconstruction to fnam in '/phase/checkpoint'. 
     
-    args = parser.parse_args()
+    The state is: the modes to continue from (mapper.modes when resumed),
+    mapper.O, mapper.voxel_support, the current solid unit O, the 
+    eMod / eCon history and the position in the schedule iters_str 
+    (the step and the number of iterations done in that step).
     
-    # if config is non then read the default from the *.h5 dir
-    if args.config is None :
-        args.config = os.path.join(os.path.split(args.filename)[0], default_config)
-        if not os.path.exists(args.config):
-            args.config = '../process/' + default_config
+    If writer (an io_utils.H5_writer of fnam) is not None then its 
+    queued writes are flushed first, so that the eMod / eCon history 
+    in the file agrees with the checkpoint.
+    """
+    if writer is not None :
+        writer.flush()
     
-    # check that args.config exists
-    if not os.path.exists(args.config):
-        raise NameError('config file does not exist: ' + args.config)
+    print('\nwriting checkpoint to:', fnam, 'step', step, 'iteration', done)
+    state = {'modes'         : modes,
+             'mapper_O'      : mapper.O,
+             'voxel_support' : mapper.voxel_support,
+             'O'             : O,
+             'eMod'          : np.array(eMod),
+             'eCon'          : np.array(eCon),
+             'step'          : step,
+             'done'          : done,
+             'iters'         : np.string_(iters_str)}
+    if Cheshire_error_map is not None :
+        state['Cheshire_error_map'] = Cheshire_error_map
     
-    # process config file
-    config = configparser.ConfigParser()
-    config.read(args.config)
+    group = '/phase/checkpoint'
+    f = h5py.File(fnam, 'a')
+    for key, value in state.items():
+        h5_key = group + '/' + key
+        if h5_key in f :
+            # overwrite in place if we can
+            if f[h5_key].shape == np.shape(value) and f[h5_key].dtype == np.asarray(value).dtype :
+                f[h5_key][...] = value
+                continue
+            del f[h5_key]
+        f[h5_key] = value
+    f.close()
+
+def read_checkpoint(fnam, mapper, iters_str):
+    """
+    Restore the state of mapper from the checkpoint in fnam, written by 
+    write_checkpoint. Returns O, eMod, eCon, step, done, Cheshire_error_map
+    """
+    group = '/phase/checkpoint'
+    f = h5py.File(fnam, 'r')
+    if group not in f :
+        f.close()
+        raise ValueError('no checkpoint in: ' + str(fnam))
     
-    params = io_utils.parse_parameters(config)[default_config[:-4]]
+    g = f[group]
+    if g['iters'][()].decode() != iters_str :
+        print('Warning: the checkpoint was written with iters =', g['iters'][()].decode())
     
-    # check that the output file was specified
-    ################################################
-    if args.filename is None and params['output_file'] is not None :
-        fnam = params['output_file']
-        args.filename = fnam
+    mapper.modes         = g['modes'][()]
+    mapper.O             = g['mapper_O'][()]
+    mapper.voxel_support = g['voxel_support'][()]
+    O                    = g['O'][()]
+    eMod                 = list(g['eMod'][()])
+    eCon                 = list(g['eCon'][()])
+    step                 = int(g['step'][()])
+    done                 = int(g['done'][()])
+    if 'Cheshire_error_map' in g :
+        Cheshire_error_map = g['Cheshire_error_map'][()]
+    else :
+        Cheshire_error_map = None
+    f.close()
     
-    if args.filename is None :
-        raise ValueError('output_file in the ini file is not valid, or the filename was not specified on the command line')
+    print('\nresuming from checkpoint:', fnam, 'step', step, 'iteration', done)
+    return O, eMod, eCon, step, done, Cheshire_error_map
+
+_worker = {}
+
+def _init_worker(shared, mapper_args, phase_args):
+    _worker['shared']      = shared
+    _worker['mapper_args'] = mapper_args
+    _worker['phase_args']  = phase_args
+
+def _phase_start(seed):
+    """
+    Run one random start in a worker process. The data, weightings, 
+    mask, support... are views of the shared memory arrays.
+    """
+    np.random.seed(seed)
     
-    return args, params
+    args = dict(_worker['mapper_args'])
+    for k, v in _worker['shared'].items():
+        args[k] = from_shared(v)
+    I = args.pop('I')
+    
+    mapper = maps.Mapper_ellipse(I, **args)
+    O, mapper, eMod, eCon, info = phase(mapper, *_worker['phase_args'])
+    return O, eMod, eCon
 
+def phase_starts(I, mapper_args, iters_str = '100DM 100ERA', beta=1, cheshire_scan=3, 
+                 starts=4, processes=None, merge=None, seed=None):
+    """
+    Run independent random starts of phase in parallel then 
+    merge the best of them.
+    
+    Parameters
+    ----------
+    I : numpy.ndarray
+        the diffraction intensities
+    
+    mapper_args : dict
+        the keyword arguments for maps.Mapper_ellipse, the numpy 
+        arrays in this dict (and I) are put in shared memory so that
+        each worker process does not need its own copy
+    
+    Keyword Arguments
+    -----------------
+    iters_str, beta, cheshire_scan : 
+        see phase
+    
+    starts : int, optional, default (4)
+        the number of random starts
+    
+    processes : int, optional, default (None)
+        the number of worker processes, if None then the number 
+        of cpu cores is used (up to 'starts')
+    
+    merge : int, optional, default (None)
+        the number of solutions (with the lowest final eMod) to merge 
+        with phasing_3d.utils.merge.merge_sols, if None then merge all
+    
+    seed : int, optional, default (None)
+        the random starts use the seeds seed, seed+1, ... 
+    
+    Returns
+    -------
+    O : numpy.ndarray
+        the merged solid unit
+    
+    Os : numpy.ndarray
+        the solid units of every start, sorted by the final eMod
+    
+    eMods : list
+        the eMod of each iteration for every start, sorted by the final eMod
+    
+    eCons : list
+        the eCon of each iteration for every start, sorted by the final eMod
+    
+    PRTF : numpy.ndarray
+        the phase retrieval transfer function of the merged solutions
+    """
+    if processes is None :
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, starts))
+    
+    if merge is None :
+        merge = starts
+    
+    if seed is None :
+        seed = np.random.randint(0, 2**31 - starts)
+    
+    # share the cpu cores between the ellipse projections of each process
+    mapper_args = dict(mapper_args)
+    if mapper_args.get('threads', None) is None :
+        mapper_args['threads'] = max(1, multiprocessing.cpu_count() // processes)
+    
+    # put the arrays in shared memory
+    shared = {'I' : to_shared(I)}
+    for k in list(mapper_args.keys()):
+        if isinstance(mapper_args[k], np.ndarray) :
+            shared[k] = to_shared(mapper_args.pop(k))
+    
+    phase_args = (iters_str, beta, cheshire_scan)
+    seeds      = [seed + i for i in range(starts)]
+    
+    if processes == 1 :
+        _init_worker(shared, mapper_args, phase_args)
+        out = list(map(_phase_start, seeds))
+    else :
+        pool = multiprocessing.Pool(processes, _init_worker, (shared, mapper_args, phase_args))
+        try :
+            out = pool.map(_phase_start, seeds)
+        finally :
+            pool.close()
+            pool.join()
+    
+    Os    = np.array([o[0] for o in out])
+    eMods = [o[1] for o in out]
+    eCons = [o[2] for o in out]
+    return _merge_starts(Os, eMods, eCons, merge)
 
-if __name__ == '__main__':
-    args, params = parse_cmdline_args()
+def _merge_starts(Os, eMods, eCons, merge):
+    """
+    Sort the starts by the final eMod and merge the best 'merge' of them.
+    """
+    # rank by the final eMod
+    order = np.argsort([e[-1] for e in eMods])
+    Os    = Os[order]
+    eMods = [eMods[i] for i in order]
+    eCons = [eCons[i] for i in order]
+    print('final eMod of each start:', [e[-1] for e in eMods])
     
-    # make the input
-    ################
+    # merge the best solutions 
+    O, PRTF = phasing_3d.utils.merge.merge_sols(Os[:merge].copy())
+    if PRTF is not None :
+        PRTF = np.abs(PRTF)
+    return O, Os, eMods, eCons, PRTF
+
+def phase_starts_mpi(I, mapper_args, iters_str = '100DM 100ERA', beta=1, cheshire_scan=3, 
+                     starts=None, merge=None, seed=None, comm=None):
+    """
+    Run independent random starts of phase on the ranks of an MPI 
+    communicator (a task farm) then merge the best of them on the 
+    first rank.
+    
+    Parameters
+    ----------
+    I : numpy.ndarray
+        the diffraction intensities (only used on the first rank)
+    
+    mapper_args : dict
+        the keyword arguments for maps.Mapper_ellipse (only used on the 
+        first rank), I and mapper_args are broadcast to the other ranks 
+        with io_utils.bcast_arrays
+    
+    Keyword Arguments
+    -----------------
+    iters_str, beta, cheshire_scan : 
+        see phase
+    
+    starts : int, optional, default (None)
+        the number of random starts, they are dealt out to the ranks in 
+        turn, if None (or less than the number of ranks) then there is 
+        one start per rank
+    
+    merge, seed : 
+        see phase_starts, the seed of the first rank is used
+    
+    comm : MPI communicator, optional, default (None)
+        if None then MPI.COMM_WORLD
+    
+    Returns
+    -------
+    O, Os, eMods, eCons, PRTF : 
+        see phase_starts, on the first rank. None on the other ranks.
+    """
+    from mpi4py import MPI
+    if comm is None :
+        comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    
+    starts = max(starts or 1, size)
+    
+    if merge is None :
+        merge = starts
+    
+    if rank == 0 and seed is None :
+        seed = np.random.randint(0, 2**31 - starts)
+    seed = comm.bcast(seed, root = 0)
+    
+    # the input is read once (on the first rank)
+    if rank == 0 :
+        d = dict(mapper_args)
+        d['I'] = I
+    else :
+        d = None
+    mapper_args = io_utils.bcast_arrays(d, comm)
+    I = mapper_args.pop('I')
+    
+    # share the cpu cores between the ranks on each node
+    if mapper_args.get('threads', None) is None :
+        node = comm.Split_type(MPI.COMM_TYPE_SHARED)
+        mapper_args['threads'] = max(1, multiprocessing.cpu_count() // node.Get_size())
+        node.Free()
+    
+    out = []
+    for s in range(rank, starts, size):
+        if rank == 0 : print('\nrandom start', s, 'of', starts)
+        np.random.seed(seed + s)
+        
+        mapper = maps.Mapper_ellipse(I, **mapper_args)
+        O, mapper, eMod, eCon, info = phase(mapper, iters_str, beta, cheshire_scan)
+        out.append((O, eMod, eCon))
+    
+    # gather the solutions and the error histories on the first rank
+    # (in start order)
+    Os_local = np.ascontiguousarray([o[0] for o in out])
+    counts   = comm.gather(Os_local.size, root = 0)
+    hist     = comm.gather([(o[1], o[2]) for o in out], root = 0)
+    
+    if rank == 0 :
+        buf    = np.empty((starts,) + Os_local.shape[1:], dtype = Os_local.dtype)
+        displs = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        comm.Gatherv(Os_local, [buf, (counts, displs)], root = 0)
+    else :
+        comm.Gatherv(Os_local, None, root = 0)
+        return None
+    
+    # the solutions are grouped by rank
+    order = [s for r in range(size) for s in range(r, starts, size)]
+    Os    = np.empty_like(buf)
+    Os[order] = buf
+    eMods = [None] * starts
+    eCons = [None] * starts
+    for s, (eMod, eCon) in zip(order, [h for hs in hist for h in hs]):
+        eMods[s], eCons[s] = eMod, eCon
+    
+    return _merge_starts(Os, eMods, eCons, merge)
+
+def read_input(filename, params, slabs = False):
+    """
+    Read the diffraction data, weightings, mask, support... for the 
+    mapper from params['input_file'] (or filename if that is None).
+    
+    Returns
+    -------
+    I : numpy.ndarray
+        the diffraction intensities
+    
+    mapper_args : dict
+        the keyword arguments for maps.Mapper_ellipse
+    
+    If slabs is True then the volumes (I, solid_unit, mask, support and 
+    the weightings) are returned as h5py datasets and the file is left 
+    open, so that each rank of maps_mpi.Mapper_ellipse_mpi reads only 
+    its slab of the first axis when it slices them. Close the file 
+    (I.file.close()) once the mapper has been made.
+    """
+    # read only, so that every MPI rank can open it
     if params['input_file'] is None :
-        f = h5py.File(args.filename)
+        f = h5py.File(filename, 'r')
     else :
-        f = h5py.File(params['input_file'])
+        f = h5py.File(params['input_file'], 'r')
+    
+    # each dataset is read once, the large real volumes are converted 
+    # to dtype as they are read (or memory mapped if mmap_input is True)
+    if params['dtype'] is None :
+        dtype = np.float64
+    else :
+        dtype = np.dtype(params['dtype'])
+    mmap = params.get('mmap_input', False)
+    
+    def read(key, dtype = None, mmap = False):
+        if slabs :
+            return f[key]
+        return io_utils.read_dataset(f, key, dtype, mmap)
 
-    I = f[params['data']][()]
+    I = read(params['data'], dtype, mmap)
     
     if params['solid_unit'] is None :
         solid_unit = None
     else :
         print('loading solid_unit from file...')
-        solid_unit = f[params['solid_unit']][()]
+        solid_unit = read(params['solid_unit'])
     
     if params['mask'] is None :
         mask = None
     else :
-        mask = f[params['mask']][()]
+        mask = read(params['mask'], mmap = mmap)
     
     if params['voxels'] is None :
         voxels = None
@@ -167,55 +686,100 @@ if __name__ == '__main__':
     if params['support'] is None or params['support'] is False :
         support = None
     else :
-        support = f[params['support']][()]
+        support = read(params['support'], mmap = mmap)
         
     if params['bragg_weighting'] is None or params['bragg_weighting'] is False :
         bragg_weighting = None
     else :
-        bragg_weighting = f[params['bragg_weighting']][()]
+        bragg_weighting = read(params['bragg_weighting'], dtype, mmap)
 
     if params['diffuse_weighting'] is None or params['diffuse_weighting'] is False :
         diffuse_weighting = None
     else :
-        diffuse_weighting = f[params['diffuse_weighting']][()]
+        diffuse_weighting = read(params['diffuse_weighting'], dtype, mmap)
 
-    # make the mapper
-    #################
-    mapper = maps.Mapper_ellipse(f[params['data']][()], 
-                                 Bragg_weighting   = bragg_weighting, 
-                                 diffuse_weighting = diffuse_weighting, 
-                                 solid_unit        = solid_unit,
-                                 voxels            = voxels,
-                                 overlap           = params['overlap'],
-                                 support           = support,
-                                 unit_cell         = params['unit_cell'],
-                                 space_group       = params['space_group'],
-                                 alpha             = params['alpha'],
-                                 dtype             = params['dtype']
-                                 )
-    f.close()
+    # the mapper arguments
+    mapper_args = {'Bragg_weighting'   : bragg_weighting, 
+                   'diffuse_weighting' : diffuse_weighting, 
+                   'solid_unit'        : solid_unit,
+                   'voxels'            : voxels,
+                   'overlap'           : params['overlap'],
+                   'support'           : support,
+                   'unit_cell'         : params['unit_cell'],
+                   'space_group'       : params['space_group'],
+                   'alpha'             : params['alpha'],
+                   'threads'           : params.get('threads', None),
+                   'newton'            : params.get('newton', False),
+                   'fft'               : params.get('fft', None),
+                   'dtype'             : params['dtype']
+                   }
+    if not slabs :
+        f.close()
+    return I, mapper_args
 
-    # phase
-    #######
-    O, mapper, eMod, eCon, info = phase(mapper, params['iters'], params['beta'])
+def parse_cmdline_args(default_config='phase.ini'):
+    parser = argparse.ArgumentParser(description="phase a crappy crystal from it's diffraction intensity. The results are output into a .h5 file.")
+    parser.add_argument('-f', '--filename', type=str, \
+                        help="file name of the output *.h5 file to edit / create")
+    parser.add_argument('-c', '--config', type=str, \
+                        help="file name of the configuration file")
+    parser.add_argument('-r', '--resume', action='store_true', \
+                        help="continue from the checkpoint in the output file")
+    
+    args = parser.parse_args()
+    
+    # if config is non then read the default from the *.h5 dir
+    if args.config is None :
+        args.config = os.path.join(os.path.split(args.filename)[0], default_config)
+        if not os.path.exists(args.config):
+            args.config = '../process/' + default_config
+    
+    # check that args.config exists
+    if not os.path.exists(args.config):
+        raise NameError('config file does not exist: ' + args.config)
+    
+    # process config file
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    
+    params = io_utils.parse_parameters(config)[default_config[:-4]]
+    
+    # check that the output file was specified
+    ################################################
+    if args.filename is None and params['output_file'] is not None :
+        fnam = params['output_file']
+        args.filename = fnam
+    
+    if args.filename is None :
+        raise ValueError('output_file in the ini file is not valid, or the filename was not specified on the command line')
+    
+    return args, params
 
-    # calculate the fidelity if we have the ground truth
-    ####################################################
-    if params['input_file'] is None :
-        f = h5py.File(args.filename)
+
+if __name__ == '__main__':
+    args, params = parse_cmdline_args()
+    
+    # the MPI mode: 'starts' for a task farm of random starts, 
+    # True (or 'slab') to phase a slab of the volume on each rank
+    mpi = params.get('mpi', False)
+    if mpi == 'starts' :
+        from mpi4py import MPI
+        rank = MPI.COMM_WORLD.Get_rank()
     else :
-        f = h5py.File(params['input_file'])
+        rank = 0
     
-    if '/forward_model/solid_unit' in f:
-        fids, fids_trans = [], []
-        #O = h5py.File('duck_both/duck_both.h5.bak')['/phase/solid_unit'][()]
-        for o in mapper.sym_ops.solid_syms_real(O):
-            fid, fid_trans = fidelity.calculate_fidelity(f['/forward_model/solid_unit'][()], O)
-            fids.append(fid)
-            fids_trans.append(fid_trans)
-        i         = np.argmin(np.array(fids_trans))
-        info['fidelity'] = fids[i]
-        info['fidelity_trans'] = fids_trans[i]
+    # make the input (only the first rank reads it in the task farm, 
+    # in the slab mode each rank reads its slab when the mapper is made)
+    ################
+    if rank == 0 :
+        I, mapper_args = read_input(args.filename, params, slabs = bool(mpi) and mpi != 'starts')
+    else :
+        I, mapper_args = None, None
+    
+    # reuse the FFTW plans from previous runs
+    fft_wisdom = params.get('fft_wisdom', None)
+    if fft_wisdom is not None and params.get('fft', None) == 'pyfftw' :
+        fft_backends.load_wisdom(fft_wisdom)
     
     # output
     ########
@@ -227,49 +791,150 @@ if __name__ == '__main__':
     outputdir = os.path.split(os.path.abspath(filename))[0]
 
     # mkdir if it does not exist
-    if not os.path.exists(outputdir):
+    if rank == 0 and not os.path.exists(outputdir):
         os.makedirs(outputdir)
     
-    print('writing to:', filename)
-    f = h5py.File(filename)
+    # the results are written to '/phase' in a background thread,
+    # large arrays are chunked and compressed
+    compression = params.get('compression', 'gzip')
+    
+    starts = params.get('starts', 1)
+    if starts is None :
+        starts = 1
     
-    group = '/phase'
-    if group not in f:
-        f.create_group(group)
+    if mpi == 'starts' :
+        # each MPI rank runs its own random starts (run with mpirun), 
+        # the first rank merges them
+        ##############################################################
+        out = phase_starts_mpi(I, mapper_args, params['iters'], params['beta'], 
+                               params.get('cheshire_scan', 3), params.get('starts', None), 
+                               params.get('merge', None), params.get('seed', None))
+        
+        if rank != 0 :
+            sys.exit()
+        
+        O, Os, eMods, eCons, PRTF = out
+    
+    elif mpi :
+        # each MPI rank phases a slab of the volume (run with mpirun), 
+        # and reads only its slab of the input datasets
+        ##############################################################
+        import maps_mpi
+        mapper = maps_mpi.Mapper_ellipse_mpi(I, **mapper_args)
+        I.file.close()
+        
+        # the first rank writes the output
+        if mapper.rank == 0 :
+            print('writing to:', filename)
+            writer = io_utils.H5_writer(filename, '/phase', compression)
+        else :
+            writer = None
+        
+        if params.get('checkpoint', None) or args.resume :
+            if mapper.rank == 0 : print('checkpoints are not supported with mpi')
+        
+        # phase
+        #######
+        O, mapper, eMod, eCon, info = phase(mapper, params['iters'], params['beta'], 
+                                            params.get('cheshire_scan', 3), writer = writer)
+        
+        # gather the slabs on the first rank
+        O = mapper.gather(O)
+        for key, value in info.items():
+            if isinstance(value, np.ndarray) and value.shape == mapper.local_shape :
+                info[key] = mapper.gather(value)
+        
+        if mapper.rank != 0 :
+            sys.exit()
+    
+    elif starts > 1 :
+        # phase in parallel then merge
+        ##############################
+        O, Os, eMods, eCons, PRTF = phase_starts(I, mapper_args, params['iters'], params['beta'], 
+                                                 params.get('cheshire_scan', 3), starts,
+                                                 params.get('processes', None), 
+                                                 params.get('merge', None), 
+                                                 params.get('seed', None))
+    
+    if mpi == 'starts' or (not mpi and starts > 1) :
+        # after the worker processes have forked
+        print('writing to:', filename)
+        writer = io_utils.H5_writer(filename, '/phase', compression)
+        
+        # the output for the merged solution
+        mapper = maps.Mapper_ellipse(I, **mapper_args)
+        modes  = mapper.sym_ops.solid_syms_Fourier(mapper.fftn(O.astype(mapper.c_dtype)), apply_translation=True)
+        info   = mapper.finish(modes)
+        info['eMod'] = info['eCon'] = None
+        info['eMod_merged'] = mapper.Emod(modes)
+        info['eMod_starts'] = np.array([e[-1] for e in eMods])
+        info['solid_unit_starts'] = Os
+        if PRTF is not None :
+            info['PRTF']     = PRTF
+            info['PRTF_rav'] = rad_av(PRTF, is_fft_shifted = True)
+        
+        # the error history of the best start
+        eMod, eCon = eMods[0], eCons[0]
+        writer.append('eMod', eMod, reset=True)
+        writer.append('eCon', eCon, reset=True)
+    
+    elif not mpi :
+        mapper = maps.Mapper_ellipse(I, **mapper_args)
+        
+        # the checkpoints and the error history (as it is 
+        # produced) go in the output file
+        print('writing to:', filename)
+        writer = io_utils.H5_writer(filename, '/phase', compression)
+        
+        # phase
+        #######
+        O, mapper, eMod, eCon, info = phase(mapper, params['iters'], params['beta'], 
+                                            params.get('cheshire_scan', 3),
+                                            params.get('checkpoint', None), 
+                                            filename, args.resume, writer)
+
+    if fft_wisdom is not None and params.get('fft', None) == 'pyfftw' :
+        fft_backends.save_wisdom(fft_wisdom)
+    
+    # the run finished so we do not need the checkpoint
+    writer.delete('checkpoint')
     
     # solid unit
-    key = group+'/solid_unit'
-    if key in f :
-        del f[key]
-    f[key] = O
+    writer.write('solid_unit', O)
     
     # real-space crystal
-    key = group+'/crystal'
-    if key in f :
-        del f[key]
-    f[key] = mapper.sym_ops.solid_to_crystal_real(O)
-
+    writer.write('crystal', mapper.sym_ops.solid_to_crystal_real(O))
+    
+    # everything else (eMod and eCon have already been written)
     del info['eMod']
     del info['eCon']
-    info['eMod'] = eMod
-    info['eCon'] = eCon
-    # everything else
     for key, value in info.items():
         if value is None :
             continue 
-        
-        h5_key = group+'/'+key
-        if h5_key in f :
-            del f[h5_key]
-        
-        try :
-            print('writing:', h5_key, type(value))
-            f[h5_key] = value
-        
-        except Exception as e :
-            print('could not write:', h5_key, ':', e)
-        
-    f.close() 
+        writer.write(key, value)
+    
+    # calculate the fidelity if we have the ground truth
+    # (while the arrays above are written)
+    ####################################################
+    if params['input_file'] is None :
+        f = h5py.File(args.filename)
+    else :
+        f = h5py.File(params['input_file'])
+    
+    if '/forward_model/solid_unit' in f:
+        fids, fids_trans = [], []
+        #O = h5py.File('duck_both/duck_both.h5.bak')['/phase/solid_unit'][()]
+        solid_unit_true = f['/forward_model/solid_unit'][()]
+        for o in mapper.sym_ops.solid_syms_real(O):
+            fid, fid_trans = fidelity.calculate_fidelity(solid_unit_true, O)
+            fids.append(fid)
+            fids_trans.append(fid_trans)
+        i         = np.argmin(np.array(fids_trans))
+        writer.write('fidelity', fids[i])
+        writer.write('fidelity_trans', fids_trans[i])
+    f.close()
+    
+    writer.close() 
     
     # copy the config file
     ######################
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+Check the bisection and Newton ellipse projections against the
+analytic solution for circles and against the conditions for the
+closest point on an ellipse.
+
+run with: python test_ellipse.py (or pytest)
+"""
+
+# for python 2 / 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import os, sys
+
+# import python modules using the relative directory
+# locations, utils goes first because this directory
+# has old copies of the cython modules
+root = os.path.split(os.path.abspath(__file__))[0]
+root = os.path.split(root)[0]
+sys.path.insert(0, os.path.join(root, 'utils'))
+
+import pyximport; pyximport.install()
+from ellipse_2D_cython_new import project_2D_Ellipse_arrays_cython_test
+from ellipse_2D_cython_new import project_2D_Ellipse_arrays_cython_newton
+from ellipse_2D_cython_new import project_2D_Ellipse_arrays_cython_parallel
+
+def random_points(N, seed = 1):
+    """
+    points inside and outside of ellipses with weightings that
+    span a few orders of magnitude (as in ellipse_projections.benchmark)
+    """
+    np.random.seed(seed)
+    x    = np.random.random(N) * 8. - 4.
+    y    = np.random.random(N) * 8. - 4.
+    Wx   = 10**(np.random.random(N) * 3. - 2.)
+    Wy   = 10**(np.random.random(N) * 3. - 2.)
+    I    = np.random.random(N) * 3. + 0.1
+    mask = np.ones((N,), dtype=np.uint8)
+    return x, y, Wx, Wy, I, mask
+
+def test_circle():
+    # Wx = Wy: the projection is the radial scaling of (x, y)
+    x, y, Wx, Wy, I, mask = random_points(10000)
+    Wy = Wx
+    r  = np.sqrt(I / Wx) / np.sqrt(x**2 + y**2)
+    for newton in [0, 1]:
+        xp, yp, its = project_2D_Ellipse_arrays_cython_parallel(x, y, Wx, Wy, I, mask, 1, newton)
+        err = max(np.max(np.abs(xp - r * x)), np.max(np.abs(yp - r * y)))
+        print('circle, newton', newton, 'max error:', err)
+        assert err < 1.0e-10
+
+def test_closest_point():
+    x, y, Wx, Wy, I, mask = random_points(10000)
+    for newton in [0, 1]:
+        xp, yp, its = project_2D_Ellipse_arrays_cython_parallel(x, y, Wx, Wy, I, mask, 1, newton)
+
+        # on the ellipse
+        err_e = np.max(np.abs(Wx * xp**2 + Wy * yp**2 - I) / I)
+
+        # (x, y) - (xp, yp) is normal to the ellipse at (xp, yp)
+        nx, ny = Wx * xp, Wy * yp
+        dx, dy = x - xp, y - yp
+        err_n  = np.max(np.abs(dx * ny - dy * nx) / (np.sqrt(nx**2 + ny**2) * (np.sqrt(dx**2 + dy**2) + 1.)))
+
+        # and it is closer than any point on a fine grid of the ellipse
+        t   = np.linspace(0, 2 * np.pi, 2**12, endpoint=False)
+        xe  = np.sqrt(I / Wx)[:, None] * np.cos(t)
+        ye  = np.sqrt(I / Wy)[:, None] * np.sin(t)
+        d   = np.min((xe - x[:, None])**2 + (ye - y[:, None])**2, axis=1)
+        err_d = np.max((x - xp)**2 + (y - yp)**2 - d)
+
+        print('newton', newton, 'ellipse error:', err_e, 'normal error:', err_n, 'excess distance:', err_d)
+        assert err_e < 1.0e-10
+        assert err_n < 1.0e-8
+        assert err_d < 1.0e-10
+
+def test_newton_bisection():
+    x, y, Wx, Wy, I, mask = random_points(10000)
+
+    # a few of the special cases
+    Wx[:10] = 0.
+    Wy[10:20] = 0.
+    mask[20:30] = 0
+    x[30:40] = 0.
+
+    xp_b, yp_b = project_2D_Ellipse_arrays_cython_test(x, y, Wx, Wy, I, mask)
+    xp_n, yp_n = project_2D_Ellipse_arrays_cython_newton(x, y, Wx, Wy, I, mask)
+
+    r   = np.sqrt(xp_b**2 + yp_b**2) + 1.0e-10
+    err = np.max(np.sqrt((xp_b - xp_n)**2 + (yp_b - yp_n)**2) / r)
+    print('newton vs bisection max relative difference:', err)
+    assert err < 1.0e-10
+
+    # masked points are not moved
+    assert np.all(xp_n[20:30] == x[20:30]) and np.all(yp_n[20:30] == y[20:30])
+
+    # the parallel kernel gives the same points
+    for newton, xp, yp in [(0, xp_b, yp_b), (1, xp_n, yp_n)]:
+        xp2, yp2, its = project_2D_Ellipse_arrays_cython_parallel(x, y, Wx, Wy, I, mask, 2, newton)
+        assert np.allclose(xp, xp2, rtol=1.0e-12, atol=0) and np.allclose(yp, yp2, rtol=1.0e-12, atol=0)
+
+def test_single_precision():
+    x, y, Wx, Wy, I, mask = random_points(10000)
+    xp, yp, its = project_2D_Ellipse_arrays_cython_parallel(x, y, Wx, Wy, I, mask, 1, 1)
+
+    args = [a.astype(np.float32) for a in (x, y, Wx, Wy, I)]
+    xp32, yp32, its = project_2D_Ellipse_arrays_cython_parallel(*(args + [mask, 1, 1]))
+    assert xp32.dtype == np.float32
+    err = np.max(np.sqrt((xp - xp32)**2 + (yp - yp32)**2) / np.sqrt(xp**2 + yp**2))
+    print('float32 vs float64 max relative difference:', err)
+    assert err < 1.0e-5
+
+def test_threads():
+    # each point is projected independently, so the threaded
+    # results are the same as the serial results bit for bit
+    x, y, Wx, Wy, I, mask = random_points(2**20)
+    for newton in [0, 1]:
+        xp, yp, its = project_2D_Ellipse_arrays_cython_parallel(x, y, Wx, Wy, I, mask, 1, newton)
+        for threads in [2, 4]:
+            for repeat in range(3):
+                xp2, yp2, its2 = project_2D_Ellipse_arrays_cython_parallel(x, y, Wx, Wy, I, mask, threads, newton)
+                assert np.array_equal(xp, xp2) and np.array_equal(yp, yp2) and np.array_equal(its, its2)
+
+
+if __name__ == '__main__':
+    for name, f in sorted(list(globals().items())):
+        if name.startswith('test_') and callable(f):
+            print('\n' + name)
+            f()
+    print('\nall tests passed')
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Compare the fft backends of fft_backends with np.fft.
+
+run with: python test_fft_backends.py (or pytest)
+"""
+
+# for python 2 / 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import os, sys
+
+# import python modules using the relative directory
+# locations, utils goes first because this directory
+# has old copies of the cython modules
+root = os.path.split(os.path.abspath(__file__))[0]
+root = os.path.split(root)[0]
+sys.path.insert(0, os.path.join(root, 'utils'))
+
+import fft_backends
+
+def backends():
+    out = ['numpy', 'scipy', None]
+    try :
+        import pyfftw
+        out.append('pyfftw')
+    except ImportError :
+        print('pyfftw is not installed, skipping the pyfftw backend')
+    return out
+
+def test_fftn():
+    np.random.seed(1)
+    shape = (12, 10, 9)
+    for backend in backends():
+        for dtype, tol in [(np.complex128, 1.0e-12), (np.complex64, 1.0e-5)]:
+            fftn, ifftn = fft_backends.get_fft(backend, 2, dtype, 'FFTW_ESTIMATE')
+            a = (np.random.random(shape) + 1J * np.random.random(shape)).astype(dtype)
+
+            for axes in [None, (0,), (1, 2)]:
+                ref = np.fft.fftn(a, axes = axes)
+                b   = fftn(a, axes = axes)
+                assert b.dtype == dtype
+                assert np.max(np.abs(b - ref)) < tol * np.max(np.abs(ref)), (backend, dtype, axes)
+
+                c = ifftn(b, axes = axes)
+                assert np.max(np.abs(c - a)) < tol * np.max(np.abs(a)), (backend, dtype, axes)
+
+                # overwrite_x (the input is not used afterwards)
+                b2 = fftn(a.copy(), axes = axes, overwrite_x = True)
+                assert np.allclose(b2, b, rtol = tol, atol = 0)
+
+            # results are not overwritten by later transforms
+            b0 = fftn(a)
+            b1 = fftn(2 * a)
+            assert np.allclose(b1, 2 * b0, rtol = tol)
+            print(backend, np.dtype(dtype).name, 'fftn / ifftn ok')
+
+def test_pyfftw_in_place():
+    if 'pyfftw' not in backends():
+        return
+    import pyfftw
+    plans = fft_backends.FFTW_plans(1, 'FFTW_ESTIMATE')
+    a = pyfftw.empty_aligned((8, 6, 4), dtype = np.complex128)
+    a[...] = np.random.random(a.shape)
+    ref = np.fft.fftn(a)
+
+    b = plans.c2c(a, None, 'FFTW_FORWARD', overwrite_x = True)
+    assert b is a and np.allclose(b, ref)
+
+    # the plan still uses its own buffers afterwards
+    c = plans.c2c(ref, None, 'FFTW_BACKWARD')
+    assert c is not a and np.allclose(c, np.fft.ifftn(ref))
+    assert len(plans.plans) == 2
+
+def test_rfftn():
+    np.random.seed(1)
+    for shape in [(12, 10, 8), (7, 9, 5)]:
+        for backend in backends():
+            for dtype, tol in [(np.float64, 1.0e-12), (np.float32, 1.0e-5)]:
+                rfftn, irfftn = fft_backends.get_rfft(backend, 2, dtype, 'FFTW_ESTIMATE')
+                a   = np.random.random(shape).astype(dtype)
+                ref = np.fft.rfftn(a)
+                b   = rfftn(a)
+                assert b.dtype == np.result_type(dtype, np.complex64)
+                assert np.max(np.abs(b - ref)) < tol * np.max(np.abs(ref)), (backend, dtype)
+
+                c = irfftn(b, shape)
+                assert c.dtype == dtype and c.shape == shape
+                assert np.max(np.abs(c - a)) < tol, (backend, dtype)
+
+        # the hermitian half / expansion
+        a = np.random.random(shape) + 1J * np.random.random(shape)
+        assert np.allclose(np.fft.irfftn(fft_backends.hermitian_half(a), shape), np.fft.ifftn(a).real)
+        assert np.allclose(fft_backends.hermitian_expand(np.fft.rfftn(a.real), shape), np.fft.fftn(a.real))
+
+        # the hermitian half of the sum of a stack
+        a = np.random.random((3,) + shape) + 1J * np.random.random((3,) + shape)
+        assert np.allclose(np.fft.irfftn(fft_backends.hermitian_half(a), shape), np.fft.ifftn(np.sum(a, axis=0)).real)
+        print(shape, 'rfftn / irfftn ok')
+
+
+if __name__ == '__main__':
+    for name, f in sorted(list(globals().items())):
+        if name.startswith('test_') and callable(f):
+            print('\n' + name)
+            f()
+    print('\nall tests passed')
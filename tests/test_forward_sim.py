@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Check that the cached forward simulations of forward_sim (prepare_diff
+and sweep_diff) agree with direct calls to generate_diff.
+
+run with: python test_forward_sim.py (or pytest)
+"""
+
+# for python 2 / 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import os, sys
+
+# import python modules using the relative directory
+# locations, utils goes first because this directory
+# has old copies of the cython modules
+root = os.path.split(os.path.abspath(__file__))[0]
+root = os.path.split(root)[0]
+sys.path.insert(0, os.path.join(root, 'utils'))
+
+import forward_sim
+import duck_3D
+
+unit_cell = (8, 8, 8)
+
+def make_solid_unit(shape = (16, 16, 16)):
+    duck  = duck_3D.make_3D_duck(shape = (4, 5, 5))
+    solid = np.zeros(shape, dtype = np.complex128)
+    solid[:duck.shape[0], :duck.shape[1], :duck.shape[2]] = duck
+    return solid
+
+def assert_same(diff, info, diff_ref, info_ref):
+    assert np.allclose(diff, diff_ref, rtol = 1.0e-12, atol = 0)
+    for k in ['support', 'lattice', 'Bragg_weighting', 'diffuse_weighting',
+              'Bragg_diffraction', 'diffuse_diffraction', 'voxels', 'solvent_content'] :
+        assert np.allclose(info[k], info_ref[k], rtol = 1.0e-12, atol = 0), k
+
+def test_prepare_diff():
+    # one cache reused for several N, sigma, photons and support_frac
+    solid = make_solid_unit()
+    cache = forward_sim.prepare_diff(solid, unit_cell, space_group = 'P212121')
+    for N, sigma, photons, support_frac in [(4, 1.0, None, None), (10, 0.5, 1e6, None),
+                                           (4, 2.0, 1e6, 0.5), (10, 1.0, None, 0.5)]:
+        np.random.seed(5)
+        diff_ref, info_ref = forward_sim.generate_diff(solid, unit_cell, N, sigma, space_group = 'P212121',
+                                                       photons = photons, support_frac = support_frac)
+        np.random.seed(5)
+        diff, info = forward_sim.generate_diff(solid, unit_cell, N, sigma, cache = cache, space_group = 'P212121',
+                                               photons = photons, support_frac = support_frac)
+        assert_same(diff, info, diff_ref, info_ref)
+    assert sorted(cache['lattice'].keys()) == [(4, None), (10, None)]
+
+def test_sweep_diff():
+    # grid point 'index' uses the seed seed + index
+    solid = make_solid_unit()
+    grid  = {'n' : [4, 10], 'sigma' : [0.5, 1.0]}
+    seed  = 7
+    for processes in [1, 2]:
+        cache, results = forward_sim.sweep_diff(solid, unit_cell, grid, processes = processes, seed = seed,
+                                                space_group = 'P212121', photons = 1e6)
+        indices = []
+        for index, point, diff, info in results :
+            np.random.seed(seed + index)
+            diff_ref, info_ref = forward_sim.generate_diff(solid, unit_cell, point['n'], point['sigma'],
+                                                           space_group = 'P212121', photons = 1e6)
+            assert_same(diff, info, diff_ref, info_ref)
+            indices.append(index)
+        assert indices == list(range(4))
+
+def test_unknown_space_group():
+    try :
+        forward_sim.prepare_diff(make_solid_unit(), unit_cell, space_group = 'P2/m')
+    except ValueError as e :
+        print(e)
+    else :
+        raise AssertionError('prepare_diff accepted an unknown space group')
+
+
+if __name__ == '__main__':
+    for name, f in sorted(list(globals().items())):
+        if name.startswith('test_') and callable(f):
+            print('\n' + name)
+            f()
+    print('\nall tests passed')
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+Round trips through the h5 helpers of io_utils.
+
+run with: python test_io_utils.py (or pytest)
+"""
+
+# for python 2 / 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import os, sys
+import shutil, tempfile
+import h5py
+
+# import python modules using the relative directory
+# locations, utils goes first because this directory
+# has old copies of the cython modules
+root = os.path.split(os.path.abspath(__file__))[0]
+root = os.path.split(root)[0]
+sys.path.insert(0, os.path.join(root, 'utils'))
+
+import io_utils
+
+def test_H5_writer():
+    d    = tempfile.mkdtemp()
+    fnam = os.path.join(d, 'out.h5')
+    try :
+        np.random.seed(1)
+        big   = np.random.random((32, 32, 8))
+        small = np.arange(10)
+
+        writer = io_utils.H5_writer(fnam, '/phase', compression = 'gzip')
+        writer.write('big', big)
+        writer.write('small', small)
+        writer.write('scalar', 1.5)
+        writer.append('eMod', [1., 2.])
+        writer.append('eMod', [3.])
+        writer.append('eCon', [1., 2.])
+        writer.append('eCon', [5.], reset = True)
+        writer.write('gone', small)
+        writer.delete('gone')
+        writer.flush()
+
+        # overwrite in place and with a new shape
+        writer.write('big', 2 * big)
+        writer.write('small', small[:5])
+        writer.close()
+
+        with h5py.File(fnam, 'r') as f :
+            g = f['phase']
+            assert np.array_equal(g['big'][()], 2 * big)
+            assert g['big'].compression == 'gzip' and g['big'].chunks is not None
+            assert np.array_equal(g['small'][()], small[:5])
+            assert g['small'].compression is None
+            assert g['scalar'][()] == 1.5
+            assert np.array_equal(g['eMod'][()], [1., 2., 3.])
+            assert np.array_equal(g['eCon'][()], [5.])
+            assert 'gone' not in g
+
+        # no compression
+        writer = io_utils.H5_writer(fnam, '/phase', compression = None)
+        writer.write('big', big)
+        writer.close()
+        with h5py.File(fnam, 'r') as f :
+            assert np.array_equal(f['phase/big'][()], big)
+            assert f['phase/big'].compression is None
+    finally :
+        shutil.rmtree(d)
+
+def test_H5_writer_errors():
+    # errors in the writer thread are raised by flush and close
+    d    = tempfile.mkdtemp()
+    fnam = os.path.join(d, 'out.h5')
+    try :
+        writer = io_utils.H5_writer(fnam, '/phase')
+        writer.write('a', np.arange(3))
+        writer.write('a/b', np.arange(3))
+        writer.write('c', np.arange(3))
+        try :
+            writer.flush()
+        except Exception as e :
+            print('flush raised:', e)
+        else :
+            raise AssertionError('flush did not raise the write error')
+
+        # the other writes were done, and the error is only raised once
+        writer.flush()
+        writer.write('a/b', np.arange(3))
+        try :
+            writer.close()
+        except Exception as e :
+            print('close raised:', e)
+        else :
+            raise AssertionError('close did not raise the write error')
+
+        with h5py.File(fnam, 'r') as f :
+            assert np.array_equal(f['phase/c'][()], np.arange(3))
+    finally :
+        shutil.rmtree(d)
+
+def test_read_dataset():
+    d    = tempfile.mkdtemp()
+    fnam = os.path.join(d, 'in.h5')
+    try :
+        np.random.seed(1)
+        a = np.random.random((8, 9, 10))
+        with h5py.File(fnam, 'w') as f :
+            f['a']       = a
+            f['a32']     = a.astype(np.float32)
+            f.create_dataset('chunked', data = a, chunks = (4, 9, 10))
+            f.create_dataset('gzip', data = a, compression = 'gzip')
+            f['scalar']  = 2.5
+            f['empty']   = np.zeros((0, 3))
+
+        with h5py.File(fnam, 'r') as f :
+            # a copy-on-write memory map of the contiguous dataset
+            m = io_utils.read_dataset(f, 'a', mmap = True)
+            assert isinstance(m, np.memmap)
+            assert np.array_equal(m, a)
+
+            # converted to dtype as it is read (not memory mapped)
+            for key in ['a', 'a32'] :
+                out = io_utils.read_dataset(f, key, np.float64 if key == 'a32' else np.float32, mmap = True)
+                assert not isinstance(out, np.memmap)
+                assert out.dtype == (np.float64 if key == 'a32' else np.float32)
+                assert np.array_equal(out, f[key][()].astype(out.dtype))
+
+            # chunked or compressed datasets are read
+            for key in ['chunked', 'gzip'] :
+                out = io_utils.read_dataset(f, key, mmap = True)
+                assert not isinstance(out, np.memmap)
+                assert np.array_equal(out, a)
+
+            assert io_utils.read_dataset(f, 'scalar') == 2.5
+            assert io_utils.read_dataset(f, 'empty', np.float32).shape == (0, 3)
+
+        # the memory map is still valid after the file is closed
+        # and writing to it does not change the file
+        assert np.array_equal(m, a)
+        m[0] = 0
+        assert np.all(m[0] == 0)
+        del m
+        with h5py.File(fnam, 'r') as f :
+            assert np.array_equal(f['a'][()], a)
+    finally :
+        shutil.rmtree(d)
+
+
+if __name__ == '__main__':
+    for name, f in sorted(list(globals().items())):
+        if name.startswith('test_') and callable(f):
+            print('\n' + name)
+            f()
+    print('\nall tests passed')
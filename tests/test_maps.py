@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+"""
+Compare the fused Cython kernels of maps.Mapper_ellipse with the
+equivalent numpy expressions.
+
+run with: python test_maps.py (or pytest)
+"""
+
+# for python 2 / 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import os, sys
+
+# import python modules using the relative directory
+# locations, utils goes first because this directory
+# has old copies of the cython modules
+root = os.path.split(os.path.abspath(__file__))[0]
+root = os.path.split(root)[0]
+sys.path.insert(0, os.path.join(root, 'utils'))
+
+import duck_3D
+import forward_sim
+import maps
+
+from ellipse_2D_cython_new import project_2D_Ellipse_arrays_cython_parallel
+
+def make_input(space_group = 'P212121', shape = (16, 16, 16), unit_cell = (8, 8, 8), seed = 1):
+    """
+    The diffraction of a small duck crystal and the mapper arguments.
+    """
+    np.random.seed(seed)
+    duck  = duck_3D.make_3D_duck(shape = (4, 5, 5))
+    solid = np.zeros(shape, dtype = np.complex128)
+    solid[:duck.shape[0], :duck.shape[1], :duck.shape[2]] = duck
+
+    diff, info = forward_sim.generate_diff(solid, unit_cell, 4, 1.0, space_group = space_group)
+
+    args = {'Bragg_weighting' : info['Bragg_weighting'], 'diffuse_weighting' : info['diffuse_weighting'],
+            'voxels' : info['voxels'], 'support' : info['support'],
+            'unit_cell' : unit_cell, 'space_group' : space_group, 'alpha' : 1.0e-16}
+    return diff, args
+
+def make_mapper(dtype = np.float64, space_group = 'P212121', shape = (16, 16, 16),
+                unit_cell = (8, 8, 8), seed = 1, threads = 1, **args):
+    """
+    A mapper for the diffraction of a small duck crystal, the
+    modes are initialised with random numbers.
+    """
+    diff, mapper_args = make_input(space_group, shape, unit_cell, seed)
+    mapper_args.update(args)
+    mapper = maps.Mapper_ellipse(diff, dtype = dtype, threads = threads, **mapper_args)
+    return mapper
+
+def Pmod_numpy(mapper, modes):
+    """
+    The mode-axis transform, the ellipse projection and the rescaling
+    as separate numpy steps (see maps.Mapper_ellipse.Pmod).
+    """
+    u = np.fft.fft(modes, axis=0).reshape((modes.shape[0], -1)) / np.sqrt(modes.shape[0])
+
+    x = np.sqrt((u[0] * u[0].conj()).real)
+
+    if u.shape[0] > 1 :
+        y = np.sqrt(np.sum( (u[1:] * u[1:].conj()).real, axis=0))
+    else :
+        y = np.zeros_like(x)
+
+    xp, yp, its = project_2D_Ellipse_arrays_cython_parallel(x.astype(np.float64), y.astype(np.float64),
+                                      mapper.Wx.astype(np.float64), mapper.Wy.astype(np.float64),
+                                      mapper.I_ravel.astype(np.float64), mapper.mask_ravel,
+                                      1, mapper.newton)
+
+    u[0]  = xp * np.exp(1J * np.angle(u[0]))
+    u[1:] = u[1:] * yp / (y + mapper.alpha)
+
+    u = np.fft.ifft(u, axis=0) * np.sqrt(modes.shape[0])
+    return u.reshape(modes.shape)
+
+def Imap_numpy(mapper, modes):
+    U  = np.sum(modes, axis=0)
+    I  = mapper.diffuse_weighting   * np.sum( (modes * modes.conj()).real, axis=0)
+    I += mapper.unit_cell_weighting * (U * U.conj()).real
+    return I
+
+def Emod_numpy(mapper, modes):
+    M    = Imap_numpy(mapper, modes)
+    M    = mapper.mask * ( np.sqrt(M) - mapper.amp )**2
+    eMod = np.sum( M )
+    return np.sqrt( eMod / mapper.I_norm )
+
+def test_Imap_Emod():
+    for dtype, tol in [(np.float64, 1.0e-13), (np.float32, 1.0e-5)]:
+        mapper = make_mapper(dtype)
+        modes  = mapper.modes
+        ref    = Imap_numpy(mapper, modes.astype(np.complex128))
+
+        I   = mapper.Imap(modes)
+        err = np.max(np.abs(I - ref)) / np.max(ref)
+        print('Imap', np.dtype(dtype).name, 'relative error:', err)
+        assert I.dtype == dtype and err < tol
+
+        out = np.empty(modes.shape[1:], dtype = dtype)
+        assert mapper.Imap(modes, out = out) is out and np.all(out == I)
+
+        eMod = mapper.Emod(modes)
+        ref  = Emod_numpy(mapper, modes.astype(np.complex128))
+        print('Emod', np.dtype(dtype).name, 'relative error:', abs(eMod - ref) / ref)
+        assert abs(eMod - ref) < tol * ref
+
+        out = np.empty(modes.shape[1:-1] + (2 * modes.shape[-1],), dtype = dtype)[..., ::2]
+        try :
+            mapper.Imap(modes, out = out)
+        except ValueError :
+            continue
+        raise AssertionError('Imap wrote into a non contiguous out')
+
+def test_Pmod():
+    for dtype, tol in [(np.float64, 1.0e-10), (np.float32, 1.0e-4)]:
+        for newton in [False, True]:
+            mapper = make_mapper(dtype, newton = newton)
+            modes  = mapper.modes
+
+            out = mapper.Pmod(modes)
+            ref = Pmod_numpy(mapper, modes.astype(np.complex128))
+
+            err = np.max(np.abs(out - ref)) / np.max(np.abs(ref))
+            print('Pmod', np.dtype(dtype).name, 'newton', newton, 'relative error:', err)
+            assert out.dtype == modes.dtype
+            assert err < tol
+
+            # in place
+            out2 = mapper.Pmod(modes.copy(), out = modes.copy())
+            assert np.allclose(out, out2)
+
+def test_threads():
+    # the voxels are independent, so the threaded Pmod and Imap are the
+    # same as the serial ones bit for bit (Emod is a threaded sum)
+    for dtype in [np.float64, np.float32]:
+        for newton in [False, True]:
+            mapper = make_mapper(dtype, shape = (64, 64, 64), unit_cell = (32, 32, 32), newton = newton)
+            modes  = mapper.modes
+            out    = mapper.Pmod(modes)
+            I      = mapper.Imap(modes)
+            eMod   = mapper.Emod(modes)
+            for threads in [2, 4]:
+                mapper.threads = threads
+                for repeat in range(3):
+                    assert np.array_equal(mapper.Pmod(modes), out)
+                    assert np.array_equal(mapper.Imap(modes), I)
+                    assert np.isclose(mapper.Emod(modes), eMod, rtol = 1.0e-12)
+            print(np.dtype(dtype).name, 'newton', newton, 'threads ok')
+
+def test_Pmod_out_not_contiguous():
+    mapper = make_mapper()
+    modes  = mapper.modes
+    out    = np.empty(modes.shape[:-1] + (2 * modes.shape[-1],), dtype = modes.dtype)[..., ::2]
+    try :
+        mapper.Pmod(modes, out = out)
+    except ValueError :
+        return
+    raise AssertionError('Pmod wrote into a non contiguous out')
+
+def cheshire_error_ref(mapper, s, t, Bragg_mask):
+    """
+    the Emod on the Bragg mask of the Fourier space solid s shifted by t
+    """
+    q = [np.fft.fftfreq(n) for n in s.shape]
+    T = [np.exp(- 2J * np.pi * tt * qq) for tt, qq in zip(t, q)]
+    s1    = s * np.multiply.outer(np.multiply.outer(T[0], T[1]), T[2])
+    modes = mapper.sym_ops.solid_syms_Fourier(s1, apply_translation=True)
+    U     = np.sum(modes, axis=0)
+    diff  = mapper.diffuse_weighting * np.sum( (modes * modes.conj()).real, axis=0)
+    diff += mapper.unit_cell_weighting * (U * U.conj()).real
+    m     = mapper.mask * Bragg_mask
+    eMod  = np.sum( m * (np.sqrt(diff) - mapper.amp)**2 )
+    return np.sqrt( eMod / np.sum(m * mapper.amp**2) )
+
+def test_scans_cheshire():
+    mapper = make_mapper()
+    solid  = mapper.O.real
+    points = [range(-2, 2)] * 3
+
+    O, info = mapper.scans_cheshire(solid, scan_points = points, block = 100)
+    errors  = info['error_map']
+
+    Bragg_mask = mapper.unit_cell_weighting > 1.0e-1 * mapper.unit_cell_weighting[0,0,0]
+    Bragg_mask = np.sum(mapper.sym_ops.solid_syms_Fourier(Bragg_mask, apply_translation=False), axis=0) > 0
+
+    s = np.fft.fftn(solid)
+    for i, j, k in [(0, 0, 0), (3, 1, 2), (1, 3, 0)]:
+        ref = cheshire_error_ref(mapper, s, (points[0][i], points[1][j], points[2][k]), Bragg_mask)
+        print('cheshire error', (i, j, k), errors[i, j, k], ref)
+        assert np.isclose(errors[i, j, k], ref, rtol = 1.0e-10)
+
+    # the solid is shifted to the minimum
+    i, j, k = np.unravel_index(np.argmin(errors), errors.shape)
+    ref = cheshire_error_ref(mapper, s, (points[0][i], points[1][j], points[2][k]), Bragg_mask)
+    assert np.isclose(cheshire_error_ref(mapper, np.fft.fftn(O), (0, 0, 0), Bragg_mask), ref)
+
+def choose_N_highest_pixels_ref(array, N, valid):
+    """
+    the N highest valid values, ties go to the lowest flat index
+    """
+    a   = array.ravel()
+    ind = np.flatnonzero(valid.ravel())
+    ind = ind[np.lexsort((ind, -a[ind]))][:N]
+    S   = np.zeros(a.size, dtype = bool)
+    S[ind] = True
+    return S.reshape(array.shape)
+
+def test_choose_N_highest_pixels():
+    np.random.seed(1)
+    import symmetry_operations
+    shape   = (64, 64, 48)
+    sym_ops = symmetry_operations.P212121((32, 32, 24), shape)
+    support = np.random.random(shape) > 0.3
+
+    # continuous values and values with lots of ties
+    for array in [np.random.random(shape).astype(np.float32),
+                  np.random.randint(0, 50, shape).astype(np.float32)]:
+        syms    = sym_ops.solid_syms_real(array)
+        overlap = syms[0] == np.max(syms, axis=0)
+        for N in [0, 1, 1000, 50000, array.size]:
+            S = maps.choose_N_highest_pixels(array, N)
+            assert np.all(S == choose_N_highest_pixels_ref(array, N, np.ones(shape, dtype=bool)))
+
+            S = maps.choose_N_highest_pixels(array, N, support = support)
+            assert np.all(S == choose_N_highest_pixels_ref(array, N, support))
+
+            S  = maps.choose_N_highest_pixels(array, N, support = support, mapper = sym_ops.solid_syms_real)
+            S2 = maps.choose_N_highest_pixels(array, N, support = support, overlap_mask = sym_ops.overlap_mask_real)
+            ref = choose_N_highest_pixels_ref(array, N, support * overlap)
+            assert np.all(S == ref) and np.all(S2 == ref)
+            print('N', N, 'voxels', np.sum(S))
+
+
+if __name__ == '__main__':
+    for name, f in sorted(list(globals().items())):
+        if name.startswith('test_') and callable(f):
+            print('\n' + name)
+            f()
+    print('\nall tests passed')
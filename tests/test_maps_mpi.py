@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+"""
+Compare maps_mpi.Mapper_ellipse_mpi, with the volumes split into slabs
+over the MPI ranks, with maps.Mapper_ellipse.
+
+run with: mpirun -np 3 python test_maps_mpi.py (or pytest for one rank)
+"""
+
+# for python 2 / 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import os, sys
+
+# import python modules using the relative directory
+# locations, utils goes first because this directory
+# has old copies of the cython modules, then process
+# (utils has an old phase.py)
+root = os.path.split(os.path.abspath(__file__))[0]
+root = os.path.split(root)[0]
+sys.path.insert(0, os.path.join(root, 'utils'))
+
+from test_maps import make_input
+import maps
+
+try :
+    from mpi4py import MPI
+    import maps_mpi
+except ImportError :
+    maps_mpi = None
+
+sys.path.insert(0, os.path.join(root, 'process'))
+import phase
+
+def make_mappers(**args):
+    """
+    The serial and the distributed mapper for the same input and
+    starting object (no overlap constraint).
+    """
+    diff, mapper_args = make_input()
+    mapper_args.update(args)
+    mapper_args['solid_unit'] = np.random.RandomState(2).random_sample(diff.shape)
+
+    serial = maps.Mapper_ellipse(diff, threads = 1, **mapper_args)
+    mpi    = maps_mpi.Mapper_ellipse_mpi(diff, threads = 1, **mapper_args)
+    return serial, mpi
+
+def gather_modes(mapper, modes):
+    out = [mapper.gather(m) for m in modes]
+    if mapper.rank == 0 :
+        return np.array(out)
+
+def test_projections():
+    if maps_mpi is None :
+        return
+    serial, mpi = make_mappers()
+    assert np.isclose(mpi.Emod(mpi.modes), serial.Emod(serial.modes), rtol = 1.0e-10)
+
+    modes  = mpi.Psup(mpi.modes)
+    modes  = gather_modes(mpi, mpi.Pmod(modes))
+    O      = mpi.gather(mpi.O)
+    ref    = serial.Pmod(serial.Psup(serial.modes))
+    if mpi.rank == 0 :
+        assert np.allclose(modes, ref, rtol = 0, atol = 1.0e-10 * np.max(np.abs(ref)))
+        assert np.allclose(O, serial.O, rtol = 0, atol = 1.0e-10 * np.max(np.abs(serial.O)))
+
+def test_scans_cheshire():
+    if maps_mpi is None :
+        return
+    serial, mpi = make_mappers()
+    points = [range(-2, 2)] * 3
+
+    O, info      = mpi.scans_cheshire(mpi.O.real, scan_points = points, block = 100)
+    O_ref, ref   = serial.scans_cheshire(serial.O.real, scan_points = points)
+    assert np.allclose(info['error_map'], ref['error_map'], rtol = 1.0e-10)
+    assert np.isclose(info['eMod'][0], ref['eMod'][0], rtol = 1.0e-10)
+
+    O = mpi.gather(O)
+    if mpi.rank == 0 :
+        assert np.allclose(O, O_ref)
+
+def test_phase():
+    # the default schedule, with a Cheshire scan
+    if maps_mpi is None :
+        return
+    serial, mpi = make_mappers()
+    iters = '5DM 1cheshire 5ERA 3RAAR'
+
+    O, mapper, eMod, eCon, info         = phase.phase(mpi, iters, cheshire_scan = 2)
+    O_ref, s, eMod_ref, eCon_ref, i_ref = phase.phase(serial, iters, cheshire_scan = 2)
+    print('eMod', eMod[-1], eMod_ref[-1])
+    assert np.allclose(eMod, eMod_ref, rtol = 1.0e-8)
+    assert np.allclose(info['Cheshire_error_map'], i_ref['Cheshire_error_map'], rtol = 1.0e-8)
+
+    O = mpi.gather(O)
+    if mpi.rank == 0 :
+        assert np.allclose(O, O_ref, rtol = 0, atol = 1.0e-8 * np.max(np.abs(O_ref)))
+
+def test_phase_starts_mpi():
+    # more starts than ranks, the solutions are gathered (in start
+    # order) and sorted as by phase_starts
+    if maps_mpi is None :
+        return
+    comm = MPI.COMM_WORLD
+    diff, args = make_input()
+    args['threads'] = 1
+    iters  = '5DM 1cheshire 5ERA'
+    starts = 2 * comm.Get_size() + 1
+
+    out = phase.phase_starts_mpi(diff, args, iters, 1, 1, starts = starts, seed = 3, comm = comm)
+    if comm.Get_rank() == 0 :
+        O, Os, eMods, eCons, PRTF = out
+        O_ref, Os_ref, eMods_ref, eCons_ref, PRTF_ref = phase.phase_starts(diff, args, iters, 1, 1,
+                                                                           starts = starts, processes = 1, seed = 3)
+        assert len(Os) == starts
+        assert np.allclose(eMods, eMods_ref, rtol = 1.0e-10, atol = 0)
+        assert np.allclose(eCons, eCons_ref, rtol = 1.0e-10, atol = 0)
+        assert np.allclose(Os, Os_ref)
+        assert np.allclose(O, O_ref)
+    else :
+        assert out is None
+
+class Rows():
+    """
+    an array like that records the slices of the first axis that are read
+    """
+    def __init__(self, a):
+        self.a     = a
+        self.shape = a.shape
+        self.ndim  = a.ndim
+        self.keys  = []
+
+    def __getitem__(self, key):
+        self.keys.append(key)
+        return self.a[key]
+
+def test_slab_reads():
+    # each rank only reads its slab of the input volumes
+    if maps_mpi is None :
+        return
+    diff, mapper_args = make_input()
+    volumes = ['Bragg_weighting', 'diffuse_weighting', 'support']
+    for k in volumes :
+        mapper_args[k] = Rows(mapper_args[k])
+    I = Rows(diff)
+
+    mpi = maps_mpi.Mapper_ellipse_mpi(I, threads = 1, **mapper_args)
+    lo, hi = mpi.rows[mpi.rank], mpi.rows[mpi.rank+1]
+    for a in [I] + [mapper_args[k] for k in volumes] :
+        assert len(a.keys) > 0 and all(key == slice(lo, hi) for key in a.keys), a.keys
+
+def test_read_input_slabs():
+    # read_input(slabs = True) returns the h5py datasets for the mapper
+    if maps_mpi is None :
+        return
+    import h5py, tempfile
+    comm = MPI.COMM_WORLD
+    diff, mapper_args = make_input()
+
+    fnam = None
+    if comm.Get_rank() == 0 :
+        fnam = os.path.join(tempfile.mkdtemp(), 'input.h5')
+        with h5py.File(fnam, 'w') as f :
+            f['data']              = diff
+            f['support']           = mapper_args['support']
+            f['bragg_weighting']   = mapper_args['Bragg_weighting']
+            f['diffuse_weighting'] = mapper_args['diffuse_weighting']
+    fnam = comm.bcast(fnam, root = 0)
+
+    params = {'input_file' : fnam, 'dtype' : None, 'data' : '/data', 'solid_unit' : None,
+              'mask' : None, 'voxels' : int(mapper_args['voxels']), 'support' : '/support',
+              'bragg_weighting' : '/bragg_weighting', 'diffuse_weighting' : '/diffuse_weighting',
+              'overlap' : None, 'unit_cell' : mapper_args['unit_cell'],
+              'space_group' : mapper_args['space_group'], 'alpha' : mapper_args['alpha']}
+    I, args = phase.read_input(None, params, slabs = True)
+    assert isinstance(I, h5py.Dataset)
+    args['threads'] = 1
+
+    mpi = maps_mpi.Mapper_ellipse_mpi(I, **args)
+    I.file.close()
+
+    mapper_args['solid_unit'] = mpi.gather(mpi.O)
+    if mpi.rank == 0 :
+        serial = maps.Mapper_ellipse(diff, threads = 1, **mapper_args)
+        eMod   = serial.Emod(serial.modes)
+    else :
+        eMod   = None
+    assert np.isclose(mpi.Emod(mpi.modes), comm.bcast(eMod, root = 0), rtol = 1.0e-10)
+
+    comm.Barrier()
+    if comm.Get_rank() == 0 :
+        os.remove(fnam)
+        os.rmdir(os.path.dirname(fnam))
+
+
+if __name__ == '__main__':
+    for name, f in sorted(list(globals().items())):
+        if name.startswith('test_') and callable(f):
+            print('\n' + name)
+            f()
+    print('\nall tests passed')
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+"""
+Check the schedule parser of process/phase.py.
+
+run with: python test_phase.py (or pytest)
+"""
+
+# for python 2 / 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import os, sys
+import shutil, tempfile
+
+# import python modules using the relative directory
+# locations, utils goes first because this directory
+# has old copies of the cython modules, then process
+# (utils has an old phase.py)
+root = os.path.split(os.path.abspath(__file__))[0]
+root = os.path.split(root)[0]
+sys.path.insert(0, os.path.join(root, 'utils'))
+sys.path.insert(0, os.path.join(root, 'process'))
+
+import phase
+import io_utils
+
+from test_maps import make_mapper, make_input
+import maps
+
+def test_parse_schedule():
+    steps = phase.parse_schedule('1000DM(plateau[20]<1e-3, time>600) 1cheshire 100ERA(eCon<1e-8) 200RAAR(beta=0.8)')
+    assert steps == [['DM', 1000, [('plateau', 20, '<', 1e-3), ('time', None, '>', 600.)], {}],
+                     ['cheshire', 1, [], {}],
+                     ['ERA', 100, [('eCon', None, '<', 1e-8)], {}],
+                     ['RAAR', 200, [], {'beta': 0.8}]]
+
+    assert phase.parse_schedule(' 50DM  1cheshire 10ERA ') == phase.parse_schedule('50DM 1cheshire 10ERA')
+    assert phase.config_iters_to_alg_num('50DM 10ERA') == [['DM', 50], ['ERA', 10]]
+    assert phase.parse_schedule('') == []
+
+def test_parse_schedule_errors():
+    # unparsed text is an error rather than being dropped
+    for string in ['50DM foo 10ERA', 'DM50', '50DM 10', '50DM(eMod<1', '50DM(eMod>1)', '50DM(time[2]>1)']:
+        try :
+            phase.parse_schedule(string)
+        except ValueError as e :
+            print(e)
+            continue
+        raise AssertionError('parse_schedule accepted: ' + string)
+
+def test_merge_starts():
+    # the starts are sorted by their final eMod and the best are merged
+    np.random.seed(1)
+    Os    = np.random.random((4, 8, 8, 8))
+    eMods = [[5., 3.], [4., 1.], [6., 4.], [7., 2.]]
+    eCons = [[0.], [1.], [2.], [3.]]
+    O, Os_out, eMods_out, eCons_out, PRTF = phase._merge_starts(Os.copy(), eMods, eCons, 2)
+
+    order = [1, 3, 0, 2]
+    assert np.array_equal(Os_out, Os[order])
+    assert eMods_out == [eMods[i] for i in order]
+    assert eCons_out == [[1.], [3.], [0.], [2.]]
+
+    O_ref, PRTF_ref = phase.phasing_3d.utils.merge.merge_sols(Os[[1, 3]].copy())
+    assert np.allclose(O, O_ref)
+
+def test_phase_starts():
+    # each start is phase with the seed seed + start, sorted by the final eMod
+    diff, args = make_input()
+    args['threads'] = 1
+    iters = '5DM 1cheshire 5ERA'
+    seed  = 3
+    starts = 3
+
+    Os_ref, eMods_ref = [], []
+    for s in range(starts):
+        np.random.seed(seed + s)
+        mapper = maps.Mapper_ellipse(diff, **args)
+        O, mapper, eMod, eCon, info = phase.phase(mapper, iters, 1, 1)
+        Os_ref.append(O)
+        eMods_ref.append(eMod)
+    order = np.argsort([e[-1] for e in eMods_ref])
+    assert len(set(e[-1] for e in eMods_ref)) == starts
+
+    for processes in [1, 2]:
+        O, Os, eMods, eCons, PRTF = phase.phase_starts(diff, args, iters, 1, 1, starts = starts,
+                                                       processes = processes, seed = seed)
+        assert np.allclose(eMods, [eMods_ref[i] for i in order], rtol = 1.0e-10, atol = 0)
+        assert np.allclose(Os, np.array(Os_ref)[order])
+        assert O.shape == diff.shape
+
+def test_read_input_mmap():
+    # with mmap_input the stored volumes are memory mapped, and the
+    # mapper is the same as for the arrays read into memory
+    import h5py
+    diff, mapper_args = make_input()
+    d    = tempfile.mkdtemp()
+    fnam = os.path.join(d, 'input.h5')
+    try :
+        with h5py.File(fnam, 'w') as f :
+            f['data']              = diff
+            f['support']           = mapper_args['support']
+            f['bragg_weighting']   = mapper_args['Bragg_weighting']
+            f['diffuse_weighting'] = mapper_args['diffuse_weighting'].astype(np.float32)
+
+        params = {'input_file' : fnam, 'dtype' : None, 'data' : '/data', 'solid_unit' : None,
+                  'mask' : None, 'voxels' : int(mapper_args['voxels']), 'support' : '/support',
+                  'bragg_weighting' : '/bragg_weighting', 'diffuse_weighting' : '/diffuse_weighting',
+                  'overlap' : None, 'unit_cell' : mapper_args['unit_cell'],
+                  'space_group' : mapper_args['space_group'], 'alpha' : mapper_args['alpha'],
+                  'threads' : 1}
+        I_ref, args_ref = phase.read_input(None, params)
+
+        params['mmap_input'] = True
+        I, args = phase.read_input(None, params)
+
+        # the float32 weighting is converted as it is read
+        assert isinstance(I, np.memmap) and isinstance(args['support'], np.memmap)
+        assert isinstance(args['Bragg_weighting'], np.memmap)
+        assert not isinstance(args['diffuse_weighting'], np.memmap)
+        assert args['diffuse_weighting'].dtype == np.float64
+
+        np.random.seed(3)
+        mapper_ref = maps.Mapper_ellipse(I_ref, **args_ref)
+        np.random.seed(3)
+        mapper     = maps.Mapper_ellipse(I, **args)
+        assert np.allclose(mapper.Emod(mapper.modes), mapper_ref.Emod(mapper_ref.modes), rtol = 1.0e-12, atol = 0)
+        del I, args, mapper
+    finally :
+        shutil.rmtree(d)
+
+def test_make_stop():
+    assert phase.make_stop([]) is None
+
+    stop = phase.make_stop(phase.parse_schedule('1DM(eMod<1e-3)')[0][2])
+    assert not stop([], [])
+    assert not stop([1., 2e-3], [0., 0.])
+    assert stop([1., 5e-4], [1., 1.])
+
+    stop = phase.make_stop(phase.parse_schedule('1DM(eCon<1e-3)')[0][2])
+    assert not stop([0., 0.], [1., 2e-3])
+    assert stop([1., 1.], [1., 5e-4])
+
+    # the relative change of eMod over the last 3 iterations
+    stop = phase.make_stop([('plateau', 3, '<', 0.1)])
+    assert not stop([1., 1., 1.], [0.] * 3)
+    assert not stop([1., 1., 1., 0.85], [0.] * 4)
+    assert stop([1., 1., 1., 0.95], [0.] * 4)
+    assert stop([2., 1., 1., 1., 0.95], [0.] * 5)
+
+    # across a block boundary eMod_prev is combined with the current block
+    stop = phase.make_stop([('plateau', 3, '<', 0.1)], eMod_prev = [1., 1., 1.])
+    assert not stop([], [])
+    assert not stop([0.85], [0.])
+    assert stop([0.95], [0.])
+    stop = phase.make_stop([('plateau', 3, '<', 0.1)], eMod_prev = [2., 1., 1.])
+    assert not stop([1.], [0.])
+    assert stop([1., 0.95], [0.] * 2)
+
+    # the time since t0
+    import time
+    stop = phase.make_stop([('time', None, '>', 10.)])
+    assert not stop([1.], [1.])
+    stop = phase.make_stop([('time', None, '>', 10.)], t0 = time.time() - 11.)
+    assert stop([1.], [1.])
+
+    # any one of the conditions
+    stop = phase.make_stop([('eMod', None, '<', 1e-3), ('time', None, '>', 10.)], t0 = time.time() - 11.)
+    assert stop([1.], [1.])
+
+class Interrupt(Exception):
+    pass
+
+def test_checkpoint_resume():
+    # an interrupted run that is resumed from its last checkpoint
+    # gives the same errors as an uninterrupted run
+    iters = '10DM 1cheshire 10ERA 4RAAR'
+    d     = tempfile.mkdtemp()
+    write_checkpoint = phase.write_checkpoint
+    try :
+        fnam   = os.path.join(d, 'ref.h5')
+        writer = io_utils.H5_writer(fnam, '/phase')
+        O_ref, mapper, eMod_ref, eCon_ref, info = phase.phase(make_mapper(), iters, cheshire_scan = 2,
+                                                              checkpoint = 3, checkpoint_file = fnam,
+                                                              writer = writer)
+        writer.close()
+        assert len(eMod_ref) == 25
+
+        # stop after the fifth checkpoint (part way through ERA)
+        fnam   = os.path.join(d, 'out.h5')
+        writer = io_utils.H5_writer(fnam, '/phase')
+        calls  = []
+        def interrupt(*args, **kwargs):
+            write_checkpoint(*args, **kwargs)
+
+            # the history in the file agrees with the checkpoint
+            f = writer.f
+            assert np.array_equal(f['/phase/eMod'][()], f['/phase/checkpoint/eMod'][()])
+            calls.append(int(f['/phase/checkpoint/step'][()]))
+            if len(calls) == 5 :
+                raise Interrupt()
+        phase.write_checkpoint = interrupt
+        try :
+            phase.phase(make_mapper(), iters, cheshire_scan = 2, checkpoint = 3,
+                        checkpoint_file = fnam, writer = writer)
+        except Interrupt :
+            pass
+        else :
+            raise AssertionError('the run was not interrupted')
+        finally :
+            phase.write_checkpoint = write_checkpoint
+            writer.close()
+        assert calls[-1] == 2
+
+        # resume with a different random start
+        writer = io_utils.H5_writer(fnam, '/phase')
+        O, mapper, eMod, eCon, info = phase.phase(make_mapper(seed = 2), iters, cheshire_scan = 2,
+                                                  checkpoint = 3, checkpoint_file = fnam,
+                                                  resume = True, writer = writer)
+        writer.close()
+        assert np.allclose(eMod, eMod_ref, rtol = 1.0e-10, atol = 0)
+        assert np.allclose(eCon, eCon_ref, rtol = 1.0e-10, atol = 0)
+        assert np.allclose(O, O_ref)
+
+        import h5py
+        with h5py.File(fnam, 'r') as f :
+            assert np.allclose(f['/phase/eMod'][()], eMod_ref, rtol = 1.0e-10, atol = 0)
+    finally :
+        phase.write_checkpoint = write_checkpoint
+        shutil.rmtree(d)
+
+
+if __name__ == '__main__':
+    for name, f in sorted(list(globals().items())):
+        if name.startswith('test_') and callable(f):
+            print('\n' + name)
+            f()
+    print('\nall tests passed')
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Compare the in place updates of the phasing_3d algorithms with
+the textbook expressions, for maps.Mapper_ellipse (numpy array
+modes) and the generic phasing_3d Mapper (dict modes).
+
+run with: python test_phasing.py (or pytest)
+"""
+
+# for python 2 / 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import os, sys
+
+# import python modules using the relative directory
+# locations, utils goes first because this directory
+# has old copies of the cython modules
+root = os.path.split(os.path.abspath(__file__))[0]
+root = os.path.split(root)[0]
+sys.path.insert(0, os.path.join(root, 'utils'))
+
+import phasing_3d
+from phasing_3d.src.mappers import Mapper
+
+from test_maps import make_mapper
+
+def make_generic_mapper(seed = 1):
+    """
+    the generic phasing_3d Mapper for a small random object
+    """
+    np.random.seed(seed)
+    O = np.zeros((16, 16, 16))
+    O[:4, :5, :3] = np.random.random((4, 5, 3))
+    I = np.abs(np.fft.fftn(O))**2
+    S = np.zeros(O.shape, dtype = bool)
+    S[:6, :6, :6] = True
+    return Mapper(I, dtype = np.float64, c_dtype = np.complex128, support = S)
+
+def mappers():
+    return [make_mapper, make_generic_mapper]
+
+def DM_ref(iters, mapper, beta = 1):
+    """
+    f += beta (Pm Rs f - Ps Rm f), returns the eMods
+    """
+    modes     = mapper.modes
+    modes_sup = mapper.Psup(modes)
+    modes_mod = mapper.Pmod(modes)
+    eMods     = []
+    for i in range(iters):
+        if beta == 1 :
+            modes += mapper.Pmod(modes_sup * 2 - modes) - modes_sup
+            modes_sup = mapper.Psup(modes)
+            eMods.append(mapper.Emod(modes_sup))
+        else :
+            a = mapper.Pmod(modes_sup + (modes_sup - modes) * (1/beta))
+            b = mapper.Psup(modes_mod - (modes_mod - modes) * (1/beta))
+            modes += (a - b) * beta
+            modes_sup = mapper.Psup(modes)
+            modes_mod = mapper.Pmod(modes)
+            eMods.append(mapper.Emod(b))
+    return eMods
+
+def RAAR_ref(iters, mapper, beta = 0.87):
+    """
+    f = beta (f + Ps Rm f - Pm f) + (1 - beta) Pm f, returns the eMods
+    """
+    modes = mapper.modes
+    eMods = []
+    for i in range(iters):
+        modes_mod = mapper.Pmod(modes)
+        modes_sup = mapper.Psup(modes_mod * 2 - modes)
+        modes    += modes_sup - modes_mod
+        modes    *= beta
+        modes    += modes_mod * (1 - beta)
+        eMods.append(mapper.Emod(modes_sup))
+    return eMods
+
+def HIO_ref(iters, mapper, beta = 0.9):
+    """
+    f = f - Ps f + (1 + beta) Ps Pm f - beta Pm f, returns the eMods
+    """
+    modes = mapper.modes
+    eMods = []
+    for i in range(iters):
+        modes_mod = mapper.Pmod(modes)
+        modes_pms = mapper.Psup(modes_mod)
+        modes    += modes_pms * (1 + beta) - mapper.Psup(modes) - modes_mod * beta
+        eMods.append(mapper.Emod(modes_pms))
+    return eMods
+
+def ADMM_ref(iters, mapper, beta = 1.5):
+    """
+    f += beta (Pm (2 Ps f - f) - Ps f), returns the eMods
+    """
+    modes = mapper.modes
+    eMods = []
+    for i in range(iters):
+        modes_sup = mapper.Psup(modes)
+        modes    += (mapper.Pmod(modes_sup * 2 - modes) - modes_sup) * beta
+        eMods.append(mapper.Emod(mapper.Psup(modes)))
+    return eMods
+
+def compare(alg, ref, iters = 10, **args):
+    for make in mappers():
+        mapper = make()
+        eMods  = ref(iters, mapper, **args)
+
+        mapper = make()
+        O, info = alg(iters, mapper = mapper, **args)
+        print(make.__name__, args, 'eMod', eMods[-1], info['eMod'][-1])
+        assert len(info['eMod']) == iters
+        assert np.allclose(info['eMod'], eMods, rtol = 1.0e-8)
+
+def test_DM():
+    compare(phasing_3d.DM, DM_ref, beta = 1)
+
+def test_DM_beta():
+    compare(phasing_3d.DM, DM_ref, beta = 0.8)
+
+def test_RAAR():
+    compare(phasing_3d.RAAR, RAAR_ref, beta = 0.87)
+
+def test_HIO():
+    compare(phasing_3d.HIO, HIO_ref, beta = 0.9)
+
+def test_ADMM():
+    compare(phasing_3d.ADMM, ADMM_ref, beta = 1.5)
+
+def test_ADMM_DM():
+    # ADMM with beta = 1 is the Difference Map with beta = 1
+    for make in mappers():
+        O0, info0 = phasing_3d.DM(10, mapper = make(), beta = 1)
+        O1, info1 = phasing_3d.ADMM(10, mapper = make(), beta = 1)
+        assert np.allclose(info0['eMod'], info1['eMod'], rtol = 1.0e-10)
+        assert np.allclose(O0, O1)
+
+
+
+if __name__ == '__main__':
+    for name, f in sorted(list(globals().items())):
+        if name.startswith('test_') and callable(f):
+            print('\n' + name)
+            f()
+    print('\nall tests passed')
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+"""
+Check the gather-table symmetry operations of symmetry_operations
+against the slice and roll based implementations that they replaced,
+and the Space_group engine against P212121 and the group tables.
+
+run with: python test_symmetry_operations.py (or pytest)
+"""
+
+# for python 2 / 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import os, sys
+
+# import python modules using the relative directory
+# locations, utils goes first because this directory
+# has old copies of the cython modules
+root = os.path.split(os.path.abspath(__file__))[0]
+root = os.path.split(root)[0]
+sys.path.insert(0, os.path.join(root, 'utils'))
+
+import symmetry_operations
+from symmetry_operations import P212121, Space_group, multiply_T_fourier, multiroll, multiroll_nowrap
+
+# (unit_cell_size, det_shape) pairs, including odd sizes and
+# detectors larger than the unit-cell
+shapes = [((8,8,4), (8,8,4)), ((8,6,4), (16,12,8)), ((7,5,3), (7,5,3)), ((6,4,4), (13,9,10))]
+
+# the P212121 symmetry operations (with the translations of P212121)
+ops_P212121 = ['x,y,z', 'x-1/2,-y+1/2,-z', '-x,y-1/2,-z+1/2', '-x+1/2,-y,z-1/2']
+
+# the number of general positions of each Sohncke group:
+# the order of the point group times the number of lattice points
+# per unit-cell (hexagonal axes for R3 and R32)
+orders = {
+    'P1'    : 1,
+    'P2'    : 2,  'P21'    : 2,  'C2'    : 4,
+    'P222'  : 4,  'P2221'  : 4,  'P21212' : 4,  'P212121' : 4,
+    'C2221' : 8,  'C222'   : 8,  'F222'   : 16, 'I222'    : 8,  'I212121' : 8,
+    'P4'    : 4,  'P41'    : 4,  'P42'    : 4,  'P43'     : 4,  'I4'      : 8,  'I41' : 8,
+    'P422'  : 8,  'P4212'  : 8,  'P4122'  : 8,  'P41212'  : 8,  'P4222'   : 8,
+    'P42212': 8,  'P4322'  : 8,  'P43212' : 8,  'I422'    : 16, 'I4122'   : 16,
+    'P3'    : 3,  'P31'    : 3,  'P32'    : 3,  'R3'      : 9,
+    'P312'  : 6,  'P321'   : 6,  'P3112'  : 6,  'P3121'   : 6,  'P3212'   : 6,  'P3221' : 6,
+    'R32'   : 18,
+    'P6'    : 6,  'P61'    : 6,  'P65'    : 6,  'P62'     : 6,  'P64'     : 6,  'P63'   : 6,
+    'P622'  : 12, 'P6122'  : 12, 'P6522'  : 12, 'P6222'   : 12, 'P6422'   : 12, 'P6322' : 12,
+    'P23'   : 12, 'F23'    : 48, 'I23'    : 24, 'P213'    : 12, 'I213'    : 24,
+    'P432'  : 24, 'P4232'  : 24, 'F432'   : 96, 'F4132'   : 96, 'I432'    : 48,
+    'P4332' : 24, 'P4132'  : 24, 'I4132'  : 48,
+    }
+
+# reference implementations for P212121
+#######################################
+def flips(solid, syms):
+    # x = x
+    syms[0] = solid
+
+    # x = 0.5 + x, 0.5 - y, -z
+    syms[1][:, 0, :]  = solid[:, 0, :]
+    syms[1][:, 1:, :] = solid[:, -1:0:-1, :]
+    syms[1][:, :, 1:] = syms[1][:, :, -1:0:-1]
+
+    # x = -x, 0.5 + y, 0.5 - z
+    syms[2][0, :, :]  = solid[0, :, :]
+    syms[2][1:, :, :] = solid[-1:0:-1, :, :]
+    syms[2][:, :, 1:] = syms[2][:, :, -1:0:-1]
+
+    # x = 0.5 - x, -y, 0.5 + z
+    syms[3][0, :, :]  = solid[0, :, :]
+    syms[3][1:, :, :] = solid[-1:0:-1, :, :]
+    syms[3][:, 1:, :] = syms[3][:, -1:0:-1, :]
+    return syms
+
+def solid_syms_Fourier_ref(sym_ops, solid, apply_translation = True):
+    syms = flips(solid, np.empty((4,) + solid.shape, dtype=solid.dtype))
+
+    if apply_translation :
+        if sym_ops.translations is None :
+            sym_ops.make_Ts()
+
+        for n in range(4):
+            multiply_T_fourier(syms[n], sym_ops.translations[n], out = syms[n])
+    return syms
+
+def unflip_modes_Fourier_ref(sym_ops, U, apply_translation = True):
+    U_inv = U.copy()
+
+    if apply_translation :
+        if sym_ops.translations is None :
+            sym_ops.make_Ts()
+
+        for n in range(4):
+            multiply_T_fourier(U_inv[n], sym_ops.translations_conj[n], out = U_inv[n])
+
+    U_inv[1][:, 1:, :] = U_inv[1][:, -1:0:-1, :]
+    U_inv[1][:, :, 1:] = U_inv[1][:, :, -1:0:-1]
+
+    U_inv[2][1:, :, :] = U_inv[2][-1:0:-1, :, :]
+    U_inv[2][:, :, 1:] = U_inv[2][:, :, -1:0:-1]
+
+    U_inv[3][1:, :, :] = U_inv[3][-1:0:-1, :, :]
+    U_inv[3][:, 1:, :] = U_inv[3][:, -1:0:-1, :]
+    return U_inv
+
+def solid_syms_real_ref(sym_ops, solid):
+    """
+    pixel shifts (with multiroll) after the flips
+    """
+    syms = flips(solid, np.empty((4,) + solid.shape, dtype=solid.dtype))
+
+    u = sym_ops.unitcell_size
+    translations = [[-u[0]//2, u[1]//2, 0], [0, -u[1]//2, u[2]//2], [u[0]//2, 0, -u[2]//2]]
+
+    for i, t in enumerate(translations):
+        syms[i+1] = multiroll(syms[i+1], t)
+    return syms
+
+def solid_to_crystal_real_ref(sym_ops, solid, return_unit=False):
+    """
+    tile the unit-cell over the field-of-view with multiroll_nowrap
+    """
+    tiles = np.ceil(2*np.array(solid.shape, dtype=np.float64) / np.array(sym_ops.unitcell_size, dtype=np.float64) - 1.0).astype(np.int64)
+
+    U = np.fft.fftshift(np.sum(solid_syms_real_ref(sym_ops, solid), axis=0))
+    C = U.copy()
+    t = np.zeros_like(U)
+    for i in (np.arange(tiles[0]) - tiles[0]//2):
+        for j in (np.arange(tiles[1]) - tiles[1]//2):
+            for k in (np.arange(tiles[2]) - tiles[2]//2):
+                if i == 0 and j == 0 and k == 0 :
+                    continue
+                shift = np.array([i, j, k]) * np.array(sym_ops.unitcell_size)
+                C += multiroll_nowrap(U, shift, y = t)
+
+    C = np.fft.ifftshift(C)
+    if return_unit :
+        return C, np.fft.ifftshift(U)
+    else :
+        return C
+
+# tests
+#######
+def test_P212121_gathers():
+    np.random.seed(1)
+    for unit_cell_size, det_shape in shapes :
+        sym_ops = P212121(unit_cell_size, det_shape)
+        solid   = np.random.random(det_shape) + 1J * np.random.random(det_shape)
+
+        for t in [True, False]:
+            a = sym_ops.solid_syms_Fourier(solid, apply_translation = t)
+            b = solid_syms_Fourier_ref(sym_ops, solid, apply_translation = t)
+            print(det_shape, 'solid_syms_Fourier   :', np.allclose(a, b))
+            assert np.allclose(a, b, rtol = 1.0e-12, atol = 0)
+
+            a = sym_ops.unflip_modes_Fourier(b, apply_translation = t)
+            b = unflip_modes_Fourier_ref(sym_ops, b, apply_translation = t)
+            print(det_shape, 'unflip_modes_Fourier :', np.allclose(a, b))
+            assert np.allclose(a, b, rtol = 1.0e-12, atol = 0)
+
+            # the unflipped modes are copies of the solid unit
+            assert np.allclose(a, solid[None, ...])
+
+        # inplace and with syms
+        U = sym_ops.solid_syms_Fourier(solid)
+        V = np.empty_like(U)
+        assert np.allclose(sym_ops.solid_syms_Fourier(solid, syms = V), U)
+        assert np.allclose(sym_ops.unflip_modes_Fourier(V, inplace = True), solid[None, ...])
+
+        # real space (exact)
+        a = sym_ops.solid_syms_real(solid.real)
+        b = solid_syms_real_ref(sym_ops, solid.real)
+        print(det_shape, 'solid_syms_real      :', np.all(a == b))
+        assert np.all(a == b)
+
+        # the overlap mask
+        s = np.random.random(det_shape)
+        m = sym_ops.overlap_mask_real(s)
+        S = solid_syms_real_ref(sym_ops, s)
+        assert np.all(m == (S[0] == np.max(S, axis=0)))
+        index = np.random.randint(0, s.size, 100)
+        assert np.all(sym_ops.overlap_mask_real(s, index) == m.ravel()[index])
+
+def test_P212121_solid_to_crystal_real():
+    np.random.seed(1)
+    for unit_cell_size, det_shape in shapes :
+        sym_ops = P212121(unit_cell_size, det_shape)
+        solid   = np.random.random(det_shape)
+
+        C, U   = sym_ops.solid_to_crystal_real(solid, return_unit = True)
+        C2, U2 = solid_to_crystal_real_ref(sym_ops, solid, return_unit = True)
+        print(det_shape, 'solid_to_crystal_real:', np.allclose(C, C2), np.allclose(U, U2))
+        assert np.allclose(C, C2, rtol = 1.0e-12, atol = 0)
+        assert np.allclose(U, U2, rtol = 1.0e-12, atol = 0)
+
+        # the generic engine tiles the same unit-cell
+        C3 = Space_group(unit_cell_size, det_shape, ops = ops_P212121).solid_to_crystal_real(solid)
+        assert np.allclose(C, C3, rtol = 1.0e-12, atol = 0)
+
+def test_P212121():
+    """
+    The unit-cell made in Fourier space has the symmetries of P212121.
+    """
+    np.random.seed(1)
+    unit_cell_size = (8,8,4)
+    solid_shape    = (4,4,2)
+
+    i, j, k = [np.fft.fftfreq(u, 1./u).astype(np.int64) for u in unit_cell_size]
+    i, j, k = np.meshgrid(i, j, k, indexing='ij')
+
+    solid = np.random.random(solid_shape)
+    Solid = np.fft.fftn(solid, unit_cell_size)
+
+    sym_ops   = P212121(unit_cell_size, unit_cell_size)
+    unit_cell = np.fft.ifftn(np.sum(sym_ops.solid_syms_Fourier(Solid), axis=0))
+
+    u  = np.array(unit_cell_size)
+    u2 = u // 2
+    wrap = lambda a, d : ((a + 2 * u2[d]) % u[d]) - u2[d]
+
+    # r2 = 1/2 + x, 1/2 - y, -z
+    assert np.allclose(unit_cell[i,j,k], unit_cell[wrap(i, 0), wrap(-j, 1), -k])
+    # r3 = -x, 1/2 + y, 1/2 - z
+    assert np.allclose(unit_cell[i,j,k], unit_cell[-i, wrap(j, 1), wrap(-k, 2)])
+    # r4 = 1/2 - x, -y, 1/2 + z
+    assert np.allclose(unit_cell[i,j,k], unit_cell[wrap(-i, 0), -j, wrap(k, 2)])
+
+def test_Space_group_P212121():
+    """
+    Compare the generic space group engine with P212121, using the
+    same symmetry operations (and translations) as P212121.
+    """
+    np.random.seed(1)
+    ops = ops_P212121
+
+    for unit_cell_size, det_shape in shapes :
+        sym_ops  = P212121(unit_cell_size, det_shape)
+        sym_ops2 = Space_group(unit_cell_size, det_shape, ops = ops)
+
+        solid = np.random.random(det_shape) + 1J * np.random.random(det_shape)
+
+        U = sym_ops.solid_syms_Fourier(solid)
+        assert np.allclose(U, sym_ops2.solid_syms_Fourier(solid))
+        assert np.allclose(sym_ops.unflip_modes_Fourier(U), sym_ops2.unflip_modes_Fourier(U))
+
+        assert np.all(sym_ops.solid_syms_real(solid.real) == sym_ops2.solid_syms_real(solid.real))
+
+        i, j, k = np.random.randint(-2, 2, (3, 10))
+        assert np.allclose(sym_ops.solid_syms_Fourier_masked(solid, i, j, k),
+                           sym_ops2.solid_syms_Fourier_masked(solid, i, j, k))
+        print(det_shape, 'Space_group == P212121')
+
+def test_general_positions():
+    """
+    The generators of each Sohncke group give a group (closed under
+    composition, modulo lattice translations) of the right order.
+    """
+    assert set(orders.keys()) == set(symmetry_operations.sohncke_generators.keys())
+
+    for name in sorted(orders.keys()):
+        ops  = symmetry_operations.general_positions(*symmetry_operations.sohncke_generators[name])
+        keys = set((tuple(R.ravel()), tuple(tt % 1 for tt in t)) for R, t in ops)
+        assert len(ops) == orders[name], name
+        assert np.all(ops[0][0] == np.eye(3)) and not any(ops[0][1])
+
+        for Ra, ta in ops :
+            for Rb, tb in ops :
+                R = np.dot(Ra, Rb)
+                t = tuple((sum(Ra[d, e] * tb[e] for e in range(3)) + ta[d]) % 1 for d in range(3))
+                assert (tuple(R.ravel()), t) in keys, name
+
+def test_Space_group_sohncke():
+    """
+    For every Sohncke group: unflip(syms) returns the solid unit,
+    the Fourier space broadcast is the Fourier transform of the
+    real space one, and a point goes to R r + t.
+    """
+    np.random.seed(1)
+    shape = (12, 12, 12)
+    solid = np.random.random(shape)
+    for name in sorted(orders.keys()):
+        sym_ops = Space_group(shape, shape, name = name)
+        assert sym_ops.no_solid_units == orders[name]
+
+        Solid = np.fft.fftn(solid)
+        syms  = sym_ops.solid_syms_Fourier(Solid)
+        assert np.allclose(sym_ops.unflip_modes_Fourier(syms), Solid[None, ...]), name
+
+        real = sym_ops.solid_syms_real(solid)
+        assert np.allclose(np.fft.ifftn(syms, axes=(1,2,3)).real, real), name
+
+        # a delta function at r
+        r = np.array([1, 2, 3])
+        d = np.zeros(shape)
+        d[tuple(r)] = 1.
+        real = sym_ops.solid_syms_real(d)
+        for n, (R, t) in enumerate(zip(sym_ops.Rs, sym_ops.ts)):
+            r1 = (np.dot(R, r) + t * np.array(shape)).astype(np.int64) % np.array(shape)
+            assert real[n][tuple(r1)] == 1. and np.sum(real[n]) == 1., name
+
+        # the overlap mask
+        m = sym_ops.overlap_mask_real(solid)
+        S = sym_ops.solid_syms_real(solid)
+        assert np.all(m == (S[0] == np.max(S, axis=0))), name
+    print('checked', len(orders), 'space groups')
+
+def test_make_lattice():
+    """
+    The closed form lattice against the direct sum
+        |sum_k=1^N-1 exp(2 pi i k u q)|^2
+    along each axis (in double precision).
+    """
+    for u_pix, shape in [((8, 16, 12), (64, 64, 48)), ((5, 7, 3), (31, 29, 17))]:
+        for N in [1, 2, 5, 40]:
+            l = []
+            for u, n in zip(u_pix, shape):
+                q = np.fft.fftfreq(n)
+                s = np.sum(np.exp(2J * np.pi * u * np.arange(1, N)[:, None] * q), axis=0)
+                l.append(np.abs(s)**2)
+            ref = np.multiply.outer(np.multiply.outer(l[0], l[1]), l[2])
+
+            lattice = symmetry_operations.make_lattice(u_pix, shape, N)
+            err = np.max(np.abs(lattice - ref)) / max(1., np.max(ref))
+            print(shape, 'N', N, 'make_lattice relative error:', err)
+            assert lattice.shape == tuple(shape)
+            assert err < 1.0e-6
+
+        # the infinite lattice: only the Bragg peaks
+        lattice = symmetry_operations.make_lattice(u_pix, shape)
+        q = [np.fft.fftfreq(n) * n for n in shape]
+        peaks = [np.isclose(np.mod(u * qq / n + 0.5, 1) - 0.5, 0) for u, qq, n in zip(u_pix, q, shape)]
+        ref = np.multiply.outer(np.multiply.outer(peaks[0], peaks[1]), peaks[2])
+        assert np.all((lattice > 0) == ref)
+
+
+if __name__ == '__main__':
+    for name, f in sorted(list(globals().items())):
+        if name.startswith('test_') and callable(f):
+            print('\n' + name)
+            f()
+    print('\nall tests passed')
@@ -5,9 +5,12 @@ from __future__ import unicode_literals
 
 
 from libc.math cimport sin, cos, acos, exp, sqrt, fabs, M_PI
+from libc.stdlib cimport malloc, free
+from libc.stdio cimport printf
+from cython.parallel cimport prange, threadid
 import math
 
-cdef inline float float_max(float a, float b): return a if a >= b else b
+cdef inline float float_max(float a, float b) nogil: return a if a >= b else b
 #cdef inline float float_min(float a, float b): return a if a <= b else b
 #float_max = max
 
@@ -222,293 +225,692 @@ ctypedef np.int_t Ctype_int
 ctypedef np.float_t Ctype_float
 ctypedef np.uint8_t Ctype_bool
 
+# single or double precision input / output arrays,
+# the projection itself is always done in double precision
+ctypedef fused Ctype_real:
+    np.float32_t
+    np.float64_t
+
 cimport cython
-#@cython.boundscheck(False) # turn off bounds-checking for entire function
-#@cython.wraparound(False)  # turn off negative index wrapping for entire function
-def project_2D_Ellipse_arrays_cython_test(np.ndarray[Ctype_float, ndim=1] x, 
-                                          np.ndarray[Ctype_float, ndim=1] y,
-                                          np.ndarray[Ctype_float, ndim=1] Wx,
-                                          np.ndarray[Ctype_float, ndim=1] Wy,
-                                          np.ndarray[Ctype_float, ndim=1] I,
-                                          np.ndarray[Ctype_bool, ndim=1] mask):
-    cdef int i, flipped
-    cdef unsigned int ii
+cdef double bisection_root(double n0, double n1, double r0, double r1, 
+                           double s0, double s1, int *its) nogil:
+    """
+    Computes s, where g[s] = 0
+    g[s] = (n0 / (s + r0))^2 + (n1 / (s + r1))^2 - 1
+    
+    where s0 < s < s1, using the bisection method. 
+    The number of iterations is written to its[0].
+    """
+    cdef int i
+    cdef double s, ratio0, ratio1, g
+    s = 0.
+    for i in range(2074): # 1074, 149 for double, single precision
+        its[0] = i + 1
+        s = (s0 + s1) / 2.
+        if s == s0 or s == s1 :
+            break
+        ratio0 = n0 / (s+r0)
+        ratio1 = n1 / (s+r1)
+        g = ratio0**2 + ratio1**2 - 1.
+        if g > 0. :
+            s0 = s
+        elif g < 0.:
+            s1 = s
+        else :
+            break
+    return s
+
+cdef double newton_root(double n0, double n1, double r0, double r1, 
+                        double s0, double s1, int *its) nogil:
+    """
+    Computes s, where g[s] = 0
+    g[s] = (n0 / (s + r0))^2 + (n1 / (s + r1))^2 - 1
+    
+    where s0 < s < s1, using safeguarded Newton iterations.
+    
+    g is convex and decreasing for s > -r1 and g[s0] >= 0, so
+    Newton's method started at s0 increases monotonically to 
+    the root (typically in < 10 steps). If a step leaves the 
+    bracket [s0, s1] (rounding errors, or a degenerate g) then 
+    finish with bisection on the current bracket. 
+    The number of iterations is written to its[0].
+    """
+    cdef int i, its_b = 0
+    cdef double s, sn, ratio0, ratio1, g, dg
+    s = s0
+    for i in range(100):
+        its[0] = i + 1
+        ratio0 = n0 / (s+r0)
+        ratio1 = n1 / (s+r1)
+        g = ratio0**2 + ratio1**2 - 1.
+        if g == 0. :
+            return s
+        
+        # keep track of the bracket
+        if g > 0. :
+            s0 = s
+        else :
+            s1 = s
+        
+        dg = -2. * (ratio0**2 / (s+r0) + ratio1**2 / (s+r1))
+        sn = s - g / dg
+        
+        # safeguard (this is also False for nan's)
+        if not (sn >= s0 and sn <= s1) :
+            break
+        
+        # convergence is quadratic, so once the step is this small 
+        # the error in sn is at the level of rounding errors 
+        # (a tighter test can stall with sn oscillating by a few ulps)
+        if fabs(sn - s) <= 1.0e-12 * (fabs(sn) + r1) :
+            return sn
+        s = sn
+    
+    s = bisection_root(n0, n1, r0, r1, s0, s1, &its_b)
+    its[0] += its_b
+    return s
+
+cdef int project_2D_Ellipse_point(double x, double y, double Wxi, double Wyi, double Ii, int maski, 
+                                  double *u, double *v, int newton = 0) nogil:
+    """
+    Project the point (x, y) onto the ellipse Wxi x**2 + Wyi y**2 = Ii, 
+    the result is written to u[0] and v[0]. This is the per-voxel 
+    kernel of project_2D_Ellipse_arrays_cython_test.
+    
+    If newton is 1 then the root is found with newton_root
+    rather than bisection_root.
+
+    Returns the number of root finding iterations (0 if the point 
+    was handled by one of the special cases).
+    """
+    cdef int flipped
+    cdef int its = 0
     cdef int x_inv = 0
     cdef int y_inv = 0
-    cdef unsigned int ii_max = <unsigned int> x.shape[0]
-    cdef double Ii, Wxi, Wyi, s0, s1, s, ratio0, ratio1, g, n0, n1, r0, r1, xp0, yp0
+    cdef double s0, s1, s, g, n0, n1, r0, r1, xp0, yp0
     cdef double e1_sq, e0_sq, one_on_ep1, one_on_ep0, ep0, ep1, tol, z0, z1, Ip, xp, yp, nn
-    cdef np.ndarray[Ctype_float, ndim = 1] u = np.empty((ii_max), dtype=np.float)
-    cdef np.ndarray[Ctype_float, ndim = 1] v = np.empty((ii_max), dtype=np.float)
-
+    cdef double xp2, yp2
+    
     tol = 1.0e-10
     
-    for ii in range(ii_max):
-        Ii, Wxi, Wyi = I[ii], Wx[ii], Wy[ii]
-        
-        if mask[ii] == 0 or (Wxi < tol and Wyi < tol):
-            u[ii] = x[ii]
-            v[ii] = y[ii]
-            continue
-        
-        elif Ii < tol :
-            if Wxi < tol :
-                u[ii] = x[ii]
-                v[ii] = 0.
-            elif Wyi < tol :
-                u[ii] = 0.
-                v[ii] = y[ii]
-            else :
-                u[ii] = 0.
-                v[ii] = 0.
-            continue
+    if maski == 0 or (Wxi < tol and Wyi < tol):
+        u[0] = x
+        v[0] = y
+        return 0
+    
+    elif Ii < tol :
+        if Wxi < tol :
+            u[0] = x
+            v[0] = 0.
+        elif Wyi < tol :
+            u[0] = 0.
+            v[0] = y
+        else :
+            u[0] = 0.
+            v[0] = 0.
+        return 0
 
-        elif Wxi < tol:
-            u[ii] = x[ii]
-            if y[ii] < 0 :
-                # how do we know if this is safe?
-                v[ii] = -sqrt(Ii)/sqrt(Wyi)
-            else :
-                v[ii] =  sqrt(Ii)/sqrt(Wyi)
-            continue
+    elif Wxi < tol:
+        u[0] = x
+        if y < 0 :
+            # how do we know if this is safe?
+            v[0] = -sqrt(Ii)/sqrt(Wyi)
+        else :
+            v[0] =  sqrt(Ii)/sqrt(Wyi)
+        return 0
 
-        elif (Wyi > tol and Wxi/Wyi < tol):
-            yp = sqrt(Ii) / sqrt(Wyi)
-            xp = sqrt(Ii) / sqrt(Wxi)
-            
-            if x[ii] > xp :
-                u[ii] = xp
-            elif x[ii] < -xp :
-                u[ii] = -xp
-            else :
-                u[ii] = x[ii]
-            
-            if y[ii] < 0 :
-                v[ii] = -yp
-            else :
-                v[ii] =  yp
-            continue
+    elif (Wyi > tol and Wxi/Wyi < tol):
+        yp = sqrt(Ii) / sqrt(Wyi)
+        xp = sqrt(Ii) / sqrt(Wxi)
         
-        elif Wyi < tol :
-            v[ii] = y[ii]
-            if x[ii] < 0 :
-                u[ii] = -sqrt(Ii)/sqrt(Wxi)
-            else :
-                u[ii] =  sqrt(Ii)/sqrt(Wxi)
-            if abs(Wxi * u[ii]**2 - Ii) > tol*Ii:
-                print('scale:',1./sqrt(Wxi), 'forward I:', Wxi * u[ii]**2, 'I:', Ii)
-            continue
+        if x > xp :
+            u[0] = xp
+        elif x < -xp :
+            u[0] = -xp
+        else :
+            u[0] = x
         
-        elif (Wxi > tol and Wyi/Wxi < tol):
-            yp = sqrt(Ii) / sqrt(Wyi)
-            xp = sqrt(Ii) / sqrt(Wxi)
-            
-            if y[ii] > yp :
-                v[ii] = yp
-            elif y[ii] < -yp :
-                v[ii] = -yp
-            else :
-                v[ii] = y[ii]
-            
-            if x[ii] < 0 :
-                u[ii] = -xp
-            else :
-                u[ii] =  xp
-            continue
-
-        elif abs(x[ii]) < tol and (Wxi < Wyi):
-            u[ii] = x[ii]
-            if y[ii] < 0 :
-                v[ii] = -sqrt(Ii)/sqrt(Wyi)
-            else :
-                v[ii] =  sqrt(Ii)/sqrt(Wyi)
-            continue
+        if y < 0 :
+            v[0] = -yp
+        else :
+            v[0] =  yp
+        return 0
+    
+    elif Wyi < tol :
+        v[0] = y
+        if x < 0 :
+            u[0] = -sqrt(Ii)/sqrt(Wxi)
+        else :
+            u[0] =  sqrt(Ii)/sqrt(Wxi)
+        if fabs(Wxi * u[0]**2 - Ii) > tol*Ii:
+            printf("scale: %g forward I: %g I: %g\n", 1./sqrt(Wxi), Wxi * u[0]**2, Ii)
+        return 0
+    
+    elif (Wxi > tol and Wyi/Wxi < tol):
+        yp = sqrt(Ii) / sqrt(Wyi)
+        xp = sqrt(Ii) / sqrt(Wxi)
         
-        elif abs(y[ii]) < tol and (Wyi < Wxi):
-            v[ii] = y[ii]
-            if x[ii] < 0 :
-                u[ii] = -sqrt(Ii)/sqrt(Wxi)
-            else :
-                u[ii] =  sqrt(Ii)/sqrt(Wxi)
-            continue
+        if y > yp :
+            v[0] = yp
+        elif y < -yp :
+            v[0] = -yp
+        else :
+            v[0] = y
         
-                 
-        # transpose axes so that e0 > e1 
-        # ------------------------------
-        if Wyi >= Wxi :
-            flipped = 0
-            ep0 = sqrt(Ii)/sqrt(Wxi)
-            ep1 = sqrt(Ii)/sqrt(Wyi)
-            one_on_ep0 = sqrt(Wxi)/sqrt(Ii)
-            one_on_ep1 = sqrt(Wyi)/sqrt(Ii)
-            e0_sq      = Ii/Wxi
-            e1_sq      = Ii/Wyi
-            r0 = Wyi/Wxi
-            xp = x[ii]
-            yp = y[ii]
+        if x < 0 :
+            u[0] = -xp
         else :
-            flipped = 1
-            ep0 = sqrt(Ii)/sqrt(Wyi)
-            ep1 = sqrt(Ii)/sqrt(Wxi)
-            one_on_ep1 = sqrt(Wxi)/sqrt(Ii)
-            one_on_ep0 = sqrt(Wyi)/sqrt(Ii)
-            e0_sq      = Ii/Wyi
-            e1_sq      = Ii/Wxi
-            r0 = Wxi/Wyi
-            xp = y[ii]
-            yp = x[ii]
-            
-        # invert the axes so that all y >= 0
-        # ----------------------------------
-        if yp < 0 :
-            y_inv = 1
-            yp = -yp
+            u[0] =  xp
+        return 0
+
+    elif fabs(x) < tol and (Wxi < Wyi):
+        u[0] = x
+        if y < 0 :
+            v[0] = -sqrt(Ii)/sqrt(Wyi)
         else :
-            y_inv = 0
-            
-        if xp < 0 :
-            x_inv = 1
-            xp = -xp        
+            v[0] =  sqrt(Ii)/sqrt(Wyi)
+        return 0
+    
+    elif fabs(y) < tol and (Wyi < Wxi):
+        v[0] = y
+        if x < 0 :
+            u[0] = -sqrt(Ii)/sqrt(Wxi)
         else :
-            x_inv = 0
+            u[0] =  sqrt(Ii)/sqrt(Wxi)
+        return 0
+    
+             
+    # transpose axes so that e0 > e1 
+    # ------------------------------
+    if Wyi >= Wxi :
+        flipped = 0
+        ep0 = sqrt(Ii)/sqrt(Wxi)
+        ep1 = sqrt(Ii)/sqrt(Wyi)
+        one_on_ep0 = sqrt(Wxi)/sqrt(Ii)
+        one_on_ep1 = sqrt(Wyi)/sqrt(Ii)
+        e0_sq      = Ii/Wxi
+        e1_sq      = Ii/Wyi
+        r0 = Wyi/Wxi
+        xp = x
+        yp = y
+    else :
+        flipped = 1
+        ep0 = sqrt(Ii)/sqrt(Wyi)
+        ep1 = sqrt(Ii)/sqrt(Wxi)
+        one_on_ep1 = sqrt(Wxi)/sqrt(Ii)
+        one_on_ep0 = sqrt(Wyi)/sqrt(Ii)
+        e0_sq      = Ii/Wyi
+        e1_sq      = Ii/Wxi
+        r0 = Wxi/Wyi
+        xp = y
+        yp = x
+        
+    # invert the axes so that all y >= 0
+    # ----------------------------------
+    if yp < 0 :
+        y_inv = 1
+        yp = -yp
+    else :
+        y_inv = 0
+        
+    if xp < 0 :
+        x_inv = 1
+        xp = -xp        
+    else :
+        x_inv = 0
 
-        xp0 = xp
-        yp0 = yp
-            
-        if yp < tol :
-            n0 = ep0 * xp
-            n1 = e0_sq - e1_sq
-            if n0 < n1 :
-                z0 = n0 / n1
-                xp = ep0 * z0
-                yp = ep1 * sqrt(1. - z0*z0)
-                #print('projecting from the x-axis')
-            else :
-                xp = ep0
-                yp = 0.
+    xp0 = xp
+    yp0 = yp
+        
+    if yp < tol :
+        n0 = ep0 * xp
+        n1 = e0_sq - e1_sq
+        if n0 < n1 :
+            z0 = n0 / n1
+            xp = ep0 * z0
+            yp = ep1 * sqrt(1. - z0*z0)
+            #print('projecting from the x-axis')
         else :
-            # change variables
-            # ----------------
-            # if x or y < tol then clip
-            #tol = 1.0e-10
-            #if yp < tol : yp = tol
-            #if xp < tol : xp = tol
-         
-            z0 = xp * one_on_ep0
-            z1 = yp * one_on_ep1
-            
-            g = z0*z0 + z1*z1 - 1.
+            xp = ep0
+            yp = 0.
+    else :
+        # change variables
+        # ----------------
+        # if x or y < tol then clip
+        #tol = 1.0e-10
+        #if yp < tol : yp = tol
+        #if xp < tol : xp = tol
+     
+        z0 = xp * one_on_ep0
+        z1 = yp * one_on_ep1
+        
+        g = z0*z0 + z1*z1 - 1.
 
-            if abs(g) < tol :
-                u[ii] = x[ii]
-                v[ii] = y[ii]
-                continue
-            
-            # in general r = (e's / e_N)**2
-            #r0 = (ep0 / ep1)**2
-            r1 = 1. 
-            
-            #sbar = bisection(r, z, g)
-            
-            n0 = r0 * z0
-            n1 = r1 * z1
-            s0 = z1 - 1.
-            if g < 0 : 
-                s1 = 0. 
-            else  :
-                # calculate the 'robust length' of r * z
-                nn = float_max(n0, n1)
-                s1 = abs(nn) * sqrt( (n0/nn)**2 + (n1/nn)**2 ) - 1.
-            s = 0.
-            
-            #print('s0, s1, r0, r1, s+r0, s+r1, ep0, ep1, xp, yp, z1', s0, s1, r0, r1, s+r0, s+r1, ep0, ep1, xp, yp, z1)
-            
-            for i in range(2074): # 1074, 149 for double, single precision
-                s = (s0 + s1) / 2.
-                if s == s0 or s == s1 :
-                    break
-                ratio0 = n0 / (s+r0)
-                ratio1 = n1 / (s+r1)
-                g = ratio0**2 + ratio1**2 - 1.
-                if g > 0. :
-                    s0 = s
-                elif g < 0.:
-                    s1 = s
-                else :
-                    break
-            
-            xp = r0 * xp / (s + r0)
-            yp = r1 * yp / (s + r1)
+        if fabs(g) < tol :
+            u[0] = x
+            v[0] = y
+            return 0
         
-        #print(x_out, y_out, xp, yp, ep0, ep1, g)
+        # in general r = (e's / e_N)**2
+        #r0 = (ep0 / ep1)**2
+        r1 = 1. 
         
-        # do an additional projection onto the ellipse surface
-        # for numerical stability when xp or yp ~ 0
-        #n0 = xp*one_on_ep0 
-        #n1 = yp*one_on_ep1 
-        #nn = float_max(n0, n1)
-        #Ip = nn * sqrt((n0/nn)**2 + (n1/nn)**2)
-        if flipped == 0 :
-            Ip = Wxi*xp**2 + Wyi*yp**2
-        else :
-            Ip = Wyi*xp**2 + Wxi*yp**2
-        
-        if abs(Ip - Ii) > tol :
-            #print('Ip != 1', Ii, Ip)
-            Ip = sqrt(Ii) / sqrt(Ip)
-            xp *= Ip 
-            yp *= Ip
-        
-        # compare with Wx=0 projection
-        xp2 = xp0
-        if flipped == 0 :
-            yp2 = sqrt(I[ii] - Wx[ii]*xp2**2)/sqrt(Wy[ii])
+        #sbar = bisection(r, z, g)
+        
+        n0 = r0 * z0
+        n1 = r1 * z1
+        s0 = z1 - 1.
+        if g < 0 : 
+            s1 = 0. 
+        else  :
+            # calculate the 'robust length' of r * z
+            nn = float_max(n0, n1)
+            s1 = fabs(nn) * sqrt( (n0/nn)**2 + (n1/nn)**2 ) - 1.
+        s = 0.
+        
+        #print('s0, s1, r0, r1, s+r0, s+r1, ep0, ep1, xp, yp, z1', s0, s1, r0, r1, s+r0, s+r1, ep0, ep1, xp, yp, z1)
+        
+        if newton :
+            s = newton_root(n0, n1, r0, r1, s0, s1, &its)
         else :
-            yp2 = sqrt(I[ii] - Wy[ii]*xp2**2)/sqrt(Wx[ii])
+            s = bisection_root(n0, n1, r0, r1, s0, s1, &its)
+        
+        xp = r0 * xp / (s + r0)
+        yp = r1 * yp / (s + r1)
+    
+    #print(x_out, y_out, xp, yp, ep0, ep1, g)
+    
+    # do an additional projection onto the ellipse surface
+    # for numerical stability when xp or yp ~ 0
+    #n0 = xp*one_on_ep0 
+    #n1 = yp*one_on_ep1 
+    #nn = float_max(n0, n1)
+    #Ip = nn * sqrt((n0/nn)**2 + (n1/nn)**2)
+    if flipped == 0 :
+        Ip = Wxi*xp**2 + Wyi*yp**2
+    else :
+        Ip = Wyi*xp**2 + Wxi*yp**2
+    
+    if fabs(Ip - Ii) > tol :
+        #print('Ip != 1', Ii, Ip)
+        Ip = sqrt(Ii) / sqrt(Ip)
+        xp *= Ip 
+        yp *= Ip
+    
+    # compare with Wx=0 projection
+    xp2 = xp0
+    if flipped == 0 :
+        yp2 = sqrt(Ii - Wxi*xp2**2)/sqrt(Wyi)
+    else :
+        yp2 = sqrt(Ii - Wyi*xp2**2)/sqrt(Wxi)
 
-        # uninvert
-        if y_inv == 1 :
-            yp  = -yp
-            yp2 = -yp2
-            
-        if x_inv == 1 :
-            xp  = -xp
-            xp2 = -xp2
+    # uninvert
+    if y_inv == 1 :
+        yp  = -yp
+        yp2 = -yp2
         
-        # unflip
-        if flipped :
-            g = xp
-            xp = yp
-            yp = g
-            
-            g = xp2
-            xp2 = yp2
-            yp2 = g
+    if x_inv == 1 :
+        xp  = -xp
+        xp2 = -xp2
+    
+    # unflip
+    if flipped :
+        g = xp
+        xp = yp
+        yp = g
+        
+        g = xp2
+        xp2 = yp2
+        yp2 = g
 
-        n0 = xp2-x[ii]
-        n1 = yp2-y[ii]
-        if abs(n0) > tol and abs(n1) > tol :
-            nn = float_max(n0, n1)
-            r0 = nn * sqrt((n0/nn)**2 + (n1/nn)**2)
-        else :
-            r0 = sqrt(n0**2 + n1**2)
-        n0 = xp-x[ii]
-        n1 = yp-y[ii]
-        if abs(n0) > tol and abs(n1) > tol :
-            nn = float_max(n0, n1)
-            r1 = nn * sqrt((n0/nn)**2 + (n1/nn)**2)
-        else :
-            r1 = sqrt(n0**2 + n1**2)
-        if (r1 - r0) > tol  :
-            print('projecting straight down...', xp, yp, xp2, yp2)
-            xp = xp2
-            yp = yp2
+    n0 = xp2-x
+    n1 = yp2-y
+    if fabs(n0) > tol and fabs(n1) > tol :
+        nn = float_max(n0, n1)
+        r0 = nn * sqrt((n0/nn)**2 + (n1/nn)**2)
+    else :
+        r0 = sqrt(n0**2 + n1**2)
+    n0 = xp-x
+    n1 = yp-y
+    if fabs(n0) > tol and fabs(n1) > tol :
+        nn = float_max(n0, n1)
+        r1 = nn * sqrt((n0/nn)**2 + (n1/nn)**2)
+    else :
+        r1 = sqrt(n0**2 + n1**2)
+    if (r1 - r0) > tol  :
+        printf("projecting straight down... %g %g %g %g\n", xp, yp, xp2, yp2)
+        xp = xp2
+        yp = yp2
 
-        u[ii] = xp
-        v[ii] = yp
+    u[0] = xp
+    v[0] = yp
+    return its
+
+#@cython.boundscheck(False) # turn off bounds-checking for entire function
+#@cython.wraparound(False)  # turn off negative index wrapping for entire function
+def project_2D_Ellipse_arrays_cython_test(np.ndarray[Ctype_real, ndim=1] x, 
+                                          np.ndarray[Ctype_real, ndim=1] y,
+                                          np.ndarray[Ctype_real, ndim=1] Wx,
+                                          np.ndarray[Ctype_real, ndim=1] Wy,
+                                          np.ndarray[Ctype_real, ndim=1] I,
+                                          np.ndarray[Ctype_bool, ndim=1] mask):
+    """
+    x, y, Wx, Wy and I must all be float32 or all be float64, 
+    u and v are returned with the same dtype as x.
+    """
+    cdef unsigned int ii
+    cdef unsigned int ii_max = <unsigned int> x.shape[0]
+    cdef double ui, vi
+    cdef np.ndarray[Ctype_real, ndim = 1] u = np.empty((ii_max), dtype=x.dtype)
+    cdef np.ndarray[Ctype_real, ndim = 1] v = np.empty((ii_max), dtype=x.dtype)
+    
+    for ii in range(ii_max):
+        project_2D_Ellipse_point(x[ii], y[ii], Wx[ii], Wy[ii], I[ii], mask[ii], &ui, &vi)
+        u[ii] = ui
+        v[ii] = vi
+    return u, v
+
+@cython.boundscheck(False) # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+def project_2D_Ellipse_arrays_cython_newton(np.ndarray[Ctype_real, ndim=1] x, 
+                                            np.ndarray[Ctype_real, ndim=1] y,
+                                            np.ndarray[Ctype_real, ndim=1] Wx,
+                                            np.ndarray[Ctype_real, ndim=1] Wy,
+                                            np.ndarray[Ctype_real, ndim=1] I,
+                                            np.ndarray[Ctype_bool, ndim=1] mask):
+    """
+    Same as project_2D_Ellipse_arrays_cython_test but the root
+    is found with safeguarded Newton iterations (see newton_root).
+    """
+    cdef Py_ssize_t ii
+    cdef Py_ssize_t ii_max = x.shape[0]
+    cdef double ui, vi
+    cdef np.ndarray[Ctype_real, ndim = 1] u = np.empty((ii_max), dtype=x.dtype)
+    cdef np.ndarray[Ctype_real, ndim = 1] v = np.empty((ii_max), dtype=x.dtype)
+    
+    for ii in range(ii_max):
+        project_2D_Ellipse_point(x[ii], y[ii], Wx[ii], Wy[ii], I[ii], mask[ii], &ui, &vi, 1)
+        u[ii] = ui
+        v[ii] = vi
     return u, v
 
 
+ctypedef fused Ctype_complex:
+    np.complex64_t
+    np.complex128_t
+
+@cython.boundscheck(False) # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+def Pmod_ellipse_cython(np.ndarray[Ctype_complex, ndim=2, mode='c'] modes, 
+                        np.ndarray[Ctype_real, ndim=1] Wx,
+                        np.ndarray[Ctype_real, ndim=1] Wy,
+                        np.ndarray[Ctype_real, ndim=1] I,
+                        np.ndarray[Ctype_bool, ndim=1] mask,
+                        double alpha,
+                        np.ndarray[Ctype_complex, ndim=2, mode='c'] out,
+                        int num_threads = 1,
+                        int newton = 0):
+    """
+    The modulus projection of Mapper_ellipse in a single pass over the voxels.
+    
+    For each voxel ii:
+        u      = unitary DFT of modes[:, ii] along the mode axis
+        x, y   = |u[0]|, sqrt( sum_m>0 |u[m]|**2 )
+        xp, yp = projection of (x, y) onto Wx x**2 + Wy y**2 = I
+        u[0]  *= xp / x 
+        u[m>0]*= yp / (y + alpha)
+        out[:, ii] = inverse DFT of u
+    
+    Parameters
+    ----------
+    modes : numpy.ndarray, complex64 or complex128, (M, N)
+        The M modes, each raveled into a vector of length N.
+
+    Wx, Wy, I : numpy.ndarray, float32 or float64, (N,)
+        The ellipse parameters for each voxel.
+    
+    mask : numpy.ndarray, uint8, (N,)
+        Voxels where mask == 0 are left unchanged.
+
+    alpha : float
+        floating point offset to prevent divide by zeros
+
+    out : numpy.ndarray, same dtype as modes, (M, N)
+        The output array, this can be modes (for an in-place update).
+    
+    num_threads : int, optional, default (1)
+        The number of OpenMP threads used to loop over the voxels.
+    
+    newton : int, optional, default (0)
+        If 1 then use Newton's method (rather than bisection) 
+        in the ellipse projection.
+    
+    Returns
+    -------
+    out : numpy.ndarray
+    """
+    cdef Py_ssize_t M = modes.shape[0]
+    cdef Py_ssize_t N = modes.shape[1]
+    cdef Py_ssize_t ii, m, n
+    cdef double x, y, xp, yp, t
+    cdef double complex z
+    cdef double complex *u
+    cdef double complex *w    = <double complex *> malloc(M * M * sizeof(double complex))
+    
+    if num_threads < 1 :
+        num_threads = 1
+    
+    # one work vector per thread
+    cdef double complex *work = <double complex *> malloc(num_threads * M * sizeof(double complex))
+    
+    if w == NULL or work == NULL :
+        free(w)
+        free(work)
+        raise MemoryError()
+    
+    # the unitary DFT matrix along the mode axis
+    for m in range(M):
+        for n in range(M):
+            t = 2. * M_PI * ((m * n) % M) / <double> M
+            w[m*M + n] = (cos(t) - 1j * sin(t)) / sqrt(<double> M)
+    
+    for ii in prange(N, nogil=True, schedule='guided', num_threads=num_threads):
+        u = &work[threadid() * M]
+        
+        # forward transform
+        for m in range(M):
+            z = 0
+            for n in range(M):
+                z = z + w[m*M + n] * <double complex> modes[n, ii]
+            u[m] = z
+        
+        # make x and y
+        x = sqrt(u[0].real**2 + u[0].imag**2)
+        y = 0.
+        for m in range(1, M):
+            y = y + u[m].real**2 + u[m].imag**2
+        y = sqrt(y)
+        
+        # project onto xp yp (assigned here so that they are thread private)
+        xp = 0.
+        yp = 0.
+        project_2D_Ellipse_point(x, y, Wx[ii], Wy[ii], I[ii], mask[ii], &xp, &yp, newton)
+        
+        # xp yp --> u
+        if x > 0. :
+            u[0] = u[0] * (xp / x)
+        else :
+            u[0] = xp
+        
+        for m in range(1, M):
+            u[m] = u[m] * (yp / (y + alpha))
+        
+        # inverse transform
+        for n in range(M):
+            z = 0
+            for m in range(M):
+                z = z + w[m*M + n].conjugate() * u[m]
+            out[n, ii] = <Ctype_complex> z
+    
+    free(w)
+    free(work)
+    return out
+
+
+@cython.boundscheck(False) # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+def Imap_ellipse_cython(np.ndarray[Ctype_complex, ndim=2, mode='c'] modes, 
+                        np.ndarray[Ctype_real, ndim=1] Wd,
+                        np.ndarray[Ctype_real, ndim=1] Wu,
+                        np.ndarray[Ctype_real, ndim=1] out,
+                        int num_threads = 1):
+    """
+    The intensity of Mapper_ellipse in a single pass over the voxels.
+    
+    For each voxel ii:
+        out[ii] = Wd[ii] sum_m |modes[m, ii]|**2 + Wu[ii] |sum_m modes[m, ii]|**2
+    
+    Parameters
+    ----------
+    modes : numpy.ndarray, complex64 or complex128, (M, N)
+        The M modes, each raveled into a vector of length N.
+
+    Wd, Wu : numpy.ndarray, float32 or float64, (N,)
+        The diffuse and unit-cell (Bragg) weightings.
+    
+    out : numpy.ndarray, same dtype as Wd, (N,)
+        The output array.
+    
+    num_threads : int, optional, default (1)
+        The number of OpenMP threads used to loop over the voxels.
+    
+    Returns
+    -------
+    out : numpy.ndarray
+    """
+    cdef Py_ssize_t M = modes.shape[0]
+    cdef Py_ssize_t N = modes.shape[1]
+    cdef Py_ssize_t ii, m
+    cdef double d
+    cdef double complex z, U
+    
+    if num_threads < 1 :
+        num_threads = 1
+    
+    for ii in prange(N, nogil=True, schedule='static', num_threads=num_threads):
+        d = 0.
+        U = 0.
+        for m in range(M):
+            z = <double complex> modes[m, ii]
+            d = d + z.real**2 + z.imag**2
+            U = U + z
+        out[ii] = <Ctype_real> (Wd[ii] * d + Wu[ii] * (U.real**2 + U.imag**2))
+    return out
+
+
+@cython.boundscheck(False) # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+def Emod_ellipse_cython(np.ndarray[Ctype_complex, ndim=2, mode='c'] modes, 
+                        np.ndarray[Ctype_real, ndim=1] Wd,
+                        np.ndarray[Ctype_real, ndim=1] Wu,
+                        np.ndarray[Ctype_real, ndim=1] amp,
+                        np.ndarray[Ctype_bool, ndim=1] mask,
+                        int num_threads = 1):
+    """
+    The (un-normalised) modulus error of Mapper_ellipse in a single pass 
+    over the voxels, without any temporary arrays:
+        sum_ii mask[ii] (sqrt(I[ii]) - amp[ii])**2
+    
+    where I is the intensity of Imap_ellipse_cython. The sum is 
+    accumulated in double precision.
+    
+    Parameters
+    ----------
+    modes : numpy.ndarray, complex64 or complex128, (M, N)
+        The M modes, each raveled into a vector of length N.
+
+    Wd, Wu : numpy.ndarray, float32 or float64, (N,)
+        The diffuse and unit-cell (Bragg) weightings.
+    
+    amp : numpy.ndarray, same dtype as Wd, (N,)
+        The measured amplitudes (sqrt of the intensity).
+    
+    mask : numpy.ndarray, uint8, (N,)
+        Voxels where mask == 0 are not included.
+    
+    num_threads : int, optional, default (1)
+        The number of OpenMP threads used to loop over the voxels.
+    
+    Returns
+    -------
+    err : float
+    """
+    cdef Py_ssize_t M = modes.shape[0]
+    cdef Py_ssize_t N = modes.shape[1]
+    cdef Py_ssize_t ii, m
+    cdef double d, t
+    cdef double err = 0.
+    cdef double complex z, U
+    
+    if num_threads < 1 :
+        num_threads = 1
+    
+    for ii in prange(N, nogil=True, schedule='static', num_threads=num_threads):
+        if mask[ii] == 0 :
+            continue
+        d = 0.
+        U = 0.
+        for m in range(M):
+            z = <double complex> modes[m, ii]
+            d = d + z.real**2 + z.imag**2
+            U = U + z
+        t = sqrt(Wd[ii] * d + Wu[ii] * (U.real**2 + U.imag**2)) - amp[ii]
+        err += t * t
+    return err
+
+
+@cython.boundscheck(False) # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+def project_2D_Ellipse_arrays_cython_parallel(np.ndarray[Ctype_real, ndim=1] x, 
+                                              np.ndarray[Ctype_real, ndim=1] y,
+                                              np.ndarray[Ctype_real, ndim=1] Wx,
+                                              np.ndarray[Ctype_real, ndim=1] Wy,
+                                              np.ndarray[Ctype_real, ndim=1] I,
+                                              np.ndarray[Ctype_bool, ndim=1] mask,
+                                              int num_threads = 1,
+                                              int newton = 0):
+    """
+    OpenMP version of project_2D_Ellipse_arrays_cython_test, the 
+    voxels are split between num_threads threads. If newton is 1
+    then use Newton's method rather than bisection (see newton_root).
+    
+    Returns
+    -------
+    u, v : numpy.ndarray, same dtype as x
+    
+    iters : numpy.ndarray, int32
+        The number of root finding iterations used for each voxel.
+    """
+    cdef Py_ssize_t ii
+    cdef Py_ssize_t ii_max = x.shape[0]
+    cdef double ui, vi
+    cdef np.ndarray[Ctype_real, ndim = 1] u = np.empty((ii_max), dtype=x.dtype)
+    cdef np.ndarray[Ctype_real, ndim = 1] v = np.empty((ii_max), dtype=x.dtype)
+    cdef np.ndarray[np.int32_t, ndim = 1] iters = np.empty((ii_max), dtype=np.int32)
+    
+    if num_threads < 1 :
+        num_threads = 1
+    
+    for ii in prange(ii_max, nogil=True, schedule='guided', num_threads=num_threads):
+        # assigned here so that they are thread private
+        ui = 0.
+        vi = 0.
+        iters[ii] = project_2D_Ellipse_point(x[ii], y[ii], Wx[ii], Wy[ii], I[ii], mask[ii], &ui, &vi, newton)
+        u[ii] = ui
+        v[ii] = vi
+    return u, v, iters
+
+
 
         
 
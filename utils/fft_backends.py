@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+
+# for python 2 / 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+from itertools import product
+
+def get_fft(backend = None, threads = None, c_dtype = np.complex128, planner_effort = 'FFTW_MEASURE'):
+    """
+    Return the forward and inverse n-dimensional FFTs for a backend:
+        fftn, ifftn = get_fft('scipy', threads = 8)
+        b = fftn(a, axes = None, overwrite_x = False)
+
+    the transforms have the signature of scipy.fftpack.fftn (without
+    the shape argument). If overwrite_x is True then the input array may
+    be used as the output (an in-place transform), so it should not be
+    used afterwards.
+
+    Parameters
+    ----------
+    backend : ('numpy', 'scipy', 'pyfftw', None), optional, default (None)
+        'numpy'  : np.fft, single threaded (computed in double precision).
+        'scipy'  : scipy.fft with 'threads' workers, preserves single precision.
+        'pyfftw' : pyfftw with 'threads' threads, the FFTW plans and their
+                   aligned buffers are made once for each shape, dtype and
+                   axes (see FFTW_plans) and the wisdom is accumulated 
+                   (see load_wisdom and save_wisdom).
+        None     : np.fft for complex128 and scipy.fftpack for complex64
+                   (both single threaded).
+
+    threads : int or None, optional, default (None)
+        The number of threads (workers) for the scipy and pyfftw backends.
+        If None then the number of cpu cores is used.
+
+    c_dtype : np.dtype, optional, default (np.complex128)
+        The complex type of the arrays that will be transformed, this is
+        only used to choose the default backend.
+
+    planner_effort : str, optional, default ('FFTW_MEASURE')
+        The FFTW planner effort for the pyfftw backend.
+
+    Returns
+    -------
+    fftn, ifftn : functions
+    """
+    if threads is None :
+        import multiprocessing
+        threads = multiprocessing.cpu_count()
+
+    if backend is None :
+        if np.dtype(c_dtype) == np.complex64 :
+            import scipy.fftpack
+            return scipy.fftpack.fftn, scipy.fftpack.ifftn
+        else :
+            backend = 'numpy'
+
+    if backend == 'numpy' :
+        # np.fft always returns complex128, so cast single precision back
+        def fftn(a, axes = None, overwrite_x = False):
+            return np.fft.fftn(a, axes = axes).astype(np.result_type(a, np.complex64), copy = False)
+
+        def ifftn(a, axes = None, overwrite_x = False):
+            return np.fft.ifftn(a, axes = axes).astype(np.result_type(a, np.complex64), copy = False)
+
+    elif backend == 'scipy' :
+        import scipy.fft
+        def fftn(a, axes = None, overwrite_x = False):
+            return scipy.fft.fftn(a, axes = axes, overwrite_x = overwrite_x, workers = threads)
+
+        def ifftn(a, axes = None, overwrite_x = False):
+            return scipy.fft.ifftn(a, axes = axes, overwrite_x = overwrite_x, workers = threads)
+
+    elif backend == 'pyfftw' :
+        plans = FFTW_plans(threads, planner_effort)
+
+        def fftn(a, axes = None, overwrite_x = False):
+            return plans.c2c(a, axes, 'FFTW_FORWARD', overwrite_x)
+
+        def ifftn(a, axes = None, overwrite_x = False):
+            return plans.c2c(a, axes, 'FFTW_BACKWARD', overwrite_x)
+
+    else :
+        raise ValueError("fft backend must be one of 'numpy', 'scipy', 'pyfftw' or None")
+
+    return fftn, ifftn
+
+def get_rfft(backend = None, threads = None, dtype = np.float64, planner_effort = 'FFTW_MEASURE'):
+    """
+    Return the real to complex FFTs for a backend (see get_fft):
+        rfftn, irfftn = get_rfft('scipy', threads = 8)
+        b = rfftn(a)          # the half spectrum, b.shape[-1] = a.shape[-1]//2 + 1
+        a = irfftn(b, shape)  # the real array of shape 'shape'
+    
+    the output has the precision of dtype (float32 or float64). If 
+    backend is None then np.fft is used for float64 and scipy.fft 
+    (single threaded) for float32.
+    """
+    if threads is None :
+        import multiprocessing
+        threads = multiprocessing.cpu_count()
+    
+    if backend is None :
+        if np.dtype(dtype) == np.float32 :
+            backend, threads = 'scipy', 1
+        else :
+            backend = 'numpy'
+    
+    c_dtype = np.result_type(dtype, np.complex64)
+    r_dtype = np.dtype(dtype)
+    
+    if backend == 'numpy' :
+        def rfftn(a):
+            return np.fft.rfftn(a).astype(c_dtype, copy = False)
+        
+        def irfftn(a, shape):
+            return np.fft.irfftn(a, s = shape).astype(r_dtype, copy = False)
+    
+    elif backend == 'scipy' :
+        import scipy.fft
+        def rfftn(a):
+            return scipy.fft.rfftn(a, workers = threads)
+        
+        def irfftn(a, shape):
+            return scipy.fft.irfftn(a, s = shape, workers = threads)
+    
+    elif backend == 'pyfftw' :
+        plans = FFTW_plans(threads, planner_effort)
+        
+        def rfftn(a):
+            return plans.r2c(a, r_dtype)
+        
+        def irfftn(a, shape):
+            return plans.c2r(a, shape, r_dtype)
+    
+    else :
+        raise ValueError("fft backend must be one of 'numpy', 'scipy', 'pyfftw' or None")
+    
+    return rfftn, irfftn
+
+class FFTW_plans():
+    """
+    pyfftw.FFTW objects for the 'pyfftw' backend of get_fft and get_rfft.
+    
+    A plan and its aligned (pyfftw.empty_aligned) buffers are made the 
+    first time that a (kind, shape, dtype, axes) is transformed, and then 
+    reused. The complex to complex plans are in place (the input and 
+    output buffers are the same array), so if overwrite_x is True and 
+    the input array is itself aligned, contiguous and of the right 
+    dtype then it is transformed in place without any copies. Otherwise
+    the input is copied into the buffer and a copy of the output is 
+    returned (so that the results of later transforms do not overwrite it).
+    """
+    def __init__(self, threads = 1, planner_effort = 'FFTW_MEASURE'):
+        import pyfftw
+        self.pyfftw  = pyfftw
+        self.threads = threads
+        self.flags   = (planner_effort,)
+        self.plans   = {}
+    
+    def get(self, kind, shape, dtype, axes = None):
+        """
+        Return (plan, input buffer, output buffer), kind is one of 
+        'FFTW_FORWARD' or 'FFTW_BACKWARD' (complex to complex, where 
+        shape and dtype are of the input), 'r2c' or 'c2r' (where shape 
+        and dtype are of the real array).
+        """
+        shape = tuple(shape)
+        if axes is None :
+            axes = tuple(range(len(shape)))
+        else :
+            axes = tuple(a % len(shape) for a in axes)
+        
+        key = (kind, shape, np.dtype(dtype).str, axes)
+        if key in self.plans :
+            return self.plans[key]
+        
+        empty = self.pyfftw.empty_aligned
+        if kind in ['FFTW_FORWARD', 'FFTW_BACKWARD'] :
+            a = b = empty(shape, dtype = dtype)
+            direction = kind
+        else :
+            half = shape[:-1] + (shape[-1]//2 + 1,)
+            r    = empty(shape, dtype = dtype)
+            c    = empty(half, dtype = np.result_type(dtype, np.complex64))
+            if kind == 'r2c' :
+                a, b, direction = r, c, 'FFTW_FORWARD'
+            else :
+                a, b, direction = c, r, 'FFTW_BACKWARD'
+        
+        plan = self.pyfftw.FFTW(a, b, axes = axes, direction = direction, 
+                                flags = self.flags, threads = self.threads)
+        self.plans[key] = (plan, a, b)
+        return self.plans[key]
+    
+    def c2c(self, x, axes, direction, overwrite_x = False):
+        x     = np.asarray(x)
+        dtype = np.result_type(x, np.complex64)
+        plan, a, b = self.get(direction, x.shape, dtype, axes)
+        
+        if overwrite_x and x.dtype == dtype and x.flags.c_contiguous and \
+           x.ctypes.data % self.pyfftw.simd_alignment == 0 :
+            plan.update_arrays(x, x)
+            try :
+                plan()
+            finally :
+                plan.update_arrays(a, b)
+            return x
+        
+        a[...] = x
+        plan()
+        return b.copy()
+    
+    def r2c(self, x, dtype):
+        plan, a, b = self.get('r2c', x.shape, dtype)
+        a[...] = x
+        plan()
+        return b.copy()
+    
+    def c2r(self, x, shape, dtype):
+        plan, a, b = self.get('c2r', shape, dtype)
+        a[...] = x
+        plan()
+        return b.copy()
+
+def _negative_index_slices(n):
+    # (dst, src) slice pairs such that dst[i] = src[-i % n], i = 0, 1, ... n-1
+    return [(slice(0, 1), slice(0, 1)), (slice(1, n), slice(n-1, 0, -1))]
+
+def hermitian_half(X):
+    """
+    The half spectrum (last axis) of the Hermitian part of the 3D array X:
+        H[i, j, k] = (X[i, j, k] + X[-i, -j, -k].conj()) / 2,  k <= n2//2
+    
+    so that irfftn(H, X.shape) = ifftn(X).real
+    
+    If X is a stack of 3D arrays (4D) then this is the Hermitian part of 
+    their sum, which is accumulated one plane at a time, so only H and 
+    a plane of scratch space are allocated.
+    """
+    if X.ndim == 3 :
+        X = X[None, ...]
+    
+    n0, n1, n2 = X.shape[1:]
+    m  = n2//2 + 1
+    H  = np.empty((n0, n1, m), dtype = X.dtype)
+    P  = np.empty((n1, m), dtype = X.dtype)
+    
+    # X[-i, -j, -k] with slice copies (rather than a gather)
+    js = _negative_index_slices(n1)
+    ks = [(slice(0, 1), slice(0, 1)), (slice(1, m), slice(n2-1, n2-m, -1))]
+    for i in range(n0):
+        H[i] = X[0, i, :, :m]
+        for n in range(1, X.shape[0]):
+            H[i] += X[n, i, :, :m]
+        
+        for n in range(X.shape[0]):
+            for (d1, s1), (d2, s2) in product(js, ks):
+                if n == 0 :
+                    P[d1, d2] = X[n, -i % n0, s1, s2]
+                else :
+                    P[d1, d2] += X[n, -i % n0, s1, s2]
+        
+        np.conjugate(P, out = P)
+        H[i] += P
+    
+    H *= 0.5
+    return H
+
+def hermitian_expand(H, shape):
+    """
+    Expand the half spectrum H = rfftn(a) of the real 3D array a, 
+    to the full spectrum fftn(a) of shape 'shape', using:
+        X[i, j, k] = H[-i, -j, -k].conj(),  k > n2//2
+    """
+    n0, n1, n2 = shape
+    m  = H.shape[2]
+    X  = np.empty(shape, dtype = H.dtype)
+    X[:, :, :m] = H
+    
+    ks = [(slice(m, n2), slice(n2-m, 0, -1))]
+    for (d0, s0), (d1, s1), (d2, s2) in product(_negative_index_slices(n0), _negative_index_slices(n1), ks):
+        np.conjugate(H[s0, s1, s2], out = X[d0, d1, d2])
+    return X
+
+def load_wisdom(fnam):
+    """
+    Import the FFTW wisdom (see save_wisdom) from the file fnam,
+    so that the pyfftw plans do not need to be measured again.
+    Returns False if pyfftw is not installed or fnam does not exist.
+    """
+    import os
+    try :
+        import pyfftw
+    except ImportError :
+        return False
+
+    if not os.path.exists(fnam):
+        return False
+
+    import pickle
+    with open(fnam, 'rb') as f :
+        wisdom = pickle.load(f)
+    pyfftw.import_wisdom(wisdom)
+    return True
+
+def save_wisdom(fnam):
+    """
+    Export the accumulated FFTW wisdom to the file fnam.
+    Returns False if pyfftw is not installed.
+    """
+    try :
+        import pyfftw
+    except ImportError :
+        return False
+
+    import pickle
+    with open(fnam, 'wb') as f :
+        pickle.dump(pyfftw.export_wisdom(), f)
+    return True
@@ -12,28 +12,103 @@ except NameError :
     pass
 
 import numpy as np
+import multiprocessing
+from itertools import product
 
 import symmetry_operations 
 import padding
+import fft_backends
 import add_noise_3d
 import io_utils
+from io_utils import to_shared, from_shared
 
-def make_exp(sigma, shape):
-    # make the B-factor thing
+def make_q2(shape):
     i, j, k = np.meshgrid(np.fft.fftfreq(shape[0], 1.), \
                           np.fft.fftfreq(shape[1], 1.), \
                           np.fft.fftfreq(shape[2], 1.), indexing='ij')
+    return i**2 + j**2 + k**2
+
+def make_exp(sigma, shape, dtype=np.float64, q2 = None):
+    # make the B-factor thing
+    if q2 is None :
+        q2 = make_q2(shape)
     if sigma is np.inf :
         print('sigma is inf setting exp = 0')
-        exp     = np.zeros(i.shape, dtype=np.float)
+        exp     = np.zeros(q2.shape, dtype=dtype)
     elif sigma == 0. :
         print('sigma is 0 setting exp = 1')
-        exp     = np.ones(i.shape, dtype=np.float)
+        exp     = np.ones(q2.shape, dtype=dtype)
     else :
-        exp     = np.exp(-4. * sigma**2 * np.pi**2 * (i**2 + j**2 + k**2))
+        exp     = np.exp(-4. * sigma**2 * np.pi**2 * q2).astype(dtype)
     return exp
 
-def generate_diff(solid_unit, unit_cell, N, sigma, **params):
+def prepare_diff(solid_unit, unit_cell, **params):
+    """
+    Calculate the parts of generate_diff that do not depend on N, sigma,
+    photons or support_frac, so that they can be reused with:
+        cache = prepare_diff(solid_unit, unit_cell, **params)
+        diff, info = generate_diff(solid_unit, unit_cell, N, sigma, cache=cache, **params)
+    
+    Returns
+    -------
+    cache : dict
+        {'sym' : the symmetry operator, 
+         'Bragg_amp'   : |sum_i F_i|^2,
+         'diffuse_amp' : sum_i |F_i|^2,
+         'q2'          : |q|^2 in pixel units,
+         'crystal'     : the real-space crystal in the field-of-view,
+         'unit_cell'   : the real-space unit-cell in the field-of-view,
+         'lattice'     : {} the lattice for each (N, lattice_blur),
+         'support'     : {} the support for each support_frac}
+        
+        the lattice and support are added by generate_diff as needed.
+    """
+    if io_utils.isValid('space_group', params):
+        space_group = params['space_group']
+    else :
+        space_group = 'P1'
+    sym_ops = symmetry_operations.get_sym_ops(space_group, unit_cell, solid_unit.shape)
+    
+    # propagate the solid unit to the detector
+    # then generate the coppies of solid unit 
+    # in the unit-cell
+    ##########################################
+    if io_utils.isValid('fft', params):
+        fftn = fft_backends.get_fft(params['fft'], params.get('threads', None))[0]
+    else :
+        fftn = np.fft.fftn
+    modes = sym_ops.solid_syms_Fourier(fftn(solid_unit))
+    
+    cache = {}
+    cache['sym']         = sym_ops
+    cache['Bragg_amp']   = np.abs(np.sum(modes, axis=0))**2
+    cache['diffuse_amp'] = np.sum(np.abs(modes)**2, axis=0)
+    cache['q2']          = make_q2(solid_unit.shape)
+    cache['lattice']     = {}
+    cache['support']     = {}
+    cache['crystal'], cache['unit_cell'] = sym_ops.solid_to_crystal_real(solid_unit, return_unit=True)
+    return cache
+
+def make_support(solid_unit, support_frac = None):
+    # define the solid_unit support
+    ###############################
+    if support_frac :
+        support = padding.expand_region_by(solid_unit > 0., support_frac)
+    else :
+        support = np.abs(solid_unit) > 0.
+    return support
+
+def make_lattice_N(unit_cell, shape, N, lattice_blur = None):
+    lattice = symmetry_operations.make_lattice(unit_cell, shape, N)
+    # normalise by the number of unit cells
+    lattice = lattice / N**3
+    if lattice_blur :
+        import scipy.ndimage
+        lattice = scipy.ndimage.filters.gaussian_filter(lattice, lattice_blur, truncate=10.)
+        print('Bluring the lattice function...', lattice.dtype)
+    return lattice
+
+def generate_diff(solid_unit, unit_cell, N, sigma, cache = None, **params):
     """
     Generates the 3D diffraction volume of a translationally disordered crystal.
     
@@ -82,6 +157,10 @@ def generate_diff(solid_unit, unit_cell, N, sigma, **params):
         Padd the non-zero solid_unit pixels with a gaussian until the sample 
         support has increased by the fraction 'support_frac'.
     
+    fft : ('numpy', 'scipy', 'pyfftw', None), optional, default (None)
+        The FFT backend (see fft_backends.get_fft) with 'threads' threads.
+        If None then np.fft is used.
+    
     background : True or None or False, optional, default (None)
         If 'True' then a Gaussian background is added to the diffraction 
         volume. This is not Gaussian noise but an actual large Gaussian 
@@ -106,6 +185,11 @@ def generate_diff(solid_unit, unit_cell, N, sigma, **params):
     turn_off_diffuse : bool, optional, default (False)
         If True then exclude the diffuse scatter from the diffraction volume
     
+    cache : dict, optional, default (None)
+        The output of prepare_diff(solid_unit, unit_cell, **params), the
+        lattice and support are stored in cache for the next call. If None
+        then everything is calculated from scratch.
+    
     Returns
     -------
     diff : numpy.ndarray, float, (unit_cell)
@@ -156,61 +240,43 @@ def generate_diff(solid_unit, unit_cell, N, sigma, **params):
         'sym' : class object 
             an object for performing symmetry operations on the solid unit
     """
-    # get the symmetry operator 
-    ###########################
-    if io_utils.isValid('space_group', params):
-        space_group = params['space_group']
-    else :
-        space_group = 'P1'
-    
-    if space_group == 'P1' :
-        sym_ops = symmetry_operations.P1(unit_cell, solid_unit.shape)
-    
-    elif space_group == 'P212121':
-        sym_ops = symmetry_operations.P212121(unit_cell, solid_unit.shape)
-    
-    elif space_group == 'Ptest':
-        sym_ops = symmetry_operations.Ptest(unit_cell, solid_unit.shape)
+    if cache is None :
+        cache = prepare_diff(solid_unit, unit_cell, **params)
+    sym_ops = cache['sym']
     
     # define the solid_unit support
     ###############################
     if io_utils.isValid('support_frac', params):
-        support = padding.expand_region_by(solid_unit > 0., params['support_frac'])
+        support_frac = params['support_frac']
     else :
-        support = np.abs(solid_unit) > 0.
+        support_frac = None
     
-    #solid_unit = np.random.random(support.shape)*support + 0J
-    
-    # propagate the solid unit to the detector
-    ##########################################
-    Solid_unit = np.fft.fftn(solid_unit)
-    
-    # generate the coppies of solid unit in the 
-    # unit-cell
-    ###########################################
-    modes = sym_ops.solid_syms_Fourier(Solid_unit)
+    if support_frac not in cache['support'] :
+        cache['support'][support_frac] = make_support(solid_unit, support_frac)
+    support = cache['support'][support_frac]
     
     # generate the diffuse and Bragg weighting modes
     ################################################
-    exp     = make_exp(sigma, solid_unit.shape)
+    exp     = make_exp(sigma, solid_unit.shape, q2 = cache['q2'])
     
     # make the lattice
     ##################
-    lattice = symmetry_operations.make_lattice(unit_cell, solid_unit.shape, N)
-    # normalise by the number of unit cells
-    lattice = lattice / N**3
     if io_utils.isValid('lattice_blur', params) :
-        import scipy.ndimage
-        lattice = scipy.ndimage.filters.gaussian_filter(lattice, params['lattice_blur'], truncate=10.)
-        print('Bluring the lattice function...', lattice.dtype)
+        lattice_blur = params['lattice_blur']
+    else :
+        lattice_blur = None
+    
+    if (N, lattice_blur) not in cache['lattice'] :
+        cache['lattice'][(N, lattice_blur)] = make_lattice_N(unit_cell, solid_unit.shape, N, lattice_blur)
+    lattice = cache['lattice'][(N, lattice_blur)]
     
     Bw      = exp * lattice 
     Dw      = (1. - exp) 
     
     # calculate the Bragg and diffuse scattering
     ############################################
-    B      = Bw * np.abs(np.sum(modes, axis=0))**2
-    D      = Dw * np.sum(np.abs(modes)**2, axis=0)
+    B      = Bw * cache['Bragg_amp']
+    D      = Dw * cache['diffuse_amp']
     
     if io_utils.isValid('turn_off_bragg', params) :
         print('\nExluding Bragg peaks')
@@ -246,7 +312,7 @@ def generate_diff(solid_unit, unit_cell, N, sigma, **params):
         print('\nnumber of photons for Bragg   diffraction:', B_photons)
         print('number of photons for diffuse diffraction:', D_photons)
         print('total number of photons for diffraction  :', params['photons'])
-        assert((B_photons + D_photons) == params['photons'])
+        assert(np.isclose(B_photons + D_photons, params['photons']))
         
         # un-scale 
         B_rscale /= R_scale
@@ -292,7 +358,7 @@ def generate_diff(solid_unit, unit_cell, N, sigma, **params):
     # make the unit-cell in the field-of-view
     # make the crystal in the field-of-view
     #########################################
-    crystal_ar, unit_cell_ar = sym_ops.solid_to_crystal_real(solid_unit, return_unit=True)
+    crystal_ar, unit_cell_ar = cache['crystal'], cache['unit_cell']
     
     # no. of voxels and solvent content
     voxels           = np.sum(solid_unit > 0.)
@@ -329,3 +395,137 @@ def generate_diff(solid_unit, unit_cell, N, sigma, **params):
     info['solvent_content_support'] = solvent_support
     
     return diff, info
+
+
+_worker = {}
+
+def _init_worker(shared, sym_ops, unit_cell, params, seed):
+    _worker['shared']    = shared
+    _worker['sym']       = sym_ops
+    _worker['unit_cell'] = unit_cell
+    _worker['params']    = params
+    _worker['seed']      = seed
+
+def _sweep_point(args):
+    """
+    Run generate_diff for one grid point in a worker process. The 
+    cached arrays are views of the shared memory arrays.
+    """
+    index, point = args
+    if _worker['seed'] is not None :
+        np.random.seed(_worker['seed'] + index)
+    
+    shared = _worker['shared']
+    cache  = {'sym' : _worker['sym']}
+    for k in ['Bragg_amp', 'diffuse_amp', 'q2', 'crystal', 'unit_cell'] :
+        cache[k] = from_shared(shared[k])
+    cache['lattice'] = dict((k, from_shared(v)) for k, v in shared['lattice'].items())
+    cache['support'] = dict((k, from_shared(v)) for k, v in shared['support'].items())
+    solid_unit = from_shared(shared['solid_unit'])
+    
+    params = dict(_worker['params'])
+    params.update(point)
+    N     = params.pop('n')
+    sigma = params.pop('sigma')
+    
+    diff, info = generate_diff(solid_unit, _worker['unit_cell'], N, sigma, cache = cache, **params)
+    
+    # these are the same for every grid point
+    for k in ['sym', 'crystal', 'unit_cell'] :
+        del info[k]
+    return index, point, diff, info
+
+def sweep_diff(solid_unit, unit_cell, grid, processes = None, seed = None, **params):
+    """
+    Run generate_diff over the grid of parameter values in grid, reusing 
+    the N and sigma independent parts of the calculation (see prepare_diff),
+    with the grid points spread over a pool of processes.
+    
+    Parameters
+    ----------
+    solid_unit : numpy.ndarray
+    
+    unit_cell : sequence of length 3, int
+        The pixel dimensions of the unit-cell
+    
+    grid : dict
+        The values of each swept parameter, e.g.:
+            {'n' : [1, 10], 'sigma' : [0.5, 1.0, 2.0], 'photons' : [None, 1e6]}
+        
+        'n' and 'sigma' must be either in grid or in params. Any of the other
+        keyword arguments of generate_diff can also be swept, e.g. 'support_frac'.
+        The grid points are all combinations of the values (in the order
+        of sorted(grid.keys())).
+
+    Keyword Arguments
+    -----------------
+    processes : int or None, optional, default (None)
+        The number of worker processes, if None then use the number of 
+        cpus. If 1 then the grid points are evaluated in this process.
+    
+    seed : int or None, optional, default (None)
+        If not None then the random number generator is seeded with 
+        seed + index for the index'th grid point, so that the photon 
+        counting noise is reproducible.
+    
+    **params : 
+        The fixed keyword arguments of generate_diff (and 'n' and 'sigma' 
+        if they are not swept).
+    
+    Returns
+    -------
+    cache : dict
+        The output of prepare_diff, with the lattice and support for 
+        each grid point.
+    
+    results : generator
+        yields (index, point, diff, info) for each grid point in order, 
+        where point is a dict of the swept parameter values and (diff, info)
+        is the output of generate_diff without the grid independent 
+        'sym', 'crystal' and 'unit_cell' entries of info (see cache).
+    """
+    keys   = sorted(grid.keys())
+    points = [dict(zip(keys, v)) for v in product(*[list(grid[k]) for k in keys])]
+    
+    for k in ['n', 'sigma'] :
+        if k not in grid and k not in params :
+            raise ValueError(k + ' must be in grid or in params')
+    
+    # pre-calculate the shared parts of generate_diff
+    cache = prepare_diff(solid_unit, unit_cell, **params)
+    for point in points :
+        p = dict(params)
+        p.update(point)
+        
+        support_frac = p['support_frac'] if io_utils.isValid('support_frac', p) else None
+        if support_frac not in cache['support'] :
+            cache['support'][support_frac] = make_support(solid_unit, support_frac)
+        
+        lattice_blur = p['lattice_blur'] if io_utils.isValid('lattice_blur', p) else None
+        if (p['n'], lattice_blur) not in cache['lattice'] :
+            cache['lattice'][(p['n'], lattice_blur)] = make_lattice_N(unit_cell, solid_unit.shape, p['n'], lattice_blur)
+    
+    # put the large arrays in shared memory
+    shared = {}
+    for k in ['Bragg_amp', 'diffuse_amp', 'q2', 'crystal', 'unit_cell'] :
+        shared[k] = to_shared(cache[k])
+    shared['lattice']    = dict((k, to_shared(v)) for k, v in cache['lattice'].items())
+    shared['support']    = dict((k, to_shared(v)) for k, v in cache['support'].items())
+    shared['solid_unit'] = to_shared(solid_unit)
+    
+    initargs = (shared, cache['sym'], unit_cell, params, seed)
+    
+    def results():
+        if processes == 1 :
+            _init_worker(*initargs)
+            for r in map(_sweep_point, enumerate(points)):
+                yield r
+        else :
+            pool = multiprocessing.Pool(processes, _init_worker, initargs)
+            try :
+                for r in pool.imap(_sweep_point, enumerate(points)):
+                    yield r
+            finally :
+                pool.terminate()
+    
+    return cache, results()
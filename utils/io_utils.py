@@ -16,7 +16,14 @@ try :
 except ImportError :
     import configparser 
 
+try :
+    import Queue as queue
+except ImportError :
+    import queue
+
 import numpy as np
+import multiprocessing
+import threading
 
 def isValid(thing, d=None):
     """
@@ -119,6 +126,256 @@ def parse_parameters(config):
 
     return monitor_params
 
+def read_dataset(f, key, dtype = None, mmap = False):
+    """
+    Read the h5py dataset f[key] into a numpy array of type dtype.
+
+    The data is converted to dtype by HDF5 as it is read, so there is 
+    no full size temporary array in the stored type.
+
+    If mmap is True and the dataset is stored contiguously, without 
+    compression and with type dtype, then a copy-on-write np.memmap 
+    of the file is returned instead. The pages are read from the file 
+    as they are accessed and are only copied into memory if they are 
+    written to. The dataset must not be changed in the file while the
+    memmap is in use.
+    """
+    dset = f[key]
+    if dset.shape == () :
+        return dset[()]
+    
+    if dtype is None :
+        dtype = dset.dtype
+    dtype = np.dtype(dtype)
+    
+    if mmap and dset.chunks is None and dset.compression is None and dset.dtype == dtype :
+        offset = dset.id.get_offset()
+        if offset is not None :
+            return np.memmap(f.filename, mode = 'c', dtype = dtype, offset = offset, 
+                             shape = dset.shape, order = 'C')
+    
+    out = np.empty(dset.shape, dtype = dtype)
+    if out.size > 0 :
+        dset.read_direct(out)
+    return out
+
+def to_shared(a):
+    """
+    Copy the numpy array a into shared memory, returns a tuple
+    that can be passed to a worker process and read with from_shared.
+    """
+    if a is None :
+        return None
+    a   = np.ascontiguousarray(a)
+    raw = multiprocessing.RawArray('b', max(1, a.nbytes))
+    np.frombuffer(raw, dtype=np.uint8)[:a.nbytes] = a.view(np.uint8).ravel()
+    return (raw, a.shape, a.dtype.str)
+
+def from_shared(t):
+    """
+    A numpy view of an array made with to_shared (no copy).
+    """
+    if t is None :
+        return None
+    raw, shape, dtype = t
+    n = int(np.prod(shape))
+    return np.frombuffer(raw, dtype=np.dtype(dtype), count=n).reshape(shape)
+
+def bcast_arrays(d, comm, root = 0, block = 2**26):
+    """
+    Broadcast the dict d from the MPI rank root to every rank of comm,
+    d is ignored on the other ranks. The numpy arrays in d are sent
+    with comm.Bcast (in blocks of 'block' bytes, so there is no pickled
+    copy and large arrays do not overflow the MPI counts), everything
+    else is pickled.
+    """
+    rank = comm.Get_rank()
+    if rank == root :
+        arrays = dict((k, np.ascontiguousarray(v)) for k, v in d.items() if isinstance(v, np.ndarray))
+        meta   = dict((k, (v.shape, v.dtype.str)) for k, v in arrays.items())
+        rest   = dict((k, v) for k, v in d.items() if k not in arrays)
+    else :
+        meta, rest = None, None
+
+    meta, rest = comm.bcast((meta, rest), root = root)
+
+    out = dict(rest)
+    for k in sorted(meta.keys()) :
+        shape, dtype = meta[k]
+        if rank == root :
+            a = arrays[k]
+        else :
+            a = np.empty(shape, dtype = np.dtype(dtype))
+
+        b = a.reshape(-1).view(np.uint8)
+        for i in range(0, b.size, block):
+            comm.Bcast(b[i : i + block], root = root)
+        out[k] = a
+    return out
+
+class H5_writer(object):
+    """
+    Write datasets to the h5 file fnam from a background thread, so 
+    that the (compressed) writing of large arrays overlaps with compute.
+    
+    Parameters
+    ----------
+    fnam : str
+        the h5 file, opened in 'a' mode and kept open until close()
+    
+    Keyword Arguments
+    -----------------
+    group : str, optional, default ('/')
+        keys are relative to this group
+    
+    compression : str or None, optional, default ('gzip')
+        the h5py compression filter for arrays with at least min_size 
+        elements, these are chunked (and shuffled) in the file
+    
+    compression_opts : optional, default (None)
+        the h5py compression options (e.g. the gzip level)
+    
+    min_size : int, optional, default (1024)
+        smaller arrays are written contiguously without compression
+    
+    Notes
+    -----
+    Arrays passed to write and append are not copied, they must not 
+    be changed until flush() or close() returns. Errors in the writer
+    thread are printed and do not stop the other writes, the first 
+    error is raised again by the next call to flush() or close().
+    """
+    def __init__(self, fnam, group = '/', compression = 'gzip', compression_opts = None, min_size = 1024):
+        import h5py
+        self.f      = h5py.File(fnam, 'a')
+        self.group  = group.rstrip('/') + '/'
+        self.min_size = min_size
+        if compression in [None, False, 'None']:
+            self.compression = None
+        else :
+            self.compression = compression
+        self.compression_opts = compression_opts
+        
+        # the first exception of the writer thread
+        self.error  = None
+        
+        self.queue  = queue.Queue()
+        self.thread = threading.Thread(target = self._run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def write(self, key, value):
+        """
+        (Re)write the dataset group/key with value.
+        """
+        self.queue.put((self._write, key, value))
+    
+    def append(self, key, values, reset = False):
+        """
+        Append the 1D values to the resizable dataset group/key, it is 
+        created if needed. If reset is True the dataset is emptied first.
+        """
+        self.queue.put((self._append, key, (np.array(values).ravel(), reset)))
+    
+    def delete(self, key):
+        """
+        Delete group/key if it exists.
+        """
+        self.queue.put((self._delete, key, None))
+    
+    def flush(self):
+        """
+        Wait for the queued writes and flush the file, raises the 
+        first error of the writer thread (if any).
+        """
+        self.queue.join()
+        self.f.flush()
+        self._raise()
+    
+    def close(self):
+        """
+        Wait for the queued writes, stop the writer thread and close the file,
+        then raise the first error of the writer thread (if any).
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self.f.close()
+        self._raise()
+    
+    def _raise(self):
+        if self.error is not None :
+            e, self.error = self.error, None
+            raise e
+    
+    def _run(self):
+        while True :
+            job = self.queue.get()
+            if job is None :
+                self.queue.task_done()
+                break
+            
+            fun, key, value = job
+            h5_key = self.group + key
+            try :
+                fun(h5_key, value)
+                self.f.flush()
+            except Exception as e :
+                print('could not write:', h5_key, ':', e)
+                if self.error is None :
+                    self.error = e
+            self.queue.task_done()
+    
+    def _delete(self, h5_key, value):
+        if h5_key in self.f :
+            del self.f[h5_key]
+    
+    def _write(self, h5_key, value):
+        value = np.asarray(value)
+        
+        compress = value.ndim > 0 and value.size >= self.min_size and value.dtype.kind in 'biufc'
+        if compress :
+            kwargs = {'chunks' : True, 'compression' : self.compression, 
+                      'compression_opts' : self.compression_opts, 
+                      'shuffle' : self.compression is not None}
+        else :
+            kwargs = {}
+        
+        if h5_key in self.f :
+            # overwrite in place if we can (deleting does not free the space)
+            d = self.f[h5_key]
+            if d.shape == value.shape and d.dtype == value.dtype and \
+               (d.chunks is not None) == compress and d.maxshape == d.shape and \
+               d.compression == kwargs.get('compression', None) :
+                d[...] = value
+                return 
+            del self.f[h5_key]
+        
+        print('writing:', h5_key, value.shape, value.dtype)
+        self.f.create_dataset(h5_key, data = value, **kwargs)
+    
+    def _append(self, h5_key, value):
+        values, reset = value
+        if h5_key in self.f :
+            d = self.f[h5_key]
+            if d.maxshape != (None,) or d.dtype != values.dtype :
+                # e.g. written by an older version, keep the old values
+                old = d[()].ravel()
+                if reset :
+                    old = old[:0]
+                del self.f[h5_key]
+                self.f.create_dataset(h5_key, data = old.astype(values.dtype), 
+                                      maxshape = (None,), chunks = (1024,))
+            elif reset :
+                d.resize((0,))
+        else :
+            self.f.create_dataset(h5_key, shape = (0,), dtype = values.dtype, 
+                                  maxshape = (None,), chunks = (1024,))
+        
+        d = self.f[h5_key]
+        n = d.shape[0]
+        d.resize((n + values.size,))
+        d[n:] = values
+
 def if_exists_del(fnam):
     import os
     # check that the directory exists and is a directory
@@ -18,35 +18,21 @@ from functools import reduce
 
 import symmetry_operations 
 import padding
+import fft_backends
 import add_noise_3d
 import io_utils
 
 import pyximport; pyximport.install()
-from ellipse_2D_cython import project_2D_Ellipse_arrays_cython
 from ellipse_2D_cython_new import project_2D_Ellipse_arrays_cython_test
+from ellipse_2D_cython_new import Pmod_ellipse_cython
+from ellipse_2D_cython_new import Imap_ellipse_cython
+from ellipse_2D_cython_new import Emod_ellipse_cython
 
 import phasing_3d
 from phasing_3d.src.mappers import Modes
 from phasing_3d.src.mappers import isValid
 
-
-def get_sym_ops(space_group, unit_cell, det_shape):
-    if space_group == 'P1':
-        print('\ncrystal space group: P1')
-        sym_ops = \
-            symmetry_operations.P1(unit_cell, det_shape)
-
-    elif space_group == 'P212121':
-        print('\ncrystal space group: P212121')
-        sym_ops = \
-            symmetry_operations.P212121(unit_cell, det_shape)
-    
-    elif space_group == 'Ptest':
-        print('\ncrystal space group: Ptest')
-        sym_ops = \
-            symmetry_operations.Ptest(unit_cell, det_shape)
-
-    return sym_ops
+from symmetry_operations import get_sym_ops
 
 
 class Mapper_ellipse():
@@ -106,19 +92,63 @@ class Mapper_ellipse():
         alpha : float, optional, default (1.0e-10)
             floating point offset to prevent divide by zeros: a / (b + alpha)
         
+        threads : integer, optional, default (None)
+            The number of OpenMP threads used in Pmod. If None then 
+            the number of cpu cores is used.
+        
+        newton : bool, optional, default (False)
+            If True then the ellipse projections in Pmod are solved 
+            with Newton's method (with a bisection fallback) rather 
+            than pure bisection. This is several times faster and 
+            agrees with bisection to ~1e-12.
+        
         dtype : np.dtype, optional, default (np.float64)
-            the complex data type is inferred from this
+            the complex data type is inferred from this. All of the 
+            arrays used in the iterations (modes, weightings, amplitudes, 
+            symmetry translations...) are stored with this precision, 
+            so e.g. dtype = np.float32 gives a complex64 reconstruction.
+        
+        fft : ('numpy', 'scipy', 'pyfftw', None), optional, default (None)
+            The FFT backend (see fft_backends.get_fft), 'scipy' and 'pyfftw'
+            use 'threads' threads. If None then np.fft is used (or 
+            scipy.fftpack for single precision).
         """
         # dtype
         #-----------------------------------------------
         if isValid('dtype', args) :
-            dtype = args['dtype']
+            dtype   = np.dtype(args['dtype']).type
             a       = np.array([1], dtype=dtype)
-            c_dtype = np.array(a+1J).dtype
+            c_dtype = np.array(a+1J).dtype.type
         else :
             dtype   = np.float64
             c_dtype = np.complex128
         
+        self.dtype   = dtype
+        self.c_dtype = c_dtype
+        
+        # number of threads for the ellipse projection
+        #-----------------------------------------------
+        if isValid('threads', args) :
+            self.threads = args['threads']
+        else :
+            import multiprocessing
+            self.threads = multiprocessing.cpu_count()
+        
+        if isValid('newton', args) :
+            self.newton = int(args['newton'])
+        else :
+            self.newton = 0
+        
+        # the fft backend, numpy's fft always returns double 
+        # precision arrays whereas scipy's preserves single precision
+        #-----------------------------------------------
+        if isValid('fft', args) :
+            fft = args['fft']
+        else :
+            fft = None
+        self.fftn, self.ifftn   = fft_backends.get_fft(fft, self.threads, c_dtype)
+        self.rfftn, self.irfftn = fft_backends.get_rfft(fft, self.threads, dtype)
+        
         # initialise the object
         #-----------------------------------------------
         if isValid('solid_unit', args):
@@ -129,19 +159,19 @@ class Mapper_ellipse():
             print(O.shape)
         
         self.O = O
-        Ohat   = np.fft.fftn(O)
+        Ohat   = self.fftn(O)
         
         # diffuse and Bragg weightings
         #-----------------------------
         if isValid('Bragg_weighting', args):
-            self.unit_cell_weighting = args['Bragg_weighting']
+            self.unit_cell_weighting = np.asarray(args['Bragg_weighting'], dtype=dtype)
         else :
-            self.unit_cell_weighting = np.zeros_like(I)
+            self.unit_cell_weighting = np.zeros(I.shape, dtype=dtype)
         
         if isValid('diffuse_weighting', args):
-            self.diffuse_weighting   = args['diffuse_weighting']
+            self.diffuse_weighting   = np.asarray(args['diffuse_weighting'], dtype=dtype)
         else :
-            self.diffuse_weighting   = np.zeros_like(I)
+            self.diffuse_weighting   = np.zeros(I.shape, dtype=dtype)
         
         # initialise the mask, alpha value and amp
         #-----------------------------------------------
@@ -158,14 +188,16 @@ class Mapper_ellipse():
         #print(np.sum(self.mask), 'good pixels')
         #print(self.mask.dtype, 'good pixels dtype')
         
-        self.I_norm = (self.mask * I).sum()
-        
         self.alpha = 1.0e-10
         if isValid('alpha', args):
             self.alpha = args['alpha']
 
-        self.I_norm = (self.mask * I).sum()
-        self.amp    = np.sqrt(I.astype(dtype))
+        self.I_norm = (self.mask * I).sum(dtype=np.float64)
+        
+        # the input arrays are not modified, so they are only 
+        # copied if they are not already of type dtype
+        I           = np.asarray(I, dtype=dtype)
+        self.amp    = np.sqrt(I)
 
         # define the support projection
         #-----------------------------------------------
@@ -191,7 +223,7 @@ class Mapper_ellipse():
         if isValid('sym', args):
             self.sym_ops = args['sym'] 
         else :
-            self.sym_ops = get_sym_ops(args['space_group'], args['unit_cell'], O.shape)
+            self.sym_ops = get_sym_ops(args['space_group'], args['unit_cell'], O.shape, c_dtype)
         
         # make the reconstruction modes
         #------------------------------
@@ -203,9 +235,13 @@ class Mapper_ellipse():
         #----------------------------------------------
         self.Wx         = (self.diffuse_weighting + self.sym_ops.no_solid_units * self.unit_cell_weighting).ravel()
         self.Wy         = self.diffuse_weighting.ravel()
-        self.I_ravel    = I.astype(dtype).ravel()
+        self.I_ravel    = I.ravel()
         self.mask_ravel = self.mask.astype(np.uint8).ravel()
         
+        # and the Imap / Emod arguments
+        self.Wu         = self.unit_cell_weighting.ravel()
+        self.amp_ravel  = self.amp.ravel()
+        
         # check that self.Imap == I * (x/e_0)**2 + (y/e_1)**2
         # or that (x/e_0)**2 + (y/e_1)**2 = 1
         self.iters = 0
@@ -214,42 +250,67 @@ class Mapper_ellipse():
 
          
     def object(self, modes):
-        out = np.fft.ifftn(modes[0])
+        out = self.ifftn(modes[0])
         return out
     
-    def Imap(self, modes):
-        U  = np.sum(modes, axis=0)
-        I  = self.diffuse_weighting   * np.sum( (modes * modes.conj()).real, axis=0)
-        I += self.unit_cell_weighting * (U * U.conj()).real
-        return I
+    def Imap(self, modes, out = None):
+        """
+        The diffraction intensity of the modes:
+            diffuse_weighting * sum_n |modes[n]|**2 + unit_cell_weighting * |sum_n modes[n]|**2
+        
+        evaluated in a single pass over the voxels by Imap_ellipse_cython, 
+        so there are no temporary arrays. If out is not None then the 
+        result is written into out (C contiguous, of type self.dtype).
+        """
+        if out is None :
+            out = np.empty(modes.shape[1:], dtype=self.dtype)
+        elif not out.flags.c_contiguous :
+            raise ValueError('out must be C contiguous')
+        
+        modes = np.ascontiguousarray(modes)
+        Imap_ellipse_cython(modes.reshape((modes.shape[0], -1)), 
+                            self.Wy, self.Wu, out.reshape(-1), self.threads)
+        return out
     
     def Psup(self, modes):
+        """
+        The support projection:
+            out_solid = ifftn(mean of the unflipped modes).real
+        
+        the solid unit is real so only the half spectrum (the last axis) 
+        is transformed, the half spectrum of the Hermitian part of the 
+        mean is accumulated from the modes by hermitian_half (there is 
+        no full size mean). The rfftn of the supported solid is expanded 
+        to the full spectrum (hermitian_expand) for the broadcast to 
+        the modes.
+        """
         out = modes.copy()
         
         # unit_cell terms: unflip the modes
         out = self.sym_ops.unflip_modes_Fourier(out, apply_translation = True, inplace=True)
         
-        # average 
-        out_solid = np.mean(out, axis=0)
-        
-        # propagate
-        out_solid = np.fft.ifftn(out_solid)
-        
-        # reality
-        out_solid.imag = 0
+        # average, propagate and reality
+        shape     = out.shape[1:]
+        H         = fft_backends.hermitian_half(out)
+        H        /= out.shape[0]
+        out_solid = self.irfftn(H, shape)
+        del H
         
         # finite support
         if self.voxel_number :
             #print('\n\nVoxel number support')
-            if self.overlap == 'unit_cell' :
-                self.voxel_support = choose_N_highest_pixels( (out_solid * out_solid.conj()).real.astype(np.float32), self.voxel_number, \
+            if self.overlap == 'unit_cell' and hasattr(self.sym_ops, 'overlap_mask_real') :
+                self.voxel_support = choose_N_highest_pixels( (out_solid**2).astype(np.float32), self.voxel_number, \
+                                     support = self.support, overlap_mask = self.sym_ops.overlap_mask_real)
+            elif self.overlap == 'unit_cell' :
+                self.voxel_support = choose_N_highest_pixels( (out_solid**2).astype(np.float32), self.voxel_number, \
                                      support = self.support, mapper = self.sym_ops.solid_syms_real)
             elif self.overlap == 'crystal' :
                 # try using the crystal mapping instead of the unit-cell mapping
-                self.voxel_support = choose_N_highest_pixels( (out_solid * out_solid.conj()).real.astype(np.float32), self.voxel_number, \
+                self.voxel_support = choose_N_highest_pixels( (out_solid**2).astype(np.float32), self.voxel_number, \
                                      support = self.support, mapper = self.sym_ops.solid_to_crystal_real)
             elif self.overlap is None :
-                self.voxel_support = choose_N_highest_pixels( (out_solid * out_solid.conj()).real.astype(np.float32), self.voxel_number, \
+                self.voxel_support = choose_N_highest_pixels( (out_solid**2).astype(np.float32), self.voxel_number, \
                                      support = self.support, mapper = None)
             else :
                 raise ValueError("overlap must be one of 'unit_cell', 'crystal' or None")
@@ -257,10 +318,10 @@ class Mapper_ellipse():
         out_solid *= self.voxel_support
         
         # store the latest guess for the object
-        self.O = out_solid.copy()
+        self.O = out_solid.astype(self.c_dtype)
         
         # propagate
-        out_solid = np.fft.fftn(out_solid)
+        out_solid = fft_backends.hermitian_expand(self.rfftn(out_solid), shape)
         
         # broadcast
         out = self.sym_ops.solid_syms_Fourier(out_solid, apply_translation=True,  syms=out)
@@ -269,49 +330,40 @@ class Mapper_ellipse():
         
         return out
 
-    def Pmod(self, modes):
-        u = np.fft.fftn(modes, axes=(0,)).reshape((modes.shape[0], -1)) / np.sqrt(modes.shape[0])
-        
-        # make x
-        #-----------------------------------------------
-        x = np.sqrt((u[0] * u[0].conj()).real).ravel()
-        
-        # make y
-        #-----------------------------------------------
-        if u.shape[0] > 1 :
-            y = np.sqrt(np.sum( (u[1:] * u[1:].conj()).real, axis=0))
-        else :
-            y = np.zeros_like(x)
-        
-        # project onto xp yp
-        #-----------------------------------------------
-        xp, yp = project_2D_Ellipse_arrays_cython_test(x, y,
-                                          self.Wx,
-                                          self.Wy,
-                                          self.I_ravel,
-                                          self.mask_ravel)
-        
-        # xp yp --> modes
-        #-----------------------------------------------
-        #u[0]  = u[0]  * xp / (x + self.alpha)
-        angle = np.angle(u[0])
-        u[0]  = xp * np.exp(1J*angle)
-        
-        u[1:] = u[1:] * yp / (y + self.alpha)
-        
-        # un-rotate
-        u = np.fft.ifftn(u, axes=(0,)) * np.sqrt(modes.shape[0])
-        
-        out = u.reshape(modes.shape)
+    def Pmod(self, modes, out = None):
+        """
+        The mode-axis transform, the ellipse projection and the 
+        rescaling are done in a single pass over the voxels by
+        Pmod_ellipse_cython, so the only full-volume allocation 
+        is the output. If out is not None then the result is 
+        written into out (which may be modes itself), out must be 
+        C contiguous so that the kernel can write into a view of it.
+        """
+        if out is None :
+            out = np.empty(modes.shape, dtype=modes.dtype)
+        elif not out.flags.c_contiguous :
+            raise ValueError('out must be C contiguous')
+        
+        Pmod_ellipse_cython(modes.reshape((modes.shape[0], -1)), 
+                            self.Wx, self.Wy, self.I_ravel, self.mask_ravel,
+                            self.alpha, out.reshape((modes.shape[0], -1)),
+                            self.threads, self.newton)
         return out
 
     def Emod(self, modes):
-        M         = self.Imap(modes)
-        M         = self.mask * ( np.sqrt(M) - self.amp )**2
-        eMod      = np.sum( M )
-        eMod      = np.sqrt( eMod / self.I_norm )
+        """
+        sqrt( sum mask * (sqrt(Imap(modes)) - amp)**2 / sum mask * I )
+        
+        the masked squared residual is reduced in the same pass over 
+        the voxels as Imap by Emod_ellipse_cython. 
+        """
+        modes = np.ascontiguousarray(modes)
+        eMod  = Emod_ellipse_cython(modes.reshape((modes.shape[0], -1)), 
+                                    self.Wy, self.Wu, self.amp_ravel, 
+                                    self.mask_ravel, self.threads)
+        eMod  = np.sqrt( eMod / self.I_norm )
         return eMod
-
+    
     def Esup(self, modes):
         M         = self.Psup(modes)
         M        -= modes
@@ -339,10 +391,36 @@ class Mapper_ellipse():
             den += np.sum( (array0[i] * array0[i].conj()).real ) 
         return np.sqrt(num / den)
 
-    def scans_cheshire(self, solid, scan_points=None, err = 'Emod'):
+    def l2norm_diff(self, array1, array0):
+        """
+        l2norm(array1 - array0, array0) without a full size difference array
+        """
+        num = 0
+        den = 0
+        for i in range(array0.shape[0]):
+            d    = array1[i] - array0[i]
+            num += np.vdot(d, d).real
+            den += np.vdot(array0[i], array0[i]).real
+        return np.sqrt(num / den)
+
+    def scans_cheshire(self, solid, scan_points=None, err = 'Emod', block = 2**22):
         """
         scan the solid unit through the cheshire cell 
         until the best agreement with the data is found.
+        
+        Rather than looping over the shifts, use the fact that on the 
+        Bragg masked reflections (q) each mode of the shifted solid unit is:
+            modes[n](q) = A[n](q) exp(-2pi i g[n](q) . t)
+        
+        where A[n] = modes[n] for t = 0, and g[n](q) = R[n]^T q is the 
+        frequency that the symmetry operation maps onto q. Only the 
+        unit-cell term |sum_n modes[n]|^2 depends on t, and the phase 
+        factor separates along each axis, so for each i the error for 
+        every (j, k) shift is evaluated with one batched matrix product:
+            U(q, j, k) = sum_n A[n](q) ex[n](q, i) ey[n](q, j) ez[n](q, k)
+        
+        the reflections are processed in chunks so that U has at most
+        'block' elements.
         """
         if err == 'Emod' :
             err = self.Emod 
@@ -357,9 +435,6 @@ class Mapper_ellipse():
             J = range(self.sym_ops.unitcell_size[1])
             K = range(self.sym_ops.unitcell_size[2])
         
-        errors = np.zeros((len(I), len(J), len(K)), dtype=np.float)
-        errors.fill(np.inf)
-        
         # only evaluate the error on Bragg peaks that are strong 
         Bragg_mask = self.unit_cell_weighting > 1.0e-1 * self.unit_cell_weighting[0,0,0]
         
@@ -368,58 +443,39 @@ class Mapper_ellipse():
         Bragg_mask = np.sum(Bragg_mask, axis=0)>0
         
         # propagate
-        s  = np.fft.fftn(solid)
-        s1 = np.zeros_like(s)
+        s  = self.fftn(solid.astype(self.c_dtype))
         
-        qi = np.fft.fftfreq(s.shape[0]) 
-        qj = np.fft.fftfreq(s.shape[1])
-        qk = np.fft.fftfreq(s.shape[2])
-        qi, qj, qk = np.meshgrid(qi, qj, qk, indexing='ij')
-        qi = qi[Bragg_mask]
-        qj = qj[Bragg_mask]
-        qk = qk[Bragg_mask]
-        
-        ii = np.fft.fftfreq(s.shape[0], 1./s.shape[0]).astype(np.int)
-        jj = np.fft.fftfreq(s.shape[1], 1./s.shape[1]).astype(np.int)
-        kk = np.fft.fftfreq(s.shape[2], 1./s.shape[2]).astype(np.int)
+        ii = np.fft.fftfreq(s.shape[0], 1./s.shape[0]).astype(int)
+        jj = np.fft.fftfreq(s.shape[1], 1./s.shape[1]).astype(int)
+        kk = np.fft.fftfreq(s.shape[2], 1./s.shape[2]).astype(int)
         ii, jj, kk = np.meshgrid(ii, jj, kk, indexing='ij')
         ii = ii[Bragg_mask]
         jj = jj[Bragg_mask]
         kk = kk[Bragg_mask]
         
-        sBragg = s[Bragg_mask]
-        modes  = np.empty((self.modes.shape[0],)+s[Bragg_mask].shape, dtype=self.modes.dtype)
+        # the modes for zero shift
+        A = self.sym_ops.solid_syms_Fourier_masked(s, ii, jj, kk, apply_translation=True)
+        A = A.astype(np.complex128)
+        
+        # the frequencies g[n](q) (in cycles / pixel) along each axis, 
+        # these are the symmetry broadcasts of the coordinates
+        ex, ey, ez = [], [], []
+        for d, (e, T) in enumerate(zip([ex, ey, ez], [I, J, K])):
+            q = np.fft.fftfreq(s.shape[d]).reshape([-1 if dd == d else 1 for dd in range(3)])
+            q = np.broadcast_to(q, s.shape)
+            g = self.sym_ops.solid_syms_Fourier_masked(q, ii, jj, kk, apply_translation=False)
+            # (n, q, shift)
+            e.append(np.exp(- 2J * np.pi * g[:, :, None] * np.array(T)[None, None, :]))
+        ex, ey, ez = ex[0], ey[0], ez[0]
+        
         amp    = self.amp[Bragg_mask] 
-        if self.mask is not 1 :
-            mask = self.mask[Bragg_mask] 
-        else :
-            mask = 1
+        mask   = self.mask[Bragg_mask] 
         I_norm = np.sum(mask*amp**2)
         diffuse_weighting    = self.diffuse_weighting[Bragg_mask]
         unit_cell_weighting  = self.unit_cell_weighting[Bragg_mask]
         
-        for i in I:
-            for j in J:
-                for k in K:
-                    phase_ramp = np.exp(- 2J * np.pi * (i * qi + j * qj + k * qk))
-                     
-                    s1[Bragg_mask] = sBragg * phase_ramp
-                     
-                    # broadcast
-                    modes = self.sym_ops.solid_syms_Fourier_masked(s1, ii, jj, kk, apply_translation=True,  syms = modes)
-                    
-                    # I map
-                    U  = np.sum(modes, axis=0)
-                     
-                    diff  = diffuse_weighting   * np.sum( (modes * modes.conj()).real, axis=0)
-                    diff += unit_cell_weighting * (U * U.conj()).real
-                    
-                    # Emod
-                    mask      = mask 
-                    eMod      = np.sum( mask * ( np.sqrt(diff) - amp )**2 )
-                    eMod      = np.sqrt( eMod / I_norm )
-
-                    errors[i - I[0], j - J[0], k - K[0]] = eMod
+        errors = cheshire_errors(A, ex, ey, ez, diffuse_weighting, unit_cell_weighting, amp, mask, block)
+        errors = np.sqrt( errors / I_norm )
         
         l = np.argmin(errors)
         i, j, k = np.unravel_index(l, errors.shape)
@@ -432,13 +488,13 @@ class Mapper_ellipse():
         T0 = np.exp(- 2J * np.pi * I[i] * qi)
         T1 = np.exp(- 2J * np.pi * J[j] * qj)
         T2 = np.exp(- 2J * np.pi * K[k] * qk)
-        phase_ramp = reduce(np.multiply.outer, [T0, T1, T2])
+        phase_ramp = reduce(np.multiply.outer, [T0, T1, T2]).astype(self.c_dtype)
         s1         = s * phase_ramp
         
         # broadcast
         modes = self.sym_ops.solid_syms_Fourier(s1, apply_translation=True)
         
-        s1 = np.fft.ifftn(s1)
+        s1 = self.ifftn(s1)
         
         info = {}
         info['eMod'] = [self.Emod(modes)]
@@ -447,77 +503,123 @@ class Mapper_ellipse():
         info.update(self.finish(modes))
         return s1, info
 
-def choose_N_highest_pixels(array, N, tol = 1.0e-10, maxIters=1000, mapper = None, support = None):
+def cheshire_errors(A, ex, ey, ez, diffuse_weighting, unit_cell_weighting, amp, mask, block = 2**22):
     """
-    Use bisection to find the root of
-    e(x) = \sum_i (array_i > x) - N
+    The (un-normalised) Emod of the Cheshire scan for every shift (i, j, k):
+        errors[i, j, k] = sum_q mask * (sqrt(diff(q, i, j, k)) - amp)**2
+    
+    where, for the modes A[n](q) of zero shift and the phase factors 
+    ex[n](q, i), ey[n](q, j) and ez[n](q, k) of each axis:
+        U(q, i, j, k)    = sum_n A[n](q) ex[n](q, i) ey[n](q, j) ez[n](q, k)
+        diff(q, i, j, k) = diffuse_weighting sum_n |A[n](q)|^2 + unit_cell_weighting |U|^2
+    
+    see Mapper_ellipse.scans_cheshire. The reflections are processed 
+    in chunks so that U has at most 'block' elements for each i.
+    """
+    # the diffuse term does not depend on the shift
+    diff0 = diffuse_weighting * np.sum( (A * A.conj()).real, axis=0)
+    
+    # (q, k, n) for the batched matrix product
+    ez = np.ascontiguousarray(ez.transpose((1, 0, 2)))
+    
+    errors = np.zeros((ex.shape[2], ey.shape[2], ez.shape[2]), dtype=float)
+    chunk  = max(1, block // (ey.shape[2] * ez.shape[2]))
+    for i in range(ex.shape[2]):
+        for q0 in range(0, A.shape[1], chunk):
+            q1 = min(q0 + chunk, A.shape[1])
+            
+            # (q, j, n) x (q, n, k) --> (q, j, k)
+            a = (A[:, q0:q1] * ex[:, q0:q1, i])[:, :, None] * ey[:, q0:q1, :]
+            U = np.matmul(a.transpose((1, 2, 0)), ez[q0:q1])
+             
+            diff  = diff0[q0:q1, None, None] + \
+                    unit_cell_weighting[q0:q1, None, None] * (U * U.conj()).real
+            
+            # Emod
+            m = mask[q0:q1, None, None]
+            errors[i] += np.sum( m * ( np.sqrt(diff) - amp[q0:q1, None, None] )**2, axis=0 )
+    return errors
 
-    then return (array_i > x) a boolean mask
+def choose_N_highest_pixels(array, N, mapper = None, support = None, overlap_mask = None):
+    """
+    Return a boolean mask of the N highest values in array.
 
-    This is faster than using percentile (surprising)
+    The N'th highest value is found with np.partition (O(n)), after
+    discarding values below a cutoff estimated from a strided sample, 
+    then every value above it is selected. Ties at the cutoff are 
+    broken in favour of the lowest flat index, so exactly N voxels 
+    are returned (or all candidates if there are fewer than N).
 
     If support is not None then values outside the support
-    are ignored. 
+    are ignored. If mapper is not None then values that are not 
+    the maximum of their symmetry related copies, mapper(array), 
+    are ignored (no overlap constraint). 
+    
+    overlap_mask(array, index) can be used instead of mapper to 
+    return this mask at the flat indices index (e.g. 
+    sym_ops.overlap_mask_real), then it is only evaluated for the 
+    sample and for the voxels above the cutoff.
     """
+    a = array.ravel()
+    
+    if support is not None and np.ndim(support) > 0 :
+        sup = support.ravel() > 0
+    else :
+        sup = None
     
     # no overlap constraint
-    if mapper is not None :
+    if overlap_mask is None and mapper is not None :
         syms = mapper(array)
         # if array is not the maximum value
         # of the M symmetry related units 
         # then do not update 
-        max_support = syms[0] == np.max(syms, axis=0) 
-    else :
-        max_support = np.ones(array.shape, dtype = np.bool)
+        max_support = (syms[0] == np.max(syms, axis=0)).ravel()
+        sup = max_support if sup is None else sup * max_support
     
-    if support is not None and support is not 1 :
-        sup = support
-        a = array[(max_support > 0) * (support > 0)]
-    else :
-        sup = 1
-        a = array[(max_support > 0)]
+    def valid(index):
+        v = np.ones(len(index), dtype = bool) if sup is None else sup[index]
+        if overlap_mask is not None :
+            v[v] = overlap_mask(array, index[v])
+        return index[v]
     
-    # search for the cutoff value
-    s0 = array.max()
-    s1 = array.min()
+    if N <= 0 :
+        return np.zeros(array.shape, dtype = bool)
     
-    failed = False
-    for i in range(maxIters):
-        s = (s0 + s1) / 2.
-        e = np.sum(a > s) - N
-          
-        if e == 0 :
-            #print('e==0, exiting...')
-            break
-        
-        if e < 0 :
-            s0 = s
-        else :
-            s1 = s
-
-        #print(s, s0, s1, e)
-        if np.abs(s0 - s1) < tol and np.abs(e) > 0 :
-            failed = True
-            print('s0==s1, exiting...', s0, s1)
-            break
-        
-    S = (array > s) * max_support * sup
+    # throw away most of the values below the cutoff before 
+    # partitioning, using a conservative cutoff (~2N values above) 
+    # estimated from a strided sample
+    ind  = None
+    step = a.size // 2**16
+    if step > 1 :
+        sample = np.sort(a[valid(np.arange(0, a.size, step))])
+        j      = sample.size - 1 - (2 * N) // step
+        if j > 0 :
+            ind = valid(np.flatnonzero(a >= sample[j]))
+            if ind.size < N :
+                ind = None
     
-    # if failed is True then there are a lot of 
-    # entries in a that equal s
-    if failed :
-        print('failed, sum(max_support), sum(S), voxels, pixels>0:',np.sum(max_support), np.sum(S), N, np.sum(array>0), len(a>0))
-        # if S is less than the 
-        # number of voxels then include 
-        # some of the pixels where array == s
-        count      = np.sum(S)
-        ii, jj, kk = np.where((np.abs(array-s)<=tol) * (max_support * support > 0))
-        l          = N - count
-        print(count, N, l, len(ii))
-        if l > 0 :
-            S[ii[:l], jj[:l], kk[:l]]    = True
+    # otherwise use every valid voxel
+    if ind is None :
+        if overlap_mask is None and sup is None :
+            ind = np.arange(a.size)
+        elif overlap_mask is None :
+            ind = np.flatnonzero(sup)
         else :
-            S[ii[:-l], jj[:-l], kk[:-l]] = False
+            m   = overlap_mask(array).ravel()
+            ind = np.flatnonzero(m if sup is None else m * sup)
+    
+    S = np.zeros(a.size, dtype = bool)
+    if N >= ind.size :
+        S[ind] = True
+        return S.reshape(array.shape)
+    
+    # the N'th highest value
+    b = a[ind]
+    k = b.size - N
+    s = np.partition(b, k)[k]
     
-    #print('number of pixels in support:', np.sum(S), i, s, e)
-    return S
+    S[ind[b > s]] = True
+    l = N - np.count_nonzero(S)
+    if l > 0 :
+        S[ind[b == s][:l]] = True
+    return S.reshape(array.shape)
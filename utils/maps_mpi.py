@@ -0,0 +1,711 @@
+#!/usr/bin/env python
+
+# for python 2 / 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+try :
+    range = xrange
+except NameError :
+    pass
+
+import numpy as np
+import sys, os
+from functools import reduce
+
+from mpi4py import MPI
+
+import symmetry_operations
+import fft_backends
+import maps
+
+import pyximport; pyximport.install()
+from ellipse_2D_cython_new import Emod_ellipse_cython
+
+from phasing_3d.src.mappers import isValid
+
+
+def slab_bounds(n, size):
+    """
+    Split range(n) into 'size' contiguous slabs (as np.array_split),
+    returns the bounds [0, n_0, n_0 + n_1, ..., n] so that rank r
+    has rows bounds[r]:bounds[r+1].
+    """
+    base, extra = divmod(n, size)
+    counts = [base + (r < extra) for r in range(size)]
+    return np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+def _displs(counts):
+    return np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+
+
+class Slab_fft():
+    """
+    The n-dimensional FFT of a 3D volume that is split into slabs
+    along the first axis (rows bounds[rank]:bounds[rank+1] on each rank).
+
+    The last two axes are transformed locally, the slabs are then
+    transposed (with MPI Alltoallv) so that each rank has a slab of the
+    second axis, the first axis is transformed and the result is
+    transposed back. The input and output have the same decomposition.
+    """
+    def __init__(self, shape, comm, fft = None, threads = None, c_dtype = np.complex128):
+        self.shape = tuple(shape)
+        self.comm  = comm
+        self.rank  = comm.Get_rank()
+        self.size  = comm.Get_size()
+
+        self.rows  = slab_bounds(shape[0], self.size)
+        self.cols  = slab_bounds(shape[1], self.size)
+
+        self.fftn_local, self.ifftn_local = fft_backends.get_fft(fft, threads, c_dtype)
+
+    def fftn(self, a):
+        return self._fft(a, self.fftn_local)
+
+    def ifftn(self, a):
+        return self._fft(a, self.ifftn_local)
+
+    def _fft(self, a, fft):
+        b = fft(a, axes = (1, 2))
+        t = self._transpose(b)
+        del b
+        t = fft(t, axes = (0,), overwrite_x = True)
+        return self._untranspose(t)
+
+    def _transpose(self, b):
+        # (rows of this rank, n1, n2) --> (n0, cols of this rank, n2)
+        n0, n1, n2 = self.shape
+        r, c = self.rows, self.cols
+        m0 = r[self.rank+1] - r[self.rank]
+        m1 = c[self.rank+1] - c[self.rank]
+
+        sendbuf = np.empty(b.size, dtype = b.dtype)
+        send_counts = [m0 * (c[i+1] - c[i]) * n2 for i in range(self.size)]
+        for i, d in enumerate(_displs(send_counts)):
+            sendbuf[d : d + send_counts[i]].reshape((m0, -1, n2))[:] = b[:, c[i]:c[i+1]]
+
+        # the blocks from each rank stack along the first axis
+        recvbuf = np.empty((n0, m1, n2), dtype = b.dtype)
+        recv_counts = [(r[i+1] - r[i]) * m1 * n2 for i in range(self.size)]
+        self.comm.Alltoallv([sendbuf, (send_counts, _displs(send_counts))],
+                            [recvbuf, (recv_counts, _displs(recv_counts))])
+        return recvbuf
+
+    def _untranspose(self, t):
+        # (n0, cols of this rank, n2) --> (rows of this rank, n1, n2)
+        n0, n1, n2 = self.shape
+        r, c = self.rows, self.cols
+        m0 = r[self.rank+1] - r[self.rank]
+        m1 = c[self.rank+1] - c[self.rank]
+
+        # the rows for each rank are already contiguous
+        t = np.ascontiguousarray(t)
+        send_counts = [(r[i+1] - r[i]) * m1 * n2 for i in range(self.size)]
+
+        recvbuf = np.empty(m0 * n1 * n2, dtype = t.dtype)
+        recv_counts = [m0 * (c[i+1] - c[i]) * n2 for i in range(self.size)]
+        self.comm.Alltoallv([t, (send_counts, _displs(send_counts))],
+                            [recvbuf, (recv_counts, _displs(recv_counts))])
+
+        out = np.empty((m0, n1, n2), dtype = t.dtype)
+        for i, d in enumerate(_displs(recv_counts)):
+            out[:, c[i]:c[i+1]] = recvbuf[d : d + recv_counts[i]].reshape((m0, -1, n2))
+        return out
+
+
+def point_group(sym_ops):
+    """
+    The integer matrices R of the symmetry operations of sym_ops (P1,
+    P212121 or Space_group), so that in Fourier space:
+        solid_syms_Fourier(solid)[n][q] = solid[R_n^T q] * T_n[q]
+
+    where T_n is the translation ramp (sym_ops.translations[n]).
+    """
+    if hasattr(sym_ops, 'Rs') :
+        return [np.array(R, dtype=np.int64) for R in sym_ops.Rs]
+
+    elif isinstance(sym_ops, symmetry_operations.P212121) :
+        # x = x
+        # x = 0.5 + x, 0.5 - y, -z
+        # x = -x, 0.5 + y, 0.5 - z
+        # x = 0.5 - x, -y, 0.5 + z
+        return [np.diag(s).astype(np.int64) for s in [[1, 1, 1], [1, -1, -1], [-1, 1, -1], [-1, -1, 1]]]
+
+    elif isinstance(sym_ops, symmetry_operations.P1) :
+        return [np.eye(3, dtype=np.int64)]
+
+    else :
+        raise ValueError('the symmetry operations of ' + type(sym_ops).__name__ + ' are not known')
+
+
+class Slab_sym_ops():
+    """
+    solid_syms_Fourier and unflip_modes_Fourier of sym_ops for Fourier
+    space arrays that are split into slabs along the first axis.
+
+    The voxel permutation of each symmetry operation is done with one
+    MPI Alltoallv: a plan (which local voxels to send to each rank and
+    where the received voxels go) is made the first time that the
+    operation is used, then the translation ramps are applied locally.
+    """
+    def __init__(self, sym_ops, shape, comm, rows):
+        self.sym_ops = sym_ops
+        self.shape   = tuple(shape)
+        self.comm    = comm
+        self.rank    = comm.Get_rank()
+        self.size    = comm.Get_size()
+        self.rows    = rows
+        self.no_solid_units = sym_ops.no_solid_units
+
+        self.Rs = point_group(sym_ops)
+
+        # the 1D factors of the translation ramps with the
+        # first axis restricted to the local rows (None for 1)
+        lo, hi = rows[self.rank], rows[self.rank+1]
+        if hasattr(sym_ops, 'make_Ts') and sym_ops.translations is None :
+            sym_ops.make_Ts()
+
+        self.translations      = []
+        self.translations_conj = []
+        for n in range(self.no_solid_units):
+            T = sym_ops.translations[n]
+            if np.ndim(T) == 0 or all(np.all(t == 1) for t in T) :
+                self.translations.append(None)
+                self.translations_conj.append(None)
+            else :
+                T = [T[0][lo:hi], T[1], T[2]]
+                self.translations.append(T)
+                self.translations_conj.append([t.conj() for t in T])
+
+        self.plans = {}
+
+    def make_plan(self, M):
+        """
+        The plan to gather out[q] = a[M q] (q modulo the shape),
+        with M an integer matrix, when a and out are split into slabs.
+        """
+        key = tuple(M.ravel())
+        if key in self.plans :
+            return self.plans[key]
+
+        shape = np.array(self.shape)
+        lo, hi = self.rows[self.rank], self.rows[self.rank+1]
+        row    = shape[1] * shape[2]
+
+        # the global flat index of the source of each local voxel
+        q       = np.indices((hi - lo,) + self.shape[1:]).reshape((3, -1))
+        q[0]   += lo
+        src     = np.ravel_multi_index(np.dot(M, q) % shape[:, None], self.shape)
+        del q
+
+        # the rank that has each source voxel
+        owner   = np.searchsorted(self.rows, src // row, side = 'right') - 1
+        order   = np.argsort(owner, kind = 'stable')
+
+        recv_counts = np.bincount(owner, minlength = self.size).astype(np.int64)
+        send_counts = np.empty(self.size, dtype=np.int64)
+        self.comm.Alltoall(recv_counts, send_counts)
+        recv_counts = [int(c) for c in recv_counts]
+        send_counts = [int(c) for c in send_counts]
+
+        # ask each rank for the voxels that we need
+        requested = np.ascontiguousarray(src[order], dtype=np.int64)
+        send_inds = np.empty(sum(send_counts), dtype=np.int64)
+        self.comm.Alltoallv([requested, (recv_counts, _displs(recv_counts))],
+                            [send_inds, (send_counts, _displs(send_counts))])
+        send_inds -= lo * row
+
+        plan = (send_inds, send_counts, recv_counts, order)
+        self.plans[key] = plan
+        return plan
+
+    def gather(self, a, M, out):
+        """
+        out[q] = a[M q] for the local slabs a and out (not the same array)
+        """
+        send_inds, send_counts, recv_counts, order = self.make_plan(M)
+
+        sendbuf = np.take(np.ascontiguousarray(a).ravel(), send_inds)
+        recvbuf = np.empty(len(order), dtype = a.dtype)
+        self.comm.Alltoallv([sendbuf, (send_counts, _displs(send_counts))],
+                            [recvbuf, (recv_counts, _displs(recv_counts))])
+        out.reshape(-1)[order] = recvbuf
+        return out
+
+    def solid_syms_Fourier(self, solid, apply_translation = True, syms = None):
+        """
+        Take the (local slab of the) Fourier space solid unit then
+        return each of the symmetry related partners.
+        """
+        if syms is None :
+            syms = np.empty((self.no_solid_units,) + solid.shape, dtype=solid.dtype)
+
+        for n, R in enumerate(self.Rs):
+            if np.all(R == np.eye(3)) :
+                syms[n] = solid
+            else :
+                self.gather(solid, R.T, syms[n])
+
+            if apply_translation and self.translations[n] is not None :
+                symmetry_operations.multiply_T_fourier(syms[n], self.translations[n], out = syms[n])
+        return syms
+
+    def unflip_modes_Fourier(self, U, apply_translation=True, inplace = False):
+        if inplace :
+            U_inv = U
+        else :
+            U_inv = U.copy()
+
+        # scratch array for one mode
+        t = np.empty(U_inv.shape[1:], dtype=U_inv.dtype)
+
+        for n, R in enumerate(self.Rs):
+            translate = apply_translation and self.translations_conj[n] is not None
+            if np.all(R == np.eye(3)) :
+                if translate :
+                    symmetry_operations.multiply_T_fourier(U_inv[n], self.translations_conj[n], out = U_inv[n])
+                continue
+
+            if translate :
+                symmetry_operations.multiply_T_fourier(U_inv[n], self.translations_conj[n], out = t)
+            else :
+                t[:] = U_inv[n]
+
+            Rinv = np.rint(np.linalg.inv(R)).astype(np.int64)
+            self.gather(t, Rinv.T, U_inv[n])
+        return U_inv
+
+
+def choose_N_highest_pixels_mpi(array, N, comm, support = None):
+    """
+    Return a boolean mask of the N highest values of the distributed
+    array (each rank has a slab of the first axis). This is the same as
+    maps.choose_N_highest_pixels for the full array, with no overlap
+    constraint: ties at the cutoff are broken in favour of the lowest
+    (global) flat index, so exactly N voxels are returned.
+
+    Each rank contributes its N highest values and the N'th highest of
+    these is the global cutoff, then the number of voxels above the
+    cutoff is reduced over the ranks.
+    """
+    a = array.ravel()
+    S = np.zeros(a.size, dtype = bool)
+
+    if support is not None and np.ndim(support) > 0 :
+        ind = np.flatnonzero(support.ravel() > 0)
+    else :
+        ind = np.arange(a.size)
+    b = a[ind]
+
+    if N <= 0 :
+        return S.reshape(array.shape)
+
+    # the local candidates
+    if b.size > N :
+        c = np.partition(b, b.size - N)[b.size - N:]
+    else :
+        c = b
+    c = np.ascontiguousarray(c)
+
+    counts = comm.allgather(c.size)
+    allc   = np.empty(sum(counts), dtype = c.dtype)
+    comm.Allgatherv(c, [allc, (counts, _displs(counts))])
+
+    # there are fewer than N valid voxels
+    if N >= allc.size :
+        S[ind] = True
+        return S.reshape(array.shape)
+
+    # the N'th highest value
+    k = allc.size - N
+    s = np.partition(allc, k)[k]
+
+    S[ind[b > s]] = True
+    above = comm.allreduce(np.count_nonzero(S))
+
+    # the ties go to the lowest ranks first
+    ties   = ind[b == s]
+    before = comm.exscan(ties.size)
+    if before is None :
+        before = 0
+    l = N - above - before
+    if l > 0 :
+        S[ties[:l]] = True
+    return S.reshape(array.shape)
+
+
+class Mapper_ellipse_mpi(maps.Mapper_ellipse):
+
+    def __init__(self, I, **args):
+        """
+        Mapper_ellipse for volumes that are split into slabs along the
+        first axis over the ranks of an MPI communicator (run with e.g.
+        mpirun -np 8). Every method works on the local slabs, e.g. modes
+        has the shape (no_solid_units, rows, n1, n2) where rows are the
+        rows bounds[rank]:bounds[rank+1] of the volume (see slab_bounds).
+
+        Pmod and Imap are per voxel so they are computed locally, Psup
+        uses a distributed FFT (Slab_fft) and distributed symmetry
+        operations (Slab_sym_ops), the voxel number support is chosen
+        with a global cutoff (choose_N_highest_pixels_mpi) and the errors
+        are reduced over the ranks. So no rank ever stores the full modes.
+
+        Parameters
+        ----------
+        I : array like, float
+            The 3D diffraction volume, only I[rows] is read by each rank
+            so this can be a np.memmap or a h5py dataset.
+
+        Keyword Arguments
+        -----------------
+        comm : MPI communicator, optional, default (MPI.COMM_WORLD)
+
+        Bragg_weighting, diffuse_weighting, solid_unit, mask, support : array like
+            as in Mapper_ellipse, each rank reads its slab.
+
+        overlap : None
+            the overlap constraints are not supported.
+
+        The other arguments are the same as for Mapper_ellipse. Use 
+        gather to collect a distributed array on one rank.
+        """
+        if isValid('comm', args) :
+            self.comm = args['comm']
+        else :
+            self.comm = MPI.COMM_WORLD
+
+        self.rank = self.comm.Get_rank()
+        self.size = self.comm.Get_size()
+
+        # dtype
+        #-----------------------------------------------
+        if isValid('dtype', args) :
+            dtype   = np.dtype(args['dtype']).type
+            a       = np.array([1], dtype=dtype)
+            c_dtype = np.array(a+1J).dtype.type
+        else :
+            dtype   = np.float64
+            c_dtype = np.complex128
+
+        self.dtype   = dtype
+        self.c_dtype = c_dtype
+
+        # number of threads for the ellipse projection
+        # (the cpu cores are shared by the ranks on each node)
+        #-----------------------------------------------
+        if isValid('threads', args) :
+            self.threads = args['threads']
+        else :
+            import multiprocessing
+            node = self.comm.Split_type(MPI.COMM_TYPE_SHARED)
+            self.threads = max(1, multiprocessing.cpu_count() // node.Get_size())
+            node.Free()
+
+        if isValid('newton', args) :
+            self.newton = int(args['newton'])
+        else :
+            self.newton = 0
+
+        # the slab decomposition and the distributed fft
+        #-----------------------------------------------
+        self.shape  = tuple(I.shape)
+        if isValid('fft', args) :
+            fft = args['fft']
+        else :
+            fft = None
+        self.slab_fft = Slab_fft(self.shape, self.comm, fft, self.threads, c_dtype)
+        self.rows     = self.slab_fft.rows
+        self.fftn     = self.slab_fft.fftn
+        self.ifftn    = self.slab_fft.ifftn
+
+        if self.shape[0] < self.size or self.shape[1] < self.size :
+            raise ValueError('the volume is too small for ' + str(self.size) + ' ranks')
+
+        # initialise the object
+        #-----------------------------------------------
+        if isValid('solid_unit', args):
+            O = self.local(args['solid_unit']).astype(c_dtype)
+        else :
+            if self.rank == 0 : print('initialising object with random numbers')
+            O = np.random.random(self.local_shape).astype(c_dtype)
+
+        self.O = O
+        Ohat   = self.fftn(O)
+
+        # diffuse and Bragg weightings
+        #-----------------------------
+        if isValid('Bragg_weighting', args):
+            self.unit_cell_weighting = self.local(args['Bragg_weighting'], dtype)
+        else :
+            self.unit_cell_weighting = np.zeros(self.local_shape, dtype=dtype)
+
+        if isValid('diffuse_weighting', args):
+            self.diffuse_weighting   = self.local(args['diffuse_weighting'], dtype)
+        else :
+            self.diffuse_weighting   = np.zeros(self.local_shape, dtype=dtype)
+
+        # initialise the mask, alpha value and amp
+        #-----------------------------------------------
+        if isValid('mask', args):
+            if self.rank == 0 : print('setting mask...')
+            self.mask = self.local(args['mask'], bool)
+        else :
+            self.mask = np.ones(self.local_shape, dtype=bool)
+
+        self.alpha = 1.0e-10
+        if isValid('alpha', args):
+            self.alpha = args['alpha']
+
+        I           = self.local(I, dtype)
+        self.I_norm = self.comm.allreduce((self.mask * I).sum(dtype=np.float64))
+        self.amp    = np.sqrt(I)
+
+        # define the support projection
+        #-----------------------------------------------
+        if isValid('support', args) :
+            self.support = self.local(args['support'])
+        else :
+            self.support = 1
+
+        if isValid('voxels', args) :
+            self.voxel_number  = args['voxels']
+            self.voxel_support = np.ones(self.local_shape, dtype=bool)
+        else :
+            self.voxel_number  = False
+            self.voxel_support = self.support.copy()
+
+        if isValid('overlap', args) :
+            raise ValueError('the overlap constraints are not supported by Mapper_ellipse_mpi')
+        self.overlap = None
+
+        # make the crystal symmetry operator
+        #-----------------------------------
+        if isValid('sym', args):
+            self.sym_ops = args['sym']
+        else :
+            self.sym_ops = maps.get_sym_ops(args['space_group'], args['unit_cell'], self.shape, c_dtype)
+
+        self.slab_ops = Slab_sym_ops(self.sym_ops, self.shape, self.comm, self.rows)
+
+        # make the reconstruction modes
+        #------------------------------
+        self.modes = self.slab_ops.solid_syms_Fourier(Ohat, apply_translation = True)
+
+        # precalculate the ellipse projection arguments
+        #----------------------------------------------
+        self.Wx         = (self.diffuse_weighting + self.sym_ops.no_solid_units * self.unit_cell_weighting).ravel()
+        self.Wy         = self.diffuse_weighting.ravel()
+        self.I_ravel    = I.ravel()
+        self.mask_ravel = self.mask.astype(np.uint8).ravel()
+
+        # and the Imap / Emod arguments
+        self.Wu         = self.unit_cell_weighting.ravel()
+        self.amp_ravel  = self.amp.ravel()
+
+        self.iters = 0
+
+        eMod = self.Emod(self.modes)
+        if self.rank == 0 : print('eMod(modes0):', eMod)
+
+    @property
+    def local_shape(self):
+        return (self.rows[self.rank+1] - self.rows[self.rank],) + self.shape[1:]
+
+    def local(self, a, dtype = None):
+        """
+        The slab of the (global) array like a on this rank.
+        """
+        if np.ndim(a) == 0 :
+            return a
+        return np.asarray(a[self.rows[self.rank] : self.rows[self.rank+1]], dtype = dtype)
+
+    def gather(self, a, root = 0):
+        """
+        Collect the slabs a (split along the first axis) from every
+        rank into the full array on root, returns None on the other ranks.
+        """
+        a      = np.ascontiguousarray(a)
+        dtype  = a.dtype
+        if dtype == bool :
+            a = a.view(np.uint8)
+
+        n      = int(np.prod(a.shape[1:]))
+        counts = [int(self.rows[r+1] - self.rows[r]) * n for r in range(self.size)]
+
+        if self.rank == root :
+            out = np.empty((self.shape[0],) + a.shape[1:], dtype = a.dtype)
+            self.comm.Gatherv(a, [out, (counts, _displs(counts))], root = root)
+            return out.view(dtype)
+        else :
+            self.comm.Gatherv(a, None, root = root)
+            return None
+
+    def Psup(self, modes):
+        """
+        The support projection (see Mapper_ellipse.Psup), with
+        the distributed fft and symmetry operations.
+        """
+        out = modes.copy()
+
+        # unit_cell terms: unflip the modes
+        out = self.slab_ops.unflip_modes_Fourier(out, apply_translation = True, inplace=True)
+
+        # average (in place, out is overwritten by the broadcast below)
+        out_solid = out[0]
+        for n in range(1, out.shape[0]):
+            out_solid += out[n]
+        out_solid /= out.shape[0]
+
+        # propagate and reality
+        out_solid = np.ascontiguousarray(self.ifftn(out_solid).real)
+
+        # finite support
+        if self.voxel_number :
+            self.voxel_support = choose_N_highest_pixels_mpi( (out_solid**2).astype(np.float32),
+                                 self.voxel_number, self.comm, support = self.support)
+
+        out_solid *= self.voxel_support
+
+        # store the latest guess for the object
+        self.O = out_solid.astype(self.c_dtype)
+
+        # propagate
+        out_solid = self.fftn(self.O)
+
+        # broadcast
+        out = self.slab_ops.solid_syms_Fourier(out_solid, apply_translation=True,  syms=out)
+
+        self.iters += 1
+
+        return out
+
+    def Emod(self, modes):
+        """
+        sqrt( sum mask * (sqrt(Imap(modes)) - amp)**2 / sum mask * I )
+
+        with the sum reduced over the ranks.
+        """
+        modes = np.ascontiguousarray(modes)
+        eMod  = Emod_ellipse_cython(modes.reshape((modes.shape[0], -1)),
+                                    self.Wy, self.Wu, self.amp_ravel,
+                                    self.mask_ravel, self.threads)
+        eMod  = self.comm.allreduce(eMod)
+        eMod  = np.sqrt( eMod / self.I_norm )
+        return eMod
+
+    def Esup(self, modes):
+        M    = self.Psup(modes)
+        M   -= modes
+        num  = self.comm.allreduce(np.sum( (M * M.conj() ).real ))
+        den  = self.comm.allreduce(np.sum( (modes * modes.conj()).real ))
+        return np.sqrt( num / den )
+
+    def l2norm(self, delta, array0):
+        num = 0
+        den = 0
+        for i in range(delta.shape[0]):
+            num += np.sum( (delta[i] * delta[i].conj()).real )
+            den += np.sum( (array0[i] * array0[i].conj()).real )
+        num, den = self.comm.allreduce(np.array([num, den]))
+        return np.sqrt(num / den)
+
+    def l2norm_diff(self, array1, array0):
+        """
+        l2norm(array1 - array0, array0) without a full size difference array
+        """
+        num = 0
+        den = 0
+        for i in range(array0.shape[0]):
+            d    = array1[i] - array0[i]
+            num += np.vdot(d, d).real
+            den += np.vdot(array0[i], array0[i]).real
+        num, den = self.comm.allreduce(np.array([num, den]))
+        return np.sqrt(num / den)
+
+    def scans_cheshire(self, solid, scan_points=None, err = 'Emod', block = 2**22):
+        """
+        scan the (local slab of the) solid unit through the cheshire 
+        cell until the best agreement with the data is found, as in 
+        Mapper_ellipse.scans_cheshire.
+        
+        Each rank evaluates the errors of every shift on its own Bragg 
+        reflections (maps.cheshire_errors), these are summed over the 
+        ranks. The frequencies g[n](q) = R[n]^T q of the symmetry 
+        operations are evaluated directly (see point_group), so only 
+        the zero shift modes are communicated.
+        """
+        if scan_points is not None :
+            I = scan_points[0]
+            J = scan_points[1]
+            K = scan_points[2]
+        else :
+            I = range(self.sym_ops.unitcell_size[0])
+            J = range(self.sym_ops.unitcell_size[1])
+            K = range(self.sym_ops.unitcell_size[2])
+        
+        # only evaluate the error on Bragg peaks that are strong 
+        w0 = None
+        if self.rank == 0 :
+            w0 = self.unit_cell_weighting[0, 0, 0]
+        w0 = self.comm.bcast(w0, root = 0)
+        Bragg_mask = (self.unit_cell_weighting > 1.0e-1 * w0).astype(np.uint8)
+        
+        # symmetrise it so that we have all pairs in the point group
+        Bragg_mask = self.slab_ops.solid_syms_Fourier(Bragg_mask, apply_translation=False)
+        Bragg_mask = np.sum(Bragg_mask, axis=0)>0
+        
+        # propagate
+        s  = self.fftn(solid.astype(self.c_dtype))
+        
+        # the modes for zero shift
+        A = self.slab_ops.solid_syms_Fourier(s, apply_translation=True)[:, Bragg_mask]
+        A = A.astype(np.complex128)
+        
+        # the (global) coordinates of the local reflections
+        q     = np.array(np.nonzero(Bragg_mask), dtype=np.int64)
+        q[0] += self.rows[self.rank]
+        shape = np.array(self.shape)[:, None]
+        g     = np.array([np.dot(R.T, q) % shape for R in self.slab_ops.Rs])
+        
+        # the phase factors (n, q, shift) along each axis
+        ex, ey, ez = [], [], []
+        for d, (e, T) in enumerate(zip([ex, ey, ez], [I, J, K])):
+            f = np.fft.fftfreq(self.shape[d])[g[:, d]]
+            e.append(np.exp(- 2J * np.pi * f[:, :, None] * np.array(T)[None, None, :]))
+        ex, ey, ez = ex[0], ey[0], ez[0]
+        
+        amp    = self.amp[Bragg_mask] 
+        mask   = self.mask[Bragg_mask] 
+        I_norm = self.comm.allreduce(np.sum(mask*amp**2, dtype=np.float64))
+        
+        errors = maps.cheshire_errors(A, ex, ey, ez, self.diffuse_weighting[Bragg_mask], 
+                                      self.unit_cell_weighting[Bragg_mask], amp, mask, block)
+        self.comm.Allreduce(MPI.IN_PLACE, errors)
+        errors = np.sqrt( errors / I_norm )
+        
+        l = np.argmin(errors)
+        i, j, k = np.unravel_index(l, errors.shape)
+        if self.rank == 0 : print('lowest error at: i, j, k, err', i, j, k, errors[i,j,k])
+        
+        # shift
+        lo, hi = self.rows[self.rank], self.rows[self.rank+1]
+        T0 = np.exp(- 2J * np.pi * I[i] * np.fft.fftfreq(self.shape[0]))[lo:hi]
+        T1 = np.exp(- 2J * np.pi * J[j] * np.fft.fftfreq(self.shape[1]))
+        T2 = np.exp(- 2J * np.pi * K[k] * np.fft.fftfreq(self.shape[2]))
+        phase_ramp = reduce(np.multiply.outer, [T0, T1, T2]).astype(self.c_dtype)
+        s1         = s * phase_ramp
+        
+        # broadcast
+        modes = self.slab_ops.solid_syms_Fourier(s1, apply_translation=True)
+        
+        s1 = self.ifftn(s1)
+        
+        info = {}
+        info['eMod'] = [self.Emod(modes)]
+        info['error_map'] = errors
+        info['eCon'] = [self.l2norm(self.modes - modes, modes)]
+        info.update(self.finish(modes))
+        return s1, info
@@ -2,3 +2,6 @@ from . import src
 from . import utils
 from .src.era import ERA
 from .src.dm import DM
+from .src.raar import RAAR
+from .src.hio import HIO
+from .src.admm import ADMM
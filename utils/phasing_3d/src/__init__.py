@@ -1,2 +1,6 @@
 from . import era
 from . import dm
+from . import raar
+from . import hio
+from . import admm
+from . import iterate
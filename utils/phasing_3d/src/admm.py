@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# for python 2 / 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+from .iterate import iterate
+
+from .mappers import *
+from .mappers import empty_like, ufunc_out
+
+def ADMM(iters, beta = 1.5, **args):
+    """
+    Find the phases of 'I' with the (over) relaxed Alternating Direction Method of Multipliers.
+
+    Parameters
+    ----------
+    iters : int
+        The number of ADMM iterations to perform.
+
+    beta : float, optional, default (1.5)
+        The relaxation parameter, 0 < beta < 2. beta = 1 is the
+        Difference Map with beta = 1.
+
+    mapper : object, optional, default (phasing_3d.src.mappers.Mapper)
+        A mapping class that provides the methods supplied by:
+            phasing_3d.src.mappers.Mapper
+        (see ERA).
+
+    stop : function or None, optional, default (None)
+        If stop(eMods, eCons) is True, after an iteration, then stop early.
+        eMods and eCons are the errors of each iteration so far.
+
+    Returns
+    -------
+    O : numpy.ndarray, (U, V, K)
+        The real-space object function after 'iters' iterations of the ADMM algorithm.
+
+    info : dict
+        contains diagnostics:
+
+            'I'     : the diffraction pattern corresponding to object above
+            'eMod'  : the modulus error for each iteration:
+                      eMod_i = sqrt( sum(| O_i - Pmod(O_i) |^2) / I )
+            'eCon'  : the convergence error for each iteration:
+                      eCon_i = sqrt( sum(| O_i - O_i-1 |^2) / sum(| O_i |^2) )
+
+    Notes
+    -----
+    ADMM [1] for the feasibility problem, find z in the modulus and
+    support sets, with the over relaxation x' = beta x + (1 - beta) z:
+        x_i+1 = Pm (z_i - u_i)
+        z_i+1 = Ps (x'_i+1 + u_i)
+        u_i+1 = u_i + x'_i+1 - z_i+1
+
+    with f = x' + u (so that z = Ps f and z - u = 2 Ps f - f) this is a
+    relaxed averaged version of the Difference Map:
+        f_i+1 = f_i + beta (Pm (2 Ps f_i - f_i) - Ps f_i)
+
+    so there is one modulus and one support projection per iteration,
+    and the dual variable is not stored. The metrics and the solution
+    are for O_i = z_i = Ps f_i. mapper.modes is updated in place with f
+    (see RAAR).
+
+    References
+    ----------
+    [1] S. Boyd, N. Parikh, E. Chu, B. Peleato and J. Eckstein, "Distributed
+        optimization and statistical learning via the alternating direction
+        method of multipliers," Found. Trends Mach. Learn. 3, 1-122 (2011)
+    """
+    def make_step(mapper):
+        # z = Ps f
+        state = {'modes_sup' : mapper.Psup(mapper.modes)}
+
+        work = empty_like(mapper.modes)
+
+        def step(modes):
+            # update: f += beta (Pm (2 Ps f - f) - Ps f)
+            #-------
+            ufunc_out(np.multiply, state['modes_sup'], 2, work)
+            ufunc_out(np.subtract, work, modes, work)
+            a      = mapper.Pmod(work)
+            a     -= state['modes_sup']
+            a     *= beta
+            modes += a
+
+            state['modes_sup'] = mapper.Psup(modes)
+            return state['modes_sup']
+
+        def solution():
+            return state['modes_sup']
+
+        return step, solution
+
+    return iterate('ADMM', iters, make_step, **args)
@@ -12,7 +12,7 @@ from itertools import product
 from . import era
 
 from .mappers import *
-from .mappers import isValid
+from .mappers import isValid, empty_like, ufunc_out, l2norm_diff
 
 try :
     from mpi4py import MPI
@@ -71,6 +71,16 @@ def DM(iters, beta = 1, **args):
         Determines the numerical precision of the calculation. If dtype==None, then
         it is determined from the datatype of I.
     
+    stop : function or None, optional, default (None)
+        If stop(eMods, eCons) is True, after an iteration, then stop early.
+        eMods and eCons are the errors of each iteration so far.
+
+    mapper : object, optional, default (None)
+        Provides Psup, Pmod, Emod, finish and l2norm (or l2norm_diff) and
+        the iterate 'mapper.modes', which is updated in place. The modes
+        may be a numpy array or Modes (a dict of arrays, as in
+        mappers.Mapper). Psup must set the latest object as mapper.O.
+
     full_output : bool, optional, default (True)
         If true then return a bunch of diagnostics (see info) as a python dictionary 
         (a list of key : value pairs).
@@ -150,13 +160,22 @@ def DM(iters, beta = 1, **args):
         from mappers import Mapper 
         mapper = Mapper(I, **args)
     
+    if isValid('stop', args) :
+        stop = args['stop']
+    else :
+        stop = None
+    
     eMods     = []
     eCons     = []
     
     modes  = mapper.modes
     
+    # mapper.Psup sets (rebinds) mapper.O, so eCon is 
+    # evaluated against a reference rather than a copy
     modes_sup = mapper.Psup(modes)
-    modes_mod = None
+    
+    # for the arguments of the projections
+    work = empty_like(modes)
 
     if iters > 0  and rank==0:
         print('\n\nalgrithm progress iteration convergence modulus error')
@@ -165,76 +184,93 @@ def DM(iters, beta = 1, **args):
         for i in range(iters) :
             
             # reference
-            O0 = mapper.O.copy()
+            O0 = mapper.O
             
-            # update 
+            # update: f += Pm (2 Ps f - f) - Ps f
             #-------
-            modes += mapper.Pmod(modes_sup * 2 - modes) - modes_sup
+            ufunc_out(np.multiply, modes_sup, 2, work)
+            work  -= modes
+            a      = mapper.Pmod(work)
+            a     -= modes_sup
+            modes += a
             
             # metrics
             #--------
-            #modes0 -= modes
-            #eCon    = mapper.l2norm(modes0, modes)
-            
             # f* = Ps f_i = PM (2 Ps f_i - f_i)
             modes_sup = mapper.Psup(modes)
 
-            dO   = mapper.O - O0
-            eCon = mapper.l2norm(dO, O0)
+            eCon = l2norm_diff(mapper, mapper.O, O0)
             
             eMod = mapper.Emod(modes_sup)
-            #eMod = mapper.eMod
             
             if rank == 0 : era.update_progress(i / max(1.0, float(iters-1)), 'DM', i, eCon, eMod )
             
             eMods.append(eMod)
             eCons.append(eCon)
+            
+            if stop is not None and stop(eMods, eCons) :
+                if rank == 0 : print('\nstopping early at iteration', i)
+                break
+        
+        # the solution f* = Ps f, so there is no need to project again
+        b = modes_sup
     else :
         modes_mod = mapper.Pmod(modes)
         for i in range(iters) :
             
             # reference
-            O0 = mapper.O.copy()
+            O0 = mapper.O
             
-            # update 
+            # update: f += beta (Pm Rs f - Ps Rm f)
             #-------
-            a = mapper.Pmod(modes_sup + 1/beta * (modes_sup - modes))
-            b = mapper.Psup(modes_mod - 1/beta * (modes_mod - modes))
-            modes += beta * ( a - b )
+            # Rs f = Ps f + 1/beta (Ps f - f)
+            ufunc_out(np.subtract, modes_sup, modes, work)
+            work *= 1/beta
+            work += modes_sup
+            a     = mapper.Pmod(work)
+            
+            # Rm f = Pm f - 1/beta (Pm f - f)
+            ufunc_out(np.subtract, modes_mod, modes, work)
+            work *= 1/beta
+            ufunc_out(np.subtract, modes_mod, work, work)
+            b     = mapper.Psup(work)
+            
+            a     -= b
+            a     *= beta
+            modes += a
             
             # metrics
             #--------
-            #modes0 -= modes
-            #eCon    = mapper.l2norm(modes0, modes)
-            
             # f* = Ps f_i = PM (2 Ps f_i - f_i)
             modes_sup = mapper.Psup(modes)
             modes_mod = mapper.Pmod(modes)
             
-            dO   = mapper.O - O0
-            eCon = mapper.l2norm(dO, O0)
+            eCon = l2norm_diff(mapper, mapper.O, O0)
             
             # this is really the error of the last iteration
             eMod = mapper.Emod(b)
-            #eMod = mapper.eMod
             
             if rank == 0 : era.update_progress(i / max(1.0, float(iters-1)), 'DM', i, eCon, eMod )
             
             eMods.append(eMod)
             eCons.append(eCon)
+            
+            if stop is not None and stop(eMods, eCons) :
+                if rank == 0 : print('\nstopping early at iteration', i)
+                break
+        
+        # the solution f* = Ps Rm f
+        ufunc_out(np.subtract, modes_mod, modes, work)
+        work *= 1/beta
+        ufunc_out(np.subtract, modes_mod, work, work)
+        b = mapper.Psup(work)
     
     info = {}
     info['eMod']  = eMods
     info['eCon']  = eCons
     
-    #a = mapper.Pmod(modes_sup + 1/beta * (modes_sup - modes))
-    if modes_mod is None :
-        modes_mod = mapper.Pmod(modes)
-    b = mapper.Psup(modes_mod - 1/beta * (modes_mod - modes))
     info.update(mapper.finish(b))
     
     O = mapper.O
     
     return O, info
-
-
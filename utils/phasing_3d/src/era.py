@@ -48,6 +48,10 @@ def ERA(iters, **args):
           dict  = mapper.finish(modes) # add any additional output to the info dict
         ---------------------------------------
     
+    stop : function or None, optional, default (None)
+        If stop(eMods, eCons) is True, after an iteration, then stop early.
+        eMods and eCons are the errors of each iteration so far.
+    
     Returns
     -------
     O : numpy.ndarray, (U, V, K) 
@@ -92,6 +96,11 @@ def ERA(iters, **args):
         from mappers import Mapper 
         mapper = Mapper(**args)
     
+    if isValid('stop', args) :
+        stop = args['stop']
+    else :
+        stop = None
+    
     eMods     = []
     eCons     = []
 
@@ -125,6 +134,10 @@ def ERA(iters, **args):
         
         eMods.append(eMod)
         eCons.append(eCon)
+        
+        if stop is not None and stop(eMods, eCons) :
+            if rank == 0 : print('\nstopping early at iteration', i)
+            break
     
     info = {}
     info['eMod']  = eMods
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# for python 2 / 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+from .iterate import iterate
+
+from .mappers import *
+from .mappers import empty_like, ufunc_out
+
+def HIO(iters, beta = 0.9, **args):
+    """
+    Find the phases of 'I' with the Hybrid Input Output algorithm.
+
+    Parameters
+    ----------
+    iters : int
+        The number of HIO iterations to perform.
+
+    beta : float, optional, default (0.9)
+        The feedback parameter, 0 < beta <= 1.
+
+    mapper : object, optional, default (phasing_3d.src.mappers.Mapper)
+        A mapping class that provides the methods supplied by:
+            phasing_3d.src.mappers.Mapper
+        (see ERA).
+
+    stop : function or None, optional, default (None)
+        If stop(eMods, eCons) is True, after an iteration, then stop early.
+        eMods and eCons are the errors of each iteration so far.
+
+    Returns
+    -------
+    O : numpy.ndarray, (U, V, K)
+        The real-space object function after 'iters' iterations of the HIO algorithm.
+
+    info : dict
+        contains diagnostics:
+
+            'I'     : the diffraction pattern corresponding to object above
+            'eMod'  : the modulus error for each iteration:
+                      eMod_i = sqrt( sum(| O_i - Pmod(O_i) |^2) / I )
+            'eCon'  : the convergence error for each iteration:
+                      eCon_i = sqrt( sum(| O_i - O_i-1 |^2) / sum(| O_i |^2) )
+
+    Notes
+    -----
+    HIO [1] in the projection form of [2]:
+        f_i+1 = Ps Pm f_i + (I - Ps)(I - beta Pm) f_i
+              = f_i - Ps f_i + (1 + beta) Ps Pm f_i - beta Pm f_i
+
+    For a fixed support Ps f_i+1 = Ps Pm f_i, so Ps f is carried between
+    iterations and there is one modulus and one support projection per
+    iteration. With a voxel number support this is Fienup's HIO, where the
+    support of each iteration is chosen from Pm f_i. The metrics and the
+    solution are for O_i = Ps Pm f_i. mapper.modes is updated in place
+    with f (see RAAR).
+
+    References
+    ----------
+    [1] J. R. Fienup, "Phase retrieval algorithms: a comparison,"
+        Appl. Opt. 21, 2758-2769 (1982)
+    [2] H. H. Bauschke, P. L. Combettes and D. R. Luke, "Phase retrieval,
+        error reduction algorithm, and Fienup variants: a view from convex
+        optimization," J. Opt. Soc. Am. A 19, 1334-1345 (2002)
+    """
+    def make_step(mapper):
+        # Ps f
+        state = {'modes_sup' : mapper.Psup(mapper.modes)}
+
+        work = empty_like(mapper.modes)
+
+        def step(modes):
+            # Pm f and Ps Pm f
+            #-----------------
+            modes_mod = mapper.Pmod(modes)
+            modes_pms = mapper.Psup(modes_mod)
+
+            # update: f = f - Ps f + (1 + beta) Ps Pm f - beta Pm f
+            #-------
+            modes     -= state['modes_sup']
+            modes_mod *= beta
+            modes     -= modes_mod
+            ufunc_out(np.multiply, modes_pms, 1 + beta, work)
+            modes     += work
+
+            # Ps f_i+1 = Ps Pm f_i
+            state['modes_sup'] = modes_pms
+            return modes_pms
+
+        def solution():
+            return state['modes_sup']
+
+        return step, solution
+
+    return iterate('HIO', iters, make_step, **args)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# for python 2 / 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from . import era
+
+from .mappers import isValid, l2norm_diff
+
+try :
+    from mpi4py import MPI
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+except ImportError :
+    rank = 0
+
+def get_mapper(args):
+    """
+    args['mapper'] if it is given, otherwise make the gpu or the
+    default cpu mapper from args.
+    """
+    if isValid('mapper', args) :
+        mapper = args['mapper']
+
+    elif isValid('hardware', args) and args['hardware'] == 'gpu':
+        from mappers_gpu import Mapper
+        mapper = Mapper(**args)
+
+    else :
+        print('using default cpu mapper')
+        from mappers import Mapper
+        mapper = Mapper(**args)
+    return mapper
+
+def iterate(name, iters, make_step, **args):
+    """
+    The iteration loop of RAAR, HIO and ADMM.
+
+    make_step(mapper) returns the functions step and solution of the
+    algorithm: step(modes) updates mapper.modes in place and returns
+    the modes of the current solution O_i, for which eMod is evaluated
+    (and mapper.O, for eCon), solution() returns the modes that are
+    passed to mapper.finish after the last iteration.
+
+    args are the keyword arguments of the algorithm (mapper, stop...),
+    returns O, info as for ERA.
+    """
+    mapper = get_mapper(args)
+
+    if isValid('stop', args) :
+        stop = args['stop']
+    else :
+        stop = None
+
+    eMods     = []
+    eCons     = []
+
+    modes          = mapper.modes
+    step, solution = make_step(mapper)
+
+    if iters > 0 and rank == 0 :
+        print('\n\nalgrithm progress iteration convergence modulus error')
+
+    for i in range(iters) :
+
+        # reference (mapper.Psup rebinds mapper.O)
+        O0 = mapper.O
+
+        # update
+        #-------
+        modes_sol = step(modes)
+
+        # metrics
+        #--------
+        eCon = l2norm_diff(mapper, mapper.O, O0)
+
+        eMod = mapper.Emod(modes_sol)
+
+        if rank == 0 : era.update_progress(i / max(1.0, float(iters-1)), name, i, eCon, eMod )
+
+        eMods.append(eMod)
+        eCons.append(eCon)
+
+        if stop is not None and stop(eMods, eCons) :
+            if rank == 0 : print('\nstopping early at iteration', i)
+            break
+
+    info = {}
+    info['eMod']  = eMods
+    info['eCon']  = eCons
+
+    info.update(mapper.finish(solution()))
+
+    O = mapper.O
+    return O, info
@@ -81,6 +81,43 @@ class Modes(dict):
             out[k] = self[k].copy()
         return out
 
+def empty_like(modes):
+    """
+    np.empty_like for numpy arrays or Modes (a dict of arrays)
+    """
+    if isinstance(modes, Modes) :
+        out = Modes()
+        for k in modes.keys():
+            out[k] = np.empty_like(modes[k])
+        return out
+    else :
+        return np.empty_like(modes)
+
+def ufunc_out(ufunc, x, y, out):
+    """
+    ufunc(x, y, out=out) for numpy arrays or Modes (a dict of arrays), 
+    y may be a scalar.
+    """
+    if isinstance(out, Modes) :
+        for k in out.keys():
+            if isinstance(y, Modes) :
+                ufunc(x[k], y[k], out=out[k])
+            else :
+                ufunc(x[k], y, out=out[k])
+    else :
+        ufunc(x, y, out=out)
+    return out
+
+def l2norm_diff(mapper, array1, array0):
+    """
+    mapper.l2norm(array1 - array0, array0), with mapper.l2norm_diff
+    if the mapper has it (so that the difference is not stored).
+    """
+    if hasattr(mapper, 'l2norm_diff') :
+        return mapper.l2norm_diff(array1, array0)
+    else :
+        return mapper.l2norm(array1 - array0, array0)
+
 class Mapper():
     
     def __init__(self, I, **args):
@@ -133,6 +170,7 @@ class Mapper():
             self.support = args['support']
 
         self.modes = modes
+        self.O     = modes['O']
 
     def object(self, modes):
         return modes['O']
@@ -145,6 +183,9 @@ class Mapper():
             self.S = choose_N_highest_pixels( (O * O.conj()).real, self.voxel_number, support = self.support)
 
         out['O'] *= self.S
+        
+        # store the latest guess for the object
+        self.O = out['O']
 
         if 'B' in modes.keys() :
             out['B'], self.rs, self.r_av = radial_symetry(out['B'], rs = self.rs)
@@ -192,6 +233,15 @@ class Mapper():
             den += np.sum( (array0[k] * array0[k].conj()).real ) 
         return np.sqrt(num / den)
 
+    def l2norm_diff(self, array1, array0):
+        """
+        the l2norm of the object difference array1 - array0 
+        relative to array0 (e.g. mapper.O)
+        """
+        num = np.sum( np.abs(array1 - array0)**2 )
+        den = np.sum( np.abs(array0)**2 )
+        return np.sqrt(num / den)
+
 def choose_N_highest_pixels_slow(array, N):
     percent = (1. - float(N) / float(array.size)) * 100.
     thresh  = np.percentile(array, percent)
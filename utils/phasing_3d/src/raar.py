@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# for python 2 / 3 compatibility
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+from .iterate import iterate
+
+from .mappers import *
+from .mappers import empty_like, ufunc_out
+
+def RAAR(iters, beta = 0.87, **args):
+    """
+    Find the phases of 'I' with the Relaxed Averaged Alternating Reflections algorithm.
+
+    Parameters
+    ----------
+    iters : int
+        The number of RAAR iterations to perform.
+
+    beta : float, optional, default (0.87)
+        The relaxation parameter, 0 < beta < 1 (beta = 1 is the Difference Map
+        with the reflections in the opposite order).
+
+    mapper : object, optional, default (phasing_3d.src.mappers.Mapper)
+        A mapping class that provides the methods supplied by:
+            phasing_3d.src.mappers.Mapper
+        (see ERA).
+
+    stop : function or None, optional, default (None)
+        If stop(eMods, eCons) is True, after an iteration, then stop early.
+        eMods and eCons are the errors of each iteration so far.
+
+    Returns
+    -------
+    O : numpy.ndarray, (U, V, K)
+        The real-space object function after 'iters' iterations of the RAAR algorithm.
+
+    info : dict
+        contains diagnostics:
+
+            'I'     : the diffraction pattern corresponding to object above
+            'eMod'  : the modulus error for each iteration:
+                      eMod_i = sqrt( sum(| O_i - Pmod(O_i) |^2) / I )
+            'eCon'  : the convergence error for each iteration:
+                      eCon_i = sqrt( sum(| O_i - O_i-1 |^2) / sum(| O_i |^2) )
+
+    Notes
+    -----
+    RAAR [1] applies the following recursion on the state vector:
+        f_i+1 = beta/2 (Rs Rm + I) f_i + (1 - beta) Pm f_i
+              = beta (f_i + Ps Rm f_i - Pm f_i) + (1 - beta) Pm f_i
+    where
+        Rs f = 2 Ps f - f
+        Rm f = 2 Pm f - f
+    so there is one modulus and one support projection per iteration.
+    The metrics are evaluated for O_i = Ps Rm f_i and the solution is
+    Ps Pm f (after the last iteration). mapper.modes is updated in place
+    with f, so another call to RAAR continues from the last iterate
+    if mapper.modes is reset to it (mapper.finish replaces mapper.modes).
+
+    References
+    ----------
+    [1] D. Russell Luke, "Relaxed averaged alternating reflections for
+        diffraction imaging," Inverse Problems 21, 37-50 (2005)
+    """
+    def make_step(mapper):
+        # for the argument of the support projection
+        work = empty_like(mapper.modes)
+
+        def step(modes):
+            # Pm f and Ps Rm f
+            #-----------------
+            modes_mod = mapper.Pmod(modes)
+
+            ufunc_out(np.multiply, modes_mod, 2, work)
+            ufunc_out(np.subtract, work, modes, work)
+            modes_sup = mapper.Psup(work)
+
+            # update: f = beta (f + Ps Rm f - Pm f) + (1 - beta) Pm f
+            #-------
+            modes     += modes_sup
+            modes     -= modes_mod
+            modes     *= beta
+            modes_mod *= 1 - beta
+            modes     += modes_mod
+            return modes_sup
+
+        # the solution Ps Pm f
+        def solution():
+            return mapper.Psup(mapper.Pmod(mapper.modes))
+
+        return step, solution
+
+    return iterate('RAAR', iters, make_step, **args)
@@ -5,6 +5,8 @@ from __future__ import unicode_literals
 
 import numpy as np
 import math
+import re
+from fractions import Fraction
 from itertools import product
 from functools import reduce
 
@@ -58,6 +60,25 @@ class P1():
         out[0] = U[0]
         return out
     
+    def overlap_mask_real(self, solid, index = None):
+        # there are no symmetry partners
+        if index is not None :
+            return np.ones(len(index), dtype=bool)
+        return np.ones(solid.shape, dtype=bool)
+    
+    def solid_to_crystal_real(self, solid, return_unit=False):
+        """
+        Generate the real-space crystal in the field-of-view, the sum
+        of solid_syms_crystal_real without storing each copy.
+        """
+        U = solid.copy()
+        C = np.fft.ifftshift(tile_unit_cell(np.fft.fftshift(U), self.unitcell_size))
+        
+        if return_unit :
+            return C, U
+        else :
+            return C
+    
     def solid_syms_crystal_real(self, solid):
         """
         Generate the symmetry related copies of the real-space solid unit
@@ -122,6 +143,10 @@ class P212121():
         self.unitcell_size = unitcell_size
         self.Cheshire_cell = (unitcell_size[0]//2, unitcell_size[1]//2,unitcell_size[2]//2)
         self.det_shape     = det_shape
+        self.dtype         = dtype
+        
+        # gather-index tables for the symmetry operations (see make_inds)
+        self.inds          = {}
         
         # keep an array for the 4 symmetry related coppies of the solid unit
         #self.syms = np.zeros((4,) + tuple(det_shape), dtype=dtype)
@@ -134,45 +159,85 @@ class P212121():
         """
         det_shape     = self.det_shape
         unitcell_size = self.unitcell_size
-        # store the tranlation ramps
+        # store the 1D factors of the tranlation ramps, these 
+        # are applied with multiply_T_fourier
         # x = x
-        T0 = np.ones(det_shape, dtype=np.complex128)
+        T0 = T_fourier_1D(det_shape, [0.0, 0.0, 0.0], dtype=self.dtype)
         # x = 0.5 + x, 0.5 - y, -z
-        T1 = T_fourier(det_shape, [-unitcell_size[0]/2., unitcell_size[1]/2., 0.0])
+        T1 = T_fourier_1D(det_shape, [-unitcell_size[0]/2., unitcell_size[1]/2., 0.0], dtype=self.dtype)
         # x = -x, 0.5 + y, 0.5 - z
-        T2 = T_fourier(det_shape, [0.0, -unitcell_size[1]/2., unitcell_size[2]/2.])
+        T2 = T_fourier_1D(det_shape, [0.0, -unitcell_size[1]/2., unitcell_size[2]/2.], dtype=self.dtype)
         # x = 0.5 - x, -y, 0.5 + z
-        T3 = T_fourier(det_shape, [unitcell_size[0]/2., 0.0, -unitcell_size[2]/2.])
-        self.translations      = np.array([T0, T1, T2, T3])
-        self.translations_conj = self.translations.conj()
+        T3 = T_fourier_1D(det_shape, [unitcell_size[0]/2., 0.0, -unitcell_size[2]/2.], dtype=self.dtype)
+        self.translations      = [T0, T1, T2, T3]
+        self.translations_conj = [[t.conj() for t in T] for T in self.translations]
     
+    def make_inds(self, shape, real = False):
+        """
+        Flat gather-index tables for the symmetry operations, so that:
+            syms[n].ravel() = solid.ravel()[inds[n-1]]   for n = 1, 2, 3
+        
+        In Fourier space these are just the flips (in the fftfreq basis), 
+        the translations are applied with the phase ramps. In real space
+        (real = True) the pixel shifts of solid_syms_real are included.
+        
+        The flips are their own inverse, so the Fourier space tables are 
+        also used to unflip the modes. The tables are cached for each shape.
+        """
+        key = (tuple(shape), real)
+        if key in self.inds :
+            return self.inds[key]
+        
+        if real :
+            u = self.unitcell_size
+            shifts = [[-u[0]//2,  u[1]//2,     0   ],
+                      [    0,    -u[1]//2,  u[2]//2],
+                      [ u[0]//2,     0,    -u[2]//2]]
+        else :
+            shifts = [[0, 0, 0], [0, 0, 0], [0, 0, 0]]
+        
+        # the flipped axes for:
+        # x = 0.5 + x, 0.5 - y, -z
+        # x = -x, 0.5 + y, 0.5 - z
+        # x = 0.5 - x, -y, 0.5 + z
+        signs = [[1, -1, -1], [-1, 1, -1], [-1, -1, 1]]
+        
+        inds = np.empty((3, int(np.prod(shape))), dtype=np.intp)
+        for n in range(3):
+            # syms[n+1][r] = solid[sign * (r - shift)]
+            ijk = [(signs[n][d] * (np.arange(shape[d]) - shifts[n][d])) % shape[d] for d in range(3)]
+            inds[n] = np.ravel_multi_index(np.ix_(*ijk), shape).ravel()
+        
+        self.inds[key] = inds
+        return inds
+
     def solid_syms_Fourier(self, solid, apply_translation = True, syms = None):
+        """
+        Take the Fourier space solid unit then return each
+        of the symmetry related partners, with one gather 
+        per partner (see make_inds).
+        """
         if syms is None :
             syms = np.empty((4,) + solid.shape, dtype=solid.dtype) # syms 
+        
+        inds  = self.make_inds(solid.shape)
+        solid = np.ascontiguousarray(solid).ravel()
+        s     = syms.reshape((4, -1))
 
         # x = x
-        syms[0] = solid
-        
-        # x = 0.5 + x, 0.5 - y, -z
-        syms[1][:, 0, :]  = solid[:, 0, :]
-        syms[1][:, 1:, :] = solid[:, -1:0:-1, :]
-        syms[1][:, :, 1:] = syms[1][:, :, -1:0:-1]
+        s[0] = solid
         
-        # x = -x, 0.5 + y, 0.5 - z
-        syms[2][0, :, :]  = solid[0, :, :]
-        syms[2][1:, :, :] = solid[-1:0:-1, :, :]
-        syms[2][:, :, 1:] = syms[2][:, :, -1:0:-1]
-        
-        # x = 0.5 - x, -y, 0.5 + z
-        syms[3][0, :, :]  = solid[0, :, :]
-        syms[3][1:, :, :] = solid[-1:0:-1, :, :]
-        syms[3][:, 1:, :] = syms[3][:, -1:0:-1, :]
+        # the flips 
+        for n in range(3):
+            np.take(solid, inds[n], out = s[n+1], mode = 'clip')
         
         if apply_translation :
             if self.translations is None :
                 self.make_Ts()
             
-            syms *= self.translations
+            # the translation of syms[0] is 1
+            for n in range(3):
+                multiply_T_fourier(syms[n+1], self.translations[n+1], out = syms[n+1])
         return syms
 
     def solid_syms_Fourier_masked(self, solid, i, j, k, apply_translation = True, syms = None):
@@ -200,7 +265,8 @@ class P212121():
                 self.make_Ts()
             
             for ii in range(4):
-                syms[ii] *= self.translations[ii][(i,j,k)]
+                Ti, Tj, Tk = self.translations[ii]
+                syms[ii] *= Ti[i] * Tj[j] * Tk[k]
         
         return syms
 
@@ -210,66 +276,82 @@ class P212121():
         else :
             U_inv = U.copy()
         
-        if apply_translation :
-            if self.translations is None :
-                self.make_Ts()
-            
-            U_inv *= self.translations_conj
+        # the gathers below need a flat view of each mode
+        U_inv = np.ascontiguousarray(U_inv)
         
-        # x = x
+        if apply_translation and self.translations is None :
+            self.make_Ts()
+        
+        inds = self.make_inds(U.shape[1:])
+        
+        # scratch array for one mode
+        t = np.empty(U_inv.shape[1:], dtype=U_inv.dtype)
+        
+        # x = x (the translation is 1)
         #U_inv[0] = U_inv[0]
         
-        # x = 0.5 + x, 0.5 - y, -z
-        #U_inv[1][:, 0, :]  = U_inv[1][:, 0, :]
-        U_inv[1][:, 1:, :] = U_inv[1][:, -1:0:-1, :]
-        U_inv[1][:, :, 1:] = U_inv[1][:, :, -1:0:-1]
-
-        # x = -x, 0.5 + y, 0.5 - z
-        #U_inv[2][0, :, :]  = U_inv[2][0, :, :]
-        U_inv[2][1:, :, :] = U_inv[2][-1:0:-1, :, :]
-        U_inv[2][:, :, 1:] = U_inv[2][:, :, -1:0:-1]
+        # the flips are their own inverse
+        for n in range(3):
+            if apply_translation :
+                multiply_T_fourier(U_inv[n+1], self.translations_conj[n+1], out = t)
+            else :
+                t[:] = U_inv[n+1]
+            np.take(t.ravel(), inds[n], out = U_inv[n+1].reshape((-1,)), mode = 'clip')
         
-        # x = 0.5 - x, -y, 0.5 + z
-        #U_inv[3][0, :, :]  = U_inv[3][0, :, :]
-        U_inv[3][1:, :, :] = U_inv[3][-1:0:-1, :, :]
-        U_inv[3][:, 1:, :] = U_inv[3][:, -1:0:-1, :]
-
         return U_inv
 
     def solid_syms_real(self, solid, syms=None):
         """
         This uses pixel shifts (not phase ramps) for translation.
         Therefore sub-pixel shifts are ignored.
+        
+        The flips and shifts are done with one gather per 
+        symmetry partner (see make_inds).
         """
         if syms is None :
             syms = np.empty((4,) + solid.shape, dtype=solid.dtype) # self.syms 
         
-        # x = x
-        syms[0] = solid
+        inds  = self.make_inds(solid.shape, real = True)
+        solid = np.ascontiguousarray(solid).ravel()
+        s     = syms.reshape((4, -1))
         
-        # x = 0.5 + x, 0.5 - y, -z
-        syms[1][:, 0, :]  = solid[:, 0, :]
-        syms[1][:, 1:, :] = solid[:, -1:0:-1, :]
-        syms[1][:, :, 1:] = syms[1][:, :, -1:0:-1]
+        # x = x
+        s[0] = solid
         
-        # x = -x, 0.5 + y, 0.5 - z
-        syms[2][0, :, :]  = solid[0, :, :]
-        syms[2][1:, :, :] = solid[-1:0:-1, :, :]
-        syms[2][:, :, 1:] = syms[2][:, :, -1:0:-1]
+        for n in range(3):
+            np.take(solid, inds[n], out = s[n+1], mode = 'clip')
+        return syms
+    
+    def overlap_mask_real(self, solid, index = None):
+        """
+        Return the voxels of solid that are the maximum of their 
+        symmetry partners in the unit-cell, this is the same as:
+            syms = self.solid_syms_real(solid)
+            mask = syms[0] == np.max(syms, axis=0)
         
-        # x = 0.5 - x, -y, 0.5 + z
-        syms[3][0, :, :]  = solid[0, :, :]
-        syms[3][1:, :, :] = solid[-1:0:-1, :, :]
-        syms[3][:, 1:, :] = syms[3][:, -1:0:-1, :]
+        but with a running maximum over the gathers of make_inds, 
+        rather than the full stack of symmetry partners.
+
+        If index (flat indices into solid) is not None then only
+        the mask at those voxels is returned (as a 1D array).
+        """
+        shape = solid.shape
+        inds  = self.make_inds(shape, real = True)
+        solid = np.ascontiguousarray(solid).ravel()
         
-        translations = []
-        translations.append([-self.unitcell_size[0]//2, self.unitcell_size[1]//2, 0])
-        translations.append([0, -self.unitcell_size[1]//2, self.unitcell_size[2]//2])
-        translations.append([self.unitcell_size[0]//2, 0, -self.unitcell_size[2]//2])
+        if index is not None :
+            s0 = solid[index]
+            m  = s0.copy()
+            for n in range(3):
+                np.maximum(m, solid[inds[n][index]], out = m)
+            return s0 == m
         
-        for i, t in enumerate(translations):
-            syms[i+1] = multiroll(syms[i+1], t)
-        return syms
+        m = solid.copy()
+        t = np.empty_like(solid)
+        for n in range(3):
+            np.take(solid, inds[n], out = t, mode = 'clip')
+            np.maximum(m, t, out = m)
+        return (solid == m).reshape(shape)
 
     def solid_to_crystal_real(self, solid, return_unit=False):
         """
@@ -277,41 +359,24 @@ class P212121():
         in the crystal. This includes all symmetry related coppies of the 
         solid unit that fit within the field-of-view (not just the unit-cell
         as in solid_syms_real).
-        """
-        # calculate the number of times that we need to tile the unit-cell 
-        # unit so that we fill the field-of-view
-        tiles = np.ceil(2*np.array(solid.shape, dtype=np.float) / np.array(self.unitcell_size, dtype=np.float) - 1.0).astype(np.int)
-        
-        # get the symmetry related coppies of solid in the unit-cell
-        # hopefully these fit in the field-of-view...
-        U = np.sum(self.solid_syms_real(solid), axis=0)
-        
-        # un-fftshift them
-        U = np.fft.fftshift(U)
-        
-        # now translate the unit-cell by tiles in each dimension
-        C = U.copy()
 
-        # temp array to speed up multiroll_nowrap
-        t = np.asarray(np.zeros_like(U))
+        The unit-cell is accumulated with one gather per symmetry partner 
+        (see make_inds) and tiled over the field-of-view with tile_unit_cell.
+        """
+        shape = solid.shape
+        inds  = self.make_inds(shape, real = True)
+        s     = np.ascontiguousarray(solid).ravel()
         
-        for i in (np.arange(tiles[0]) - tiles[0]//2):
-            for j in (np.arange(tiles[1]) - tiles[1]//2):
-                for k in (np.arange(tiles[2]) - tiles[2]//2):
-                    if i == 0 and j == 0 and k == 0 :
-                        continue
-                    
-                    shift = np.array([i, j, k]) * np.array(self.unitcell_size)
-                    
-                    #print(i,j,k, shift, U.shape)
-                    #print(i,j,k, shift, index)
-                    C += multiroll_nowrap(U, shift, y = t)
+        # sum the symmetry related coppies of solid in the unit-cell
+        U = s.copy()
+        for n in range(3):
+            U += s[inds[n]]
+        U = U.reshape(shape)
         
-        # re-fftshift them
-        C = np.fft.ifftshift(C)
+        C = np.fft.ifftshift(tile_unit_cell(np.fft.fftshift(U), self.unitcell_size))
         
         if return_unit :
-            return C, np.fft.ifftshift(U)
+            return C, U
         else :
             return C
 
@@ -341,6 +406,7 @@ class Ptest():
         self.unitcell_size = unitcell_size
         self.Cheshire_cell = (unitcell_size[0]//2, unitcell_size[1]//2,unitcell_size[2]//2)
         self.det_shape     = det_shape
+        self.dtype         = dtype
         
         # keep an array for the 4 symmetry related coppies of the solid unit
         #self.syms = np.zeros((4,) + tuple(det_shape), dtype=dtype)
@@ -353,17 +419,18 @@ class Ptest():
         """
         det_shape     = self.det_shape
         unitcell_size = self.unitcell_size
-        # store the tranlation ramps
+        # store the 1D factors of the tranlation ramps, these 
+        # are applied with multiply_T_fourier
         # x = x
-        T0 = np.ones(det_shape, dtype=np.complex128)
+        T0 = T_fourier_1D(det_shape, [0.0, 0.0, 0.0], dtype=self.dtype)
         # x = 0.5 + x, 0.5 - y, -z
-        T1 = T_fourier(det_shape, [-unitcell_size[0]/2., unitcell_size[1]/2., 0.0])
+        T1 = T_fourier_1D(det_shape, [-unitcell_size[0]/2., unitcell_size[1]/2., 0.0], dtype=self.dtype)
         # x = -x, 0.5 + y, 0.5 - z
-        T2 = T_fourier(det_shape, [0.0, -unitcell_size[1]/2., unitcell_size[2]/2.])
+        T2 = T_fourier_1D(det_shape, [0.0, -unitcell_size[1]/2., unitcell_size[2]/2.], dtype=self.dtype)
         # x = 0.5 - x, -y, 0.5 + z
-        T3 = T_fourier(det_shape, [unitcell_size[0]/2., 0.0, -unitcell_size[2]/2.])
-        self.translations      = np.array([T0, T1, T2, T3])
-        self.translations_conj = self.translations.conj()
+        T3 = T_fourier_1D(det_shape, [unitcell_size[0]/2., 0.0, -unitcell_size[2]/2.], dtype=self.dtype)
+        self.translations      = [T0, T1, T2, T3]
+        self.translations_conj = [[t.conj() for t in T] for T in self.translations]
     
     def solid_syms_Fourier(self, solid, apply_translation = True, syms = None):
         if syms is None :
@@ -375,7 +442,8 @@ class Ptest():
             if self.translations is None :
                 self.make_Ts()
             
-            syms *= self.translations
+            for n in range(4):
+                multiply_T_fourier(syms[n], self.translations[n], out = syms[n])
         return syms
 
     def solid_syms_Fourier_masked(self, solid, i, j, k, apply_translation = True, syms = None):
@@ -394,7 +462,8 @@ class Ptest():
                 self.make_Ts()
             
             for ii in range(4):
-                syms[ii] *= self.translations[ii][(i,j,k)]
+                Ti, Tj, Tk = self.translations[ii]
+                syms[ii] *= Ti[i] * Tj[j] * Tk[k]
         
         return syms
 
@@ -408,7 +477,8 @@ class Ptest():
             if self.translations is None :
                 self.make_Ts()
             
-            U_inv *= self.translations_conj
+            for n in range(4):
+                multiply_T_fourier(U_inv[n], self.translations_conj[n], out = U_inv[n])
         
         return U_inv
 
@@ -439,108 +509,467 @@ class Ptest():
         solid unit that fit within the field-of-view (not just the unit-cell
         as in solid_syms_real).
         """
-        # calculate the number of times that we need to tile the unit-cell 
-        # unit so that we fill the field-of-view
-        tiles = np.ceil(2*np.array(solid.shape, dtype=np.float) / np.array(self.unitcell_size, dtype=np.float) - 1.0).astype(np.int)
-        
         # get the symmetry related coppies of solid in the unit-cell
         # hopefully these fit in the field-of-view...
         U = np.sum(self.solid_syms_real(solid), axis=0)
         
-        # un-fftshift them
-        U = np.fft.fftshift(U)
+        # tile the (un-fftshifted) unit-cell over the field-of-view
+        C = np.fft.ifftshift(tile_unit_cell(np.fft.fftshift(U), self.unitcell_size))
+        
+        if return_unit :
+            return C, U
+        else :
+            return C
+
+class Space_group():
+    """
+    A general crystal symmetry operator, built from a list of 
+    symmetry operations in the crystal (fractional) basis, e.g.
+    for P212121:
+        ops = ['x,y,z', '-x+1/2,-y,z+1/2', '-x,y+1/2,-z+1/2', 'x+1/2,-y+1/2,-z']
+    
+    or from the name of one of the Sohncke groups in sohncke_generators:
+        sym_ops = Space_group(unitcell_size, det_shape, name = 'P43212')
+
+    Each operation r --> R r + t is compiled into a flat gather-index 
+    table (R permutes / flips the voxel grid) and the 1D factors of a 
+    translation ramp, so this has the same interface as P212121. 
+    
+    The voxel grid is assumed to be aligned with the crystal axes, so R
+    must map the grid onto itself (e.g. det_shape[0] == det_shape[1] 
+    for 3 and 4 fold axes along z). For the trigonal / hexagonal groups 
+    the grid is in the oblique crystal basis.
+    
+    Assume that Fourier space arrays are fft shifted.
+    """
+    def __init__(self, unitcell_size, det_shape, dtype=np.complex128, ops = None, name = None):
+        if ops is None :
+            if name not in sohncke_generators :
+                raise ValueError('unknown space group: ' + str(name))
+            ops = general_positions(*sohncke_generators[name])
+        
+        Rs, ts = [], []
+        for op in ops :
+            if isinstance(op, str) :
+                R, t = parse_sym_op(op)
+            else :
+                R, t = op
+            Rs.append(np.array(R, dtype=int))
+            ts.append(np.array([float(tt) for tt in t]))
+        
+        for R in Rs :
+            if abs(round(np.linalg.det(R))) != 1 :
+                raise ValueError('symmetry operations must have det(R) = +-1')
+        
+        self.name          = name
+        self.Rs            = Rs
+        self.ts            = ts
+        self.no_solid_units = len(Rs)
+        
+        # the Patterson symmetry: the point group plus inversion
+        self.Pat_sym_ops   = 2 * len(set([tuple(R.ravel()) for R in Rs]))
+        self.unitcell_size = unitcell_size
+        self.Cheshire_cell = (unitcell_size[0]//2, unitcell_size[1]//2,unitcell_size[2]//2)
+        self.det_shape     = det_shape
+        self.dtype         = dtype
+        
+        # only calculate the translations when they are needed
+        self.translations      = None
+        self.translations_conj = None
+        
+        # gather-index tables for the symmetry operations (see make_inds)
+        self.inds          = {}
+        
+        # the identity has no gather or translation
+        self.is_identity   = [np.all(R == np.eye(3, dtype=int)) and np.all(t == 0) for R, t in zip(Rs, ts)]
+
+    def make_Ts(self):
+        """
+        The 1D factors of the translation ramps in pixel units.
+        """
+        self.translations = []
+        for t in self.ts :
+            T = t * np.array(self.unitcell_size, dtype=float)
+            self.translations.append(T_fourier_1D(self.det_shape, T, dtype=self.dtype))
+        self.translations_conj = [[t.conj() for t in T] for T in self.translations]
+    
+    def make_inds(self, shape, kind = 'Fourier'):
+        """
+        Flat gather-index tables for the symmetry operations, so that:
+            syms[n].ravel() = solid.ravel()[inds[n]]
+        
+        kind = 'Fourier' : syms[n][q] = solid[R^T q] (the translations 
+                           are applied with the phase ramps)
+        kind = 'unflip'  : the inverse, U_inv[n][p] = U[n][R^-T p]
+        kind = 'real'    : syms[n][r] = solid[R^-1 (r - t)], where t 
+                           is rounded down to the nearest pixel
+        
+        The tables are cached for each shape.
+        """
+        key = (tuple(shape), kind)
+        if key in self.inds :
+            return self.inds[key]
+        
+        shape = np.array(shape)
+        r     = np.indices(tuple(shape)).reshape((3, -1))
+        inds  = np.empty((self.no_solid_units, r.shape[1]), dtype=np.intp)
+        for n, (R, t) in enumerate(zip(self.Rs, self.ts)):
+            Rinv = np.rint(np.linalg.inv(R)).astype(int)
+            if kind == 'Fourier' :
+                src = np.dot(R.T, r)
+            elif kind == 'unflip' :
+                src = np.dot(Rinv.T, r)
+            elif kind == 'real' :
+                T   = np.floor(t * np.array(self.unitcell_size)).astype(int)
+                src = np.dot(Rinv, r - T[:, None])
+            
+            src     = src % shape[:, None]
+            inds[n] = np.ravel_multi_index(src, tuple(shape))
+        
+        self.inds[key] = inds
+        return inds
+    
+    def solid_syms_Fourier(self, solid, apply_translation = True, syms = None):
+        """
+        Take the Fourier space solid unit then return each
+        of the symmetry related partners.
+        """
+        if syms is None :
+            syms = np.empty((self.no_solid_units,) + solid.shape, dtype=solid.dtype) # syms 
+        
+        inds  = self.make_inds(solid.shape)
+        solid = np.ascontiguousarray(solid).ravel()
+        s     = syms.reshape((self.no_solid_units, -1))
+        
+        for n in range(self.no_solid_units):
+            if self.is_identity[n] :
+                s[n] = solid
+            else :
+                np.take(solid, inds[n], out = s[n], mode = 'clip')
+        
+        if apply_translation :
+            if self.translations is None :
+                self.make_Ts()
+            
+            for n in range(self.no_solid_units):
+                if np.any(self.ts[n] != 0) :
+                    multiply_T_fourier(syms[n], self.translations[n], out = syms[n])
+        return syms
+
+    def solid_syms_Fourier_masked(self, solid, i, j, k, apply_translation = True, syms = None):
+        """
+        solid = full solid unit at the detector
+        syms  = masked syms  
+        """
+        if syms is None :
+            syms = np.empty((self.no_solid_units,) + i.shape, dtype=solid.dtype) # syms 
+        
+        q     = np.array([i, j, k]).reshape((3, -1))
+        shape = np.array(solid.shape)[:, None]
+        for n, R in enumerate(self.Rs):
+            src     = np.dot(R.T, q) % shape
+            syms[n] = solid[tuple(src)].reshape(i.shape)
         
-        # now translate the unit-cell by tiles in each dimension
-        C = U.copy()
+        if apply_translation :
+            if self.translations is None :
+                self.make_Ts()
+            
+            for n in range(self.no_solid_units):
+                Ti, Tj, Tk = self.translations[n]
+                syms[n] *= Ti[i] * Tj[j] * Tk[k]
+        
+        return syms
 
-        # temp array to speed up multiroll_nowrap
-        t = np.asarray(np.zeros_like(U))
+    def unflip_modes_Fourier(self, U, apply_translation=True, inplace = False):
+        if inplace :
+            U_inv = U
+        else :
+            U_inv = U.copy()
+        
+        # the gathers below need a flat view of each mode
+        U_inv = np.ascontiguousarray(U_inv)
+        
+        if apply_translation and self.translations is None :
+            self.make_Ts()
+        
+        inds = self.make_inds(U.shape[1:], kind = 'unflip')
+        
+        # scratch array for one mode
+        t = np.empty(U_inv.shape[1:], dtype=U_inv.dtype)
+        
+        for n in range(self.no_solid_units):
+            if self.is_identity[n] :
+                continue
+            
+            if apply_translation and np.any(self.ts[n] != 0) :
+                multiply_T_fourier(U_inv[n], self.translations_conj[n], out = t)
+            else :
+                t[:] = U_inv[n]
+            np.take(t.ravel(), inds[n], out = U_inv[n].reshape((-1,)), mode = 'clip')
         
-        for i in (np.arange(tiles[0]) - tiles[0]//2):
-            for j in (np.arange(tiles[1]) - tiles[1]//2):
-                for k in (np.arange(tiles[2]) - tiles[2]//2):
-                    if i == 0 and j == 0 and k == 0 :
-                        continue
-                    
-                    shift = np.array([i, j, k]) * np.array(self.unitcell_size)
-                    
-                    #print(i,j,k, shift, U.shape)
-                    #print(i,j,k, shift, index)
-                    C += multiroll_nowrap(U, shift, y = t)
+        return U_inv
+
+    def solid_syms_real(self, solid, syms=None):
+        """
+        This uses pixel shifts (not phase ramps) for translation.
+        Therefore sub-pixel shifts are ignored.
+        """
+        if syms is None :
+            syms = np.empty((self.no_solid_units,) + solid.shape, dtype=solid.dtype) # self.syms 
         
-        # re-fftshift them
-        C = np.fft.ifftshift(C)
+        inds  = self.make_inds(solid.shape, kind = 'real')
+        solid = np.ascontiguousarray(solid).ravel()
+        s     = syms.reshape((self.no_solid_units, -1))
+        
+        for n in range(self.no_solid_units):
+            np.take(solid, inds[n], out = s[n], mode = 'clip')
+        return syms
+    
+    def overlap_mask_real(self, solid, index = None):
+        """
+        Return the voxels of solid that are the maximum of their 
+        symmetry partners in the unit-cell, the same as:
+            syms = self.solid_syms_real(solid)
+            mask = syms[0] == np.max(syms, axis=0)
+        
+        but with a running maximum over the gathers of make_inds.
+
+        If index (flat indices into solid) is not None then only
+        the mask at those voxels is returned (as a 1D array).
+        """
+        shape = solid.shape
+        inds  = self.make_inds(shape, kind = 'real')
+        solid = np.ascontiguousarray(solid).ravel()
+        
+        if index is not None :
+            syms = (solid[inds[n][index]] for n in range(self.no_solid_units))
+            s0   = next(syms)
+            m    = s0.copy()
+            for t in syms :
+                np.maximum(m, t, out = m)
+            return s0 == m
+        
+        if self.is_identity[0] :
+            s0 = solid
+        else :
+            s0 = np.take(solid, inds[0], mode = 'clip')
+        m = s0.copy()
+        t = np.empty_like(solid)
+        
+        for n in range(1, self.no_solid_units):
+            if self.is_identity[n] :
+                np.maximum(m, solid, out = m)
+            else :
+                np.take(solid, inds[n], out = t, mode = 'clip')
+                np.maximum(m, t, out = m)
+        return (s0 == m).reshape(shape)
+
+    def solid_to_crystal_real(self, solid, return_unit=False):
+        """
+        Generate the symmetry related copies of the real-space solid unit
+        in the crystal. This includes all symmetry related coppies of the 
+        solid unit that fit within the field-of-view (not just the unit-cell
+        as in solid_syms_real).
+
+        The unit-cell is accumulated with one gather per symmetry partner 
+        (see make_inds) and tiled over the field-of-view with tile_unit_cell.
+        """
+        shape = solid.shape
+        inds  = self.make_inds(shape, kind = 'real')
+        s     = np.ascontiguousarray(solid).ravel()
+        
+        # sum the symmetry related coppies of solid in the unit-cell
+        U = np.zeros_like(s)
+        for n in range(self.no_solid_units):
+            U += s[inds[n]]
+        U = U.reshape(shape)
+        
+        C = np.fft.ifftshift(tile_unit_cell(np.fft.fftshift(U), self.unitcell_size))
         
         if return_unit :
-            return C, np.fft.ifftshift(U)
+            return C, U
         else :
             return C
 
-def test_P212121():
-    # make a unit cell
-    unit_cell_size = tuple([8,8,4])
-    solid_shape    = tuple([4,4,2])
-    
-    i = np.fft.fftfreq(unit_cell_size[0],1./float(unit_cell_size[0])).astype(np.int)
-    j = np.fft.fftfreq(unit_cell_size[1],1./float(unit_cell_size[1])).astype(np.int)
-    k = np.fft.fftfreq(unit_cell_size[2],1./float(unit_cell_size[2])).astype(np.int)
-    i, j, k = np.meshgrid(i, j, k, indexing='ij')
-    
-    solid = np.random.random(solid_shape)
-    Solid = np.fft.fftn(solid, unit_cell_size)
-    solid = np.fft.ifftn(Solid)
-
-    sym_ops   = P212121(unit_cell_size, unit_cell_size)
-    unit_cell = sym_ops.solid_syms_Fourier(Solid)
-    unit_cell = np.sum(unit_cell, axis=0)
-    unit_cell = np.fft.ifftn(unit_cell)
-    """
-    # manual test :
-    unit_cell_size = tuple([8,8,4])
-    solid_shape    = tuple([4,4,2])
-    
-    solid = np.zeros(solid_shape)
-    solid[1,2,1] = 1.
-
-    # should become
-    unit_cell = np.zeros_like(solid)
-    unit_cell[1,2,1]   = 1.
-    unit_cell[-3,2,-1] = 1.
-    unit_cell[-1,-2,1] = 1.
-    unit_cell[3,-2,-1] = 1.
-    """
-
-    # test symmetries
-    u2 = np.array(unit_cell_size) // 2
-    i1 = i
-    j1 = j
-    k1 = k
-    print('r1 = x, y, z             :', \
-            np.allclose(unit_cell[i,j,k], unit_cell[i1,j1,k1]))
-
-    i2 =  ((i + u2[0] + u2[0]) % unit_cell_size[0]) - u2[0]
-    j2 = ((-j + u2[1] + u2[1]) % unit_cell_size[1]) - u2[1] 
-    k2 = -k
-    print('r2 = 1/2 + x, 1/2 - y, -z:', \
-            np.allclose(unit_cell[i,j,k], unit_cell[i2,j2,k2]))
-
-    i3 =  -i
-    j3 = ((j + u2[1] + u2[1]) % unit_cell_size[1]) - u2[1] 
-    k3 = ((-k + u2[2] + u2[2]) % unit_cell_size[2]) - u2[2] 
-    print('r3 = -x, 1/2 + y, 1/2 - z:', \
-            np.allclose(unit_cell[i,j,k], unit_cell[i3,j3,k3]))
-
-    i4 = ((-i + u2[0] + u2[0]) % unit_cell_size[0]) - u2[0] 
-    j4 = -j
-    k4 = ((k + u2[2] + u2[2]) % unit_cell_size[2]) - u2[2] 
-    print('r3 = 1/2 - x, -y, 1/2 + z:', \
-            np.allclose(unit_cell[i,j,k], unit_cell[i4,j4,k4]))
-
-def T_fourier(shape, T, is_fft_shifted = True):
+def parse_sym_op(op):
     """
-    e - 2pi i r q
-    e - 2pi i dx n m / N dx
-    e - 2pi i n m / N 
+    Parse a symmetry operation like '-x+1/2,y-z,-z+3/4' 
+    into (R, t) where r --> R r + t, R is a 3x3 integer 
+    matrix and t is a list of 3 fractions.Fraction's.
+    """
+    R = np.zeros((3, 3), dtype=int)
+    t = [Fraction(0), Fraction(0), Fraction(0)]
+    parts = op.replace(' ', '').lower().split(',')
+    if len(parts) != 3 :
+        raise ValueError('could not parse symmetry operation: ' + op)
+    
+    for d, part in enumerate(parts):
+        terms = re.findall(r'([+-]?)([xyz]|\d+/\d+|\d*\.?\d+)', part)
+        if ''.join(s + v for s, v in terms) != part :
+            raise ValueError('could not parse symmetry operation: ' + op)
+        
+        for sign, v in terms :
+            sign = -1 if sign == '-' else 1
+            if v in 'xyz' :
+                R[d, 'xyz'.index(v)] += sign
+            else :
+                t[d] += sign * Fraction(v)
+    return R, t
+
+def general_positions(generators, centring = ()):
+    """
+    Generate all of the symmetry operations (R, t) of a space group,
+    within one unit-cell, from a list of generators and centring 
+    translations, e.g. for C2:
+        general_positions(['-x,y,-z'], ['1/2,1/2,0'])
+    
+    The translations are reduced to [0, 1). The identity is first.
+    """
+    def key(R, t):
+        return (tuple(R.ravel()), tuple(tt % 1 for tt in t))
+    
+    def mul(a, b):
+        R = np.dot(a[0], b[0])
+        t = [sum(a[0][i, j] * b[1][j] for j in range(3)) + a[1][i] for i in range(3)]
+        return R, [tt % 1 for tt in t]
+    
+    gens = [parse_sym_op(g) for g in generators]
+    for c in centring :
+        c = [Fraction(tt) for tt in c.split(',')]
+        gens.append((np.eye(3, dtype=int), c))
+    
+    e   = (np.eye(3, dtype=int), [Fraction(0)]*3)
+    ops = {key(*e) : e}
+    new = [e]
+    while len(new) > 0 :
+        added = []
+        for a in new :
+            for g in gens :
+                b = mul(g, a)
+                if key(*b) not in ops :
+                    ops[key(*b)] = b
+                    added.append(b)
+        new = added
+    
+    ops = list(ops.values())
+    ops.sort(key = lambda o : (not np.all(o[0] == np.eye(3)) or any(o[1]), ))
+    return ops
+
+# generators and centring translations for the 65 space groups that 
+# contain no inversion or mirror operations (standard settings, 
+# hexagonal axes for the trigonal groups, origin choice 1 for F4132)
+sohncke_generators = {
+    # triclinic
+    'P1'      : ([], []),
+    # monoclinic (unique axis b)
+    'P2'      : (['-x,y,-z'], []),
+    'P21'     : (['-x,y+1/2,-z'], []),
+    'C2'      : (['-x,y,-z'], ['1/2,1/2,0']),
+    # orthorhombic
+    'P222'    : (['-x,-y,z', '-x,y,-z'], []),
+    'P2221'   : (['-x,-y,z+1/2', '-x,y,-z+1/2'], []),
+    'P21212'  : (['-x,-y,z', '-x+1/2,y+1/2,-z'], []),
+    'P212121' : (['-x+1/2,-y,z+1/2', '-x,y+1/2,-z+1/2'], []),
+    'C2221'   : (['-x,-y,z+1/2', '-x,y,-z+1/2'], ['1/2,1/2,0']),
+    'C222'    : (['-x,-y,z', '-x,y,-z'], ['1/2,1/2,0']),
+    'F222'    : (['-x,-y,z', '-x,y,-z'], ['0,1/2,1/2', '1/2,0,1/2']),
+    'I222'    : (['-x,-y,z', '-x,y,-z'], ['1/2,1/2,1/2']),
+    'I212121' : (['-x+1/2,-y,z+1/2', '-x,y+1/2,-z+1/2'], ['1/2,1/2,1/2']),
+    # tetragonal
+    'P4'      : (['-y,x,z'], []),
+    'P41'     : (['-y,x,z+1/4'], []),
+    'P42'     : (['-y,x,z+1/2'], []),
+    'P43'     : (['-y,x,z+3/4'], []),
+    'I4'      : (['-y,x,z'], ['1/2,1/2,1/2']),
+    'I41'     : (['-y,x+1/2,z+1/4'], ['1/2,1/2,1/2']),
+    'P422'    : (['-y,x,z', '-x,y,-z'], []),
+    'P4212'   : (['-y+1/2,x+1/2,z', '-x+1/2,y+1/2,-z'], []),
+    'P4122'   : (['-y,x,z+1/4', '-x,y,-z'], []),
+    'P41212'  : (['-y+1/2,x+1/2,z+1/4', '-x+1/2,y+1/2,-z+1/4'], []),
+    'P4222'   : (['-y,x,z+1/2', '-x,y,-z'], []),
+    'P42212'  : (['-y+1/2,x+1/2,z+1/2', '-x+1/2,y+1/2,-z+1/2'], []),
+    'P4322'   : (['-y,x,z+3/4', '-x,y,-z'], []),
+    'P43212'  : (['-y+1/2,x+1/2,z+3/4', '-x+1/2,y+1/2,-z+3/4'], []),
+    'I422'    : (['-y,x,z', '-x,y,-z'], ['1/2,1/2,1/2']),
+    'I4122'   : (['-y,x+1/2,z+1/4', '-x+1/2,y,-z+3/4'], ['1/2,1/2,1/2']),
+    # trigonal
+    'P3'      : (['-y,x-y,z'], []),
+    'P31'     : (['-y,x-y,z+1/3'], []),
+    'P32'     : (['-y,x-y,z+2/3'], []),
+    'R3'      : (['-y,x-y,z'], ['2/3,1/3,1/3']),
+    'P312'    : (['-y,x-y,z', '-y,-x,-z'], []),
+    'P321'    : (['-y,x-y,z', 'y,x,-z'], []),
+    'P3112'   : (['-y,x-y,z+1/3', '-y,-x,-z+2/3'], []),
+    'P3121'   : (['-y,x-y,z+1/3', 'y,x,-z'], []),
+    'P3212'   : (['-y,x-y,z+2/3', '-y,-x,-z+1/3'], []),
+    'P3221'   : (['-y,x-y,z+2/3', 'y,x,-z'], []),
+    'R32'     : (['-y,x-y,z', 'y,x,-z'], ['2/3,1/3,1/3']),
+    # hexagonal
+    'P6'      : (['x-y,x,z'], []),
+    'P61'     : (['x-y,x,z+1/6'], []),
+    'P65'     : (['x-y,x,z+5/6'], []),
+    'P62'     : (['x-y,x,z+1/3'], []),
+    'P64'     : (['x-y,x,z+2/3'], []),
+    'P63'     : (['x-y,x,z+1/2'], []),
+    'P622'    : (['x-y,x,z', 'y,x,-z'], []),
+    'P6122'   : (['x-y,x,z+1/6', 'y,x,-z+1/3'], []),
+    'P6522'   : (['x-y,x,z+5/6', 'y,x,-z+2/3'], []),
+    'P6222'   : (['x-y,x,z+1/3', 'y,x,-z+2/3'], []),
+    'P6422'   : (['x-y,x,z+2/3', 'y,x,-z+1/3'], []),
+    'P6322'   : (['x-y,x,z+1/2', 'y,x,-z'], []),
+    # cubic
+    'P23'     : (['-x,-y,z', '-x,y,-z', 'z,x,y'], []),
+    'F23'     : (['-x,-y,z', '-x,y,-z', 'z,x,y'], ['0,1/2,1/2', '1/2,0,1/2']),
+    'I23'     : (['-x,-y,z', '-x,y,-z', 'z,x,y'], ['1/2,1/2,1/2']),
+    'P213'    : (['-x+1/2,-y,z+1/2', '-x,y+1/2,-z+1/2', 'z,x,y'], []),
+    'I213'    : (['-x+1/2,-y,z+1/2', '-x,y+1/2,-z+1/2', 'z,x,y'], ['1/2,1/2,1/2']),
+    'P432'    : (['-x,-y,z', '-x,y,-z', 'z,x,y', 'y,x,-z'], []),
+    'P4232'   : (['-x,-y,z', '-x,y,-z', 'z,x,y', 'y+1/2,x+1/2,-z+1/2'], []),
+    'F432'    : (['-x,-y,z', '-x,y,-z', 'z,x,y', 'y,x,-z'], ['0,1/2,1/2', '1/2,0,1/2']),
+    'F4132'   : (['-x,-y+1/2,z+1/2', '-x+1/2,y+1/2,-z', 'z,x,y', 'y+3/4,x+1/4,-z+3/4'], ['0,1/2,1/2', '1/2,0,1/2']),
+    'I432'    : (['-x,-y,z', '-x,y,-z', 'z,x,y', 'y,x,-z'], ['1/2,1/2,1/2']),
+    'P4332'   : (['-x+1/2,-y,z+1/2', '-x,y+1/2,-z+1/2', 'z,x,y', 'y+1/4,x+3/4,-z+3/4'], []),
+    'P4132'   : (['-x+1/2,-y,z+1/2', '-x,y+1/2,-z+1/2', 'z,x,y', 'y+3/4,x+1/4,-z+1/4'], []),
+    'I4132'   : (['-x+1/2,-y,z+1/2', '-x,y+1/2,-z+1/2', 'z,x,y', 'y+3/4,x+1/4,-z+1/4'], ['1/2,1/2,1/2']),
+    }
+
+def get_sym_ops(space_group, unit_cell, det_shape, dtype=np.complex128):
+    """
+    The symmetry operator for space_group, one of 'P1', 'P212121', 'Ptest'
+    or the keys of sohncke_generators (raises a ValueError otherwise).
+    """
+    if space_group == 'P1':
+        print('\ncrystal space group: P1')
+        sym_ops = \
+            P1(unit_cell, det_shape, dtype)
+
+    elif space_group == 'P212121':
+        print('\ncrystal space group: P212121')
+        sym_ops = \
+            P212121(unit_cell, det_shape, dtype)
+    
+    elif space_group == 'Ptest':
+        print('\ncrystal space group: Ptest')
+        sym_ops = \
+            Ptest(unit_cell, det_shape, dtype)
+    
+    elif space_group in sohncke_generators :
+        print('\ncrystal space group:', space_group)
+        sym_ops = \
+            Space_group(unit_cell, det_shape, dtype, name = space_group)
+    
+    else :
+        raise ValueError('unknown space group: ' + str(space_group))
+
+    return sym_ops
+
+def T_fourier_1D(shape, T, dtype=np.complex128):
+    """
+    The 1D factors of the phase ramp in T_fourier:
+        T_fourier(shape, T) = reduce(np.multiply.outer, T_fourier_1D(shape, T))
+    
+    the 1D ramps are evaluated in double precision then 
+    cast to dtype.
     """
     # make i, j, k for each pixel
     if T[0] != 0 :
@@ -561,13 +990,46 @@ def T_fourier(shape, T, is_fft_shifted = True):
     else :
         k = np.ones((shape[2],), dtype=np.float)
     
-    phase_ramp = reduce(np.multiply.outer, [i, j, k])
+    i = i.astype(dtype)
+    j = j.astype(dtype)
+    k = k.astype(dtype)
+    return [i, j, k]
+
+def T_fourier(shape, T, is_fft_shifted = True, dtype=np.complex128):
+    """
+    e - 2pi i r q
+    e - 2pi i dx n m / N dx
+    e - 2pi i n m / N 
+
+    the 1D ramps are evaluated in double precision then 
+    the returned phase_ramp is cast to dtype.
+    """
+    phase_ramp = reduce(np.multiply.outer, T_fourier_1D(shape, T, dtype))
     
     if is_fft_shifted is False :
         phase_ramp = np.fft.ifftshift(phase_ramp)
            
     return phase_ramp
 
+def multiply_T_fourier(a, T, out = None):
+    """
+    out = a * reduce(np.multiply.outer, T) 
+    
+    where T = [i, j, k] are the 1D factors of a phase ramp 
+    (see T_fourier_1D). The ramp is evaluated one plane at a 
+    time so the full volume is never stored and a is only 
+    read once. out may be a itself.
+    """
+    i, j, k = T
+    if out is None :
+        out = np.empty(a.shape, dtype=np.result_type(a, k))
+    
+    plane = np.empty(a.shape[1:], dtype=np.result_type(j, k))
+    for x in range(a.shape[0]):
+        np.multiply.outer(i[x] * j, k, out = plane)
+        np.multiply(a[x], plane, out = out[x])
+    return out
+
 def solid_syms(solid_unit, unitcell_size, det_shape):
     """
     Take the solid unit and map it 
@@ -726,6 +1188,60 @@ def multiroll(x, shift, axis=None):
 
     return y
 
+def tile_unit_cell(U, unitcell_size, tiles = None):
+    """
+    Translate the (fftshifted) unit-cell U by the lattice vectors in 
+    the field-of-view and add them, without wrapping. The same as:
+        C = 0
+        for i, j, k in the tiles :
+            C += multiroll_nowrap(U, [i, j, k] * unitcell_size)
+    
+    but the translations along each axis are separable, so this is 
+    done one axis at a time with tiles[d] slice additions (rather 
+    than prod(tiles) translations of the whole array).
+
+    Parameters
+    ----------
+    U : numpy.ndarray
+        The unit-cell (or any array) centred in the field-of-view.
+
+    unitcell_size : sequence of int
+        The lattice spacing along each axis in pixels.
+
+    Keyword Arguments
+    -----------------
+    tiles : sequence of int, optional, default (None)
+        The number of lattice points along each axis, centred on 0. 
+        If None then ceil(2 U.shape / unitcell_size - 1) so that the 
+        tiles fill the field-of-view.
+
+    Returns
+    -------
+    C : numpy.ndarray
+        The tiled array with the same shape and dtype as U.
+    """
+    if tiles is None :
+        tiles = np.ceil(2*np.array(U.shape, dtype=np.float) / np.array(unitcell_size, dtype=np.float) - 1.0).astype(np.int)
+    
+    C = U
+    for d in range(U.ndim):
+        n   = U.shape[d]
+        out = np.zeros_like(U)
+        for i in (np.arange(tiles[d]) - tiles[d]//2):
+            shift = i * unitcell_size[d]
+            if abs(shift) >= n :
+                continue
+            
+            src = [slice(None)] * U.ndim
+            dst = [slice(None)] * U.ndim
+            if shift < 0 :
+                src[d], dst[d] = slice(-shift, n), slice(0, n+shift)
+            else :
+                src[d], dst[d] = slice(0, n-shift), slice(shift, n)
+            out[tuple(dst)] += C[tuple(src)]
+        C = out
+    return C
+
 def multiroll_nowrap(x, shift, axis=None, y = None):
     """Roll an array along each axis.
 
@@ -904,6 +1420,75 @@ def lattice_old_new(unit_cell_size, shape):
     return lattice
 
 
+def make_lattice_1D(u_pix, shape, N = None):
+    """
+    The 1D factors of the finite lattice function in q-space 
+    (see make_lattice), such that:
+        lattice = l[0][:, None, None] * l[1][None, :, None] * l[2][None, None, :]
+    
+    Each factor is the closed form of |sum_k=1^N-1 exp(2 pi i k u q)|^2
+    (a Dirichlet kernel):
+        sin^2(pi (N-1) u q) / sin^2(pi u q)
+    
+    where u q = u m / n (for the m'th pixel along an axis of length n) 
+    is reduced modulo 1 before evaluation, so that the Bragg peaks 
+    (u m / n = integer) are exactly (N-1)^2.
+
+    Parameters
+    ----------
+    u_pix : sequence of int
+        The shape of the unit-cell in pixels, e.g. (8, 16, 12)
+    
+    shape : sequence of int
+        The shape of the volume, e.g. (128, 64, 32)
+
+    Keyword Arguments
+    -----------------
+    N : int, optional, default (None)
+        The number of unit-cell's along each axis e.g. 100, if None then
+        N = 1000 as in make_lattice.
+
+    Returns
+    -------
+    l : list of numpy.ndarray, float64
+        The lattice factor along each axis (in the np.fft.fftfreq basis)
+    """
+    if N is None :
+        N = 1000
+    
+    l = []
+    for u, n in zip(u_pix, shape):
+        m = np.rint(np.fft.fftfreq(n) * n)
+        r = np.mod(u * m, n)
+        x = np.pi * r / n
+        
+        peak = (r == 0)
+        d    = np.where(peak, 1., np.sin(x))
+        l.append(np.where(peak, float(N-1)**2, (np.sin((N-1) * x) / d)**2))
+    return l
+
+def lattice_bragg_peaks(u_pix, shape, N = 1000):
+    """
+    Return the pixel indices (i, j, k) of the infinite lattice function,
+    (make_lattice(u_pix, shape) > 0) without evaluating the full volume.
+
+    The infinite lattice is the finite lattice with N unit-cells 
+    thresholded at half of its maximum value. The 1D factors are less 
+    than or equal to their maximum, so only pixels with each factor 
+    above half of its maximum can pass, and the threshold is only 
+    tested for these.
+    """
+    l = make_lattice_1D(u_pix, shape, N)
+    l = [t / t.max() if t.max() > 0 else t for t in l]
+    
+    # candidates along each axis
+    c = [np.flatnonzero(t > 0.5) for t in l]
+    
+    p = reduce(np.multiply.outer, [t[i] for t, i in zip(l, c)])
+    
+    i, j, k = np.nonzero(p > 0.5)
+    return c[0][i], c[1][j], c[2][k]
+
 def make_lattice(u_pix, shape, N = None):
     """
     make a finite lattice function in q-space
@@ -912,29 +1497,17 @@ def make_lattice(u_pix, shape, N = None):
     N     = number of unit cell's along each axis e.g. 100
 
     if N is None then assume an infinite lattice
+
+    The lattice is the outer product of the closed form 1D factors 
+    (see make_lattice_1D), for an infinite lattice only the Bragg 
+    peaks are set (see lattice_bragg_peaks).
     """
-    l          = np.zeros(shape, dtype=np.complex64)
-    q0         = np.fft.fftfreq(shape[0]).astype(np.float32)
-    q1         = np.fft.fftfreq(shape[1]).astype(np.float32)
-    q2         = np.fft.fftfreq(shape[2]).astype(np.float32)
-    
-    l0 = np.zeros(shape[0], dtype=np.complex64)
-    l1 = np.zeros(shape[1], dtype=np.complex64)
-    l2 = np.zeros(shape[2], dtype=np.complex64)
     if N is None :
-        N = 1000
-        infinite = True
-    else :
-        infinite = False
+        l = np.zeros(shape, dtype=np.float32)
+        l[lattice_bragg_peaks(u_pix, shape)] = 1.
+        return l
     
-    for k in range(1, N):
-        a   = k * np.array(u_pix)
-        l0 += np.exp(2.0J * np.pi * a[0] * q0)
-        l1 += np.exp(2.0J * np.pi * a[1] * q1)
-        l2 += np.exp(2.0J * np.pi * a[2] * q2)
-
+    l0, l1, l2 = [t.astype(np.float32) for t in make_lattice_1D(u_pix, shape, N)]
     l = np.multiply.outer(l0, l1)
-    l = np.abs(np.multiply.outer(l, l2))**2
-    if infinite :
-        l = (l > 0.5 * l.max()).astype(np.float32)
-    return l 
+    l = np.multiply.outer(l, l2)
+    return l